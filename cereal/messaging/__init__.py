@@ -7,14 +7,17 @@ from msgq import fake_event_handle, pub_sock, sub_sock, drain_sock_raw, context
 import os
 import capnp
 import time
+import numpy as np
 
-from typing import Optional, List, Union, Dict, Deque
+from typing import Optional, List, Union, Dict, Deque, Tuple
 from collections import deque
 
 from cereal import log
 from cereal.services import SERVICE_LIST
 
 NO_TRAVERSAL_LIMIT = 2**64-1
+# capnp's default size of the first segment of a new message
+FIRST_SEGMENT_WORDS = 1024
 
 
 def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
@@ -88,9 +91,15 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
 
 
 class SubMaster:
+  """Keeps the latest message of each service, with alive, frequency and valid checks.
+
+  With lazy=True, services are only decoded when they are read with sm[s], so sm.data can be behind. The frequency
+  statistics of all services are kept in arrays, and the checks are computed once per update, or again when the ignore
+  lists are changed. Changing the alive, freq_ok and valid dicts doesn't change what all_checks returns."""
   def __init__(self, services: List[str], poll: Optional[str] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
-               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None):
+               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None,
+               lazy: bool = False):
     self.frame = -1
     self.seen = {s: False for s in services}
     self.updated = {s: False for s in services}
@@ -150,7 +159,43 @@ class SubMaster:
       self.min_freq[s] = min_freq*0.8
       self.recv_dts[s] = deque(maxlen=int(10*freq))
 
+    self.lazy = lazy
+    if lazy:
+      self._init_arrays(services)
+
+  def _init_arrays(self, services: List[str]) -> None:
+    self.services = list(services)
+    self.service_idxs = {s: i for i, s in enumerate(self.services)}
+    # received messages that weren't read yet
+    self.undecoded: Dict[str, capnp.lib.capnp._DynamicStructReader] = {}
+
+    n = len(self.services)
+    self.service_freqs = np.array([SERVICE_LIST[s].frequency for s in self.services])
+    self.alive_dts = np.array([10. / f if f > 1e-5 else np.inf for f in self.service_freqs])
+    self.max_freqs = np.array([self.max_freq[s] for s in self.services])
+    self.min_freqs = np.array([self.min_freq[s] for s in self.services])
+    self.seen_arr = np.zeros(n, dtype=bool)
+    self.valid_arr = np.ones(n, dtype=bool)
+    self.recv_times = np.zeros(n)
+
+    # a ring buffer of the time between messages for each service, with running sums over
+    # the whole buffer and over the most recent tenth of it. freq_ok only changes when a service is received
+    self.dts_len = [self.recv_dts[s].maxlen for s in self.services]
+    self.recent_dts_len = [dts_len // 10 for dts_len in self.dts_len]
+    self.dts = np.zeros((n, max(self.dts_len, default=0)))
+    self.dts_cnt = [0] * n
+    self.dts_sum = [0.] * n
+    self.recent_dts_sum = [0.] * n
+    self.freq_ok_arr = self.service_freqs <= 1e-5
+
+    self.alive_arr = np.zeros(n, dtype=bool)
+    self.freq_ok_last = self.freq_ok_arr.copy()
+    self.ignore_lists: Optional[Tuple[Tuple[str, ...], ...]] = None
+    self._update_checks()
+
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if self.lazy and s in self.undecoded:
+      self.data[s] = getattr(self.undecoded.pop(s), s)
     return self.data[s]
 
   def _check_avg_freq(self, s: str) -> bool:
@@ -167,6 +212,10 @@ class SubMaster:
     self.update_msgs(time.monotonic(), msgs)
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+    if self.lazy:
+      self._update_msgs_lazy(cur_time, msgs)
+      return
+
     self.frame += 1
     self.updated = dict.fromkeys(self.updated, False)
     for msg in msgs:
@@ -211,6 +260,84 @@ class SubMaster:
         else:
           self.alive[s] = True
 
+  def _update_freq(self, i: int, dt: float) -> None:
+    cnt, dts_len, recent_dts_len = self.dts_cnt[i], self.dts_len[i], self.recent_dts_len[i]
+    dts = self.dts[i]
+    pos = cnt % dts_len
+    if cnt >= dts_len:
+      self.dts_sum[i] -= dts[pos]
+    if cnt >= recent_dts_len:
+      self.recent_dts_sum[i] -= dts[(pos - recent_dts_len) % dts_len]
+    dts[pos] = dt
+    self.dts_sum[i] += dt
+    self.recent_dts_sum[i] += dt
+    self.dts_cnt[i] = cnt = cnt + 1
+
+    # sum again every time the buffer wraps around, so the running sums don't drift
+    if pos == dts_len - 1:
+      self.dts_sum[i] = float(dts[:dts_len].sum())
+      self.recent_dts_sum[i] = float(dts[dts_len - recent_dts_len:dts_len].sum())
+
+    # check average frequency; slow to fall, quick to recover. no frequency if the dts add up to 0
+    avg_freq, avg_freq_recent = 0., 0.
+    if self.dts_sum[i] > 1e-9 and self.recent_dts_sum[i] > 1e-9:
+      avg_freq = min(cnt, dts_len) / self.dts_sum[i]
+      avg_freq_recent = min(cnt, recent_dts_len) / self.recent_dts_sum[i]
+    min_freq, max_freq = self.min_freqs[i], self.max_freqs[i]
+    self.freq_ok_arr[i] = self.service_freqs[i] <= 1e-5 or min_freq <= avg_freq <= max_freq or min_freq <= avg_freq_recent <= max_freq
+
+  def _update_msgs_lazy(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+    self.frame += 1
+    self.updated = dict.fromkeys(self.updated, False)
+    for msg in msgs:
+      if msg is None:
+        continue
+
+      s = msg.which()
+      i = self.service_idxs[s]
+      self.seen[s] = True
+      self.updated[s] = True
+
+      if self.recv_time[s] > 1e-5:
+        self._update_freq(i, cur_time - self.recv_time[s])
+      self.recv_time[s] = cur_time
+      self.recv_times[i] = cur_time
+      self.recv_frame[s] = self.frame
+      self.undecoded[s] = msg
+      self.logMonoTime[s] = msg.logMonoTime
+      self.valid[s] = msg.valid
+      self.seen_arr[i] = True
+      self.valid_arr[i] = self.valid[s]
+
+    if self.simulation:
+      # alive is defined as seen when simulation flag set
+      alive = self.seen_arr
+      freq_ok = np.ones(len(self.services), dtype=bool)
+    else:
+      # alive if delay is within 10x the expected frequency
+      alive = (cur_time - self.recv_times) < self.alive_dts
+      freq_ok = self.freq_ok_arr
+    self.alive = dict(zip(self.services, alive.tolist(), strict=True))
+    self.freq_ok = dict(zip(self.services, freq_ok.tolist(), strict=True))
+    self.alive_arr = alive.copy()
+    self.freq_ok_last = freq_ok.copy()
+    self._update_checks()
+
+  def _update_checks(self) -> None:
+    # the checks of every service for all_checks, from the results of the last update
+    ignore_lists = self._get_ignore_lists()
+    if ignore_lists != self.ignore_lists:
+      self.ignore_lists = ignore_lists
+      self.ignore_alive_mask = np.array([s in self.ignore_alive for s in self.services], dtype=bool)
+      self.ignore_freq_mask = np.array([not self._check_avg_freq(s) for s in self.services], dtype=bool)
+      self.ignore_valid_mask = np.array([s in self.ignore_valid for s in self.services], dtype=bool)
+    checks_ok = (self.alive_arr | self.ignore_alive_mask) & (self.freq_ok_last | self.ignore_freq_mask) & (self.valid_arr | self.ignore_valid_mask)
+    self.checks_ok = dict(zip(self.services, checks_ok.tolist(), strict=True))
+    self.all_checks_ok = bool(checks_ok.all())
+
+  def _get_ignore_lists(self) -> Tuple[Tuple[str, ...], ...]:
+    return tuple(self.ignore_alive), tuple(self.ignore_average_freq), tuple(self.ignore_valid)
+
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     if service_list is None:
       service_list = list(self.sock.keys())
@@ -227,6 +354,13 @@ class SubMaster:
     return all(self.valid[s] for s in service_list if s not in self.ignore_valid)
 
   def all_checks(self, service_list: Optional[List[str]] = None) -> bool:
+    if self.lazy:
+      # the ignore lists can be changed between updates, like controlsd does after its first update
+      if self._get_ignore_lists() != self.ignore_lists:
+        self._update_checks()
+      if service_list is None:
+        return self.all_checks_ok
+      return all(self.checks_ok[s] for s in service_list)
     return self.all_alive(service_list) and self.all_freq_ok(service_list) and self.all_valid(service_list)
 
 
@@ -236,9 +370,28 @@ class PubMaster:
     for s in services:
       self.sock[s] = pub_sock(s)
 
+    # new messages are copied from a template of each service, with the
+    # first segment big enough for the largest message sent on the service
+    self.templates: Dict[Tuple[str, Optional[int]], capnp.lib.capnp._DynamicStructBuilder] = {}
+    self.first_segment_words = dict.fromkeys(services, FIRST_SEGMENT_WORDS)
+
+  def new_message(self, s: str, size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+    """Same as new_message, for the services of this PubMaster"""
+    template = self.templates.get((s, size))
+    if template is None:
+      template = self.templates[(s, size)] = new_message(s, size)
+
+    dat = template.copy(num_first_segment_words=self.first_segment_words[s])
+    dat.logMonoTime = int(time.monotonic() * 1e9)
+    for k, v in kwargs.items():
+      setattr(dat, k, v)
+    return dat
+
   def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
     if not isinstance(dat, bytes):
       dat = dat.to_bytes()
+    if len(dat) // 8 > self.first_segment_words[s]:
+      self.first_segment_words[s] = len(dat) // 8
     self.sock[s].send(dat)
 
   def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
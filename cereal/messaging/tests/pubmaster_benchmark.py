@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import os
+import time
+import capnp
+import numpy as np
+
+import cereal.messaging as messaging
+
+N = int(os.getenv("N", "5000"))
+NUM_TRACKS = 16
+
+
+def fill(msg: capnp._DynamicStructBuilder) -> None:
+  # roughly what card and radard publish every cycle
+  msg.valid = True
+  if msg.which() == 'carState':
+    cs = msg.carState
+    cs.vEgo, cs.aEgo, cs.steeringAngleDeg, cs.gas = 20., 0.5, -3., 0.1
+    cs.cruiseState.enabled, cs.cruiseState.speed = True, 25.
+    cs.init('buttonEvents', 2)
+  elif msg.which() == 'liveTracks':
+    tracks = msg.init('liveTracks', NUM_TRACKS)
+    for i, track in enumerate(tracks):
+      track.trackId, track.dRel, track.yRel, track.vRel = i, 10. * i, 0.5, -1.
+
+
+def benchmark(new_messages: dict, service: str, size: int | None) -> dict[str, tuple[np.ndarray, np.ndarray, int]]:
+  # the ways of making messages take turns, so they see the same load
+  new_times: dict[str, list[float]] = {name: [] for name in new_messages}
+  publish_times: dict[str, list[float]] = {name: [] for name in new_messages}
+  num_segments = dict.fromkeys(new_messages, 0)
+  for _ in range(N):
+    for name, new_message in new_messages.items():
+      t1 = time.perf_counter()
+      msg = new_message(service, size)
+      t2 = time.perf_counter()
+      fill(msg)
+      dat = msg.to_bytes()
+      t3 = time.perf_counter()
+      new_times[name].append(t2 - t1)
+      publish_times[name].append(t3 - t1)
+      num_segments[name] += int.from_bytes(dat[:4], 'little') + 1
+  return {name: (np.array(new_times[name]) * 1e6, np.array(publish_times[name]) * 1e6, num_segments[name]) for name in new_messages}
+
+
+if __name__ == "__main__":
+  pm = messaging.PubMaster(['carState', 'liveTracks'])
+  # one send to size the first segment of liveTracks
+  msg = pm.new_message('liveTracks', 0)
+  fill(msg)
+  pm.send('liveTracks', msg)
+
+  for service, size in (('carState', None), ('liveTracks', 0)):
+    print(f"{service}, {N} messages")
+    results = benchmark({"messaging.new_message": messaging.new_message, "pm.new_message": pm.new_message}, service, size)
+    for name, (new_times, publish_times, num_segments) in results.items():
+      print(f"\t{name:22s} new avg: {np.mean(new_times):0.2f}us, new, fill and serialize avg: {np.mean(publish_times):0.2f}us, " +
+            f"p50: {np.percentile(publish_times, 50):0.2f}us, segments per message: {num_segments / N:.2f}")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import os
+import time
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
+
+N = int(os.getenv("N", "3000"))
+FREQUENCY = 100.
+# the services of controlsd
+SERVICES = ['deviceState', 'pandaStates', 'peripheralState', 'modelV2', 'liveCalibration', 'carOutput', 'driverMonitoringState',
+            'longitudinalPlan', 'liveLocationKalman', 'managerState', 'liveParameters', 'radarState', 'liveTorqueParameters',
+            'testJoystick', 'roadCameraState', 'driverCameraState', 'wideRoadCameraState', 'accelerometer', 'gyroscope']
+
+
+def get_cycles() -> list[list[bytes]]:
+  # the messages received on every cycle, each service at its own frequency
+  dats = {}
+  for s in SERVICES:
+    try:
+      dats[s] = messaging.new_message(s, valid=True).to_bytes()
+    except Exception:
+      dats[s] = messaging.new_message(s, 1, valid=True).to_bytes()
+  return [[dats[s] for s in SERVICES if SERVICE_LIST[s].frequency > 0 and i % max(round(FREQUENCY / SERVICE_LIST[s].frequency), 1) == 0]
+          for i in range(N)]
+
+
+def benchmark(sm: messaging.SubMaster, cycles: list[list[bytes]]) -> np.ndarray:
+  # decode, update and run the checks like controlsd, reading every service once per cycle
+  times = []
+  for i, cycle in enumerate(cycles):
+    t = time.perf_counter()
+    sm.update_msgs(1. + i / FREQUENCY, [messaging.log_from_bytes(dat) for dat in cycle])
+    for s in SERVICES:
+      sm[s]
+    sm.all_checks()
+    sm.all_checks(['driverMonitoringState'])
+    times.append(time.perf_counter() - t)
+  return np.array(times) * 1e6
+
+
+if __name__ == "__main__":
+  cycles = get_cycles()
+  print(f"{len(SERVICES)} services, {np.mean([len(c) for c in cycles]):.1f} messages per cycle at {FREQUENCY:.0f} Hz, {N} cycles")
+  for lazy in (False, True):
+    sm = messaging.SubMaster(SERVICES, ignore_avg_freq=['radarState', 'testJoystick'], ignore_valid=['testJoystick', ], frequency=FREQUENCY, lazy=lazy)
+    times = benchmark(sm, cycles)
+    print(f"\tlazy={lazy!s:5s} avg: {np.mean(times):0.1f}us, p50: {np.percentile(times, 50):0.1f}us, p99: {np.percentile(times, 99):0.1f}us")
@@ -5,6 +5,7 @@ from typing import Sized, cast
 import unittest
 
 import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
 from cereal.messaging.tests.test_messaging import events, random_sock, random_socks, \
                                                   random_bytes, random_carstate, assert_carstate, \
                                                   zmq_sleep
@@ -96,6 +97,47 @@ class TestSubMaster(unittest.TestCase):
         else:
           assert not sm._check_avg_freq(service)
 
+  def test_lazy(self):
+    services = ["carState", "modelV2", "liveCalibration", "carParams", "testJoystick"]
+    kwargs = {"ignore_alive": ["testJoystick"], "ignore_avg_freq": ["liveCalibration"], "ignore_valid": ["modelV2"], "frequency": 100.}
+    sm = messaging.SubMaster(services, **kwargs)
+    sm_lazy = messaging.SubMaster(services, lazy=True, **kwargs)
+
+    cur_time = 1.
+    for i in range(2000):
+      cur_time += random.choice([0.01, 0.01, 0.015]) if i < 1500 else 0.05
+      msgs = []
+      for s in services:
+        if random.random() < SERVICE_LIST[s].frequency / 100.:
+          msg = messaging.new_message(s, valid=random.random() > 0.01)
+          msgs.append(messaging.log_from_bytes(msg.to_bytes()))
+      sm.update_msgs(cur_time, msgs)
+      sm_lazy.update_msgs(cur_time, msgs)
+
+      self.assertEqual(sm.updated, sm_lazy.updated)
+      self.assertEqual(sm.alive, sm_lazy.alive)
+      self.assertEqual(sm.freq_ok, sm_lazy.freq_ok)
+      self.assertEqual(sm.valid, sm_lazy.valid)
+      self.assertEqual(sm.all_checks(), sm_lazy.all_checks())
+      for s in services:
+        self.assertEqual(sm.all_checks([s, ]), sm_lazy.all_checks([s, ]))
+        self.assertEqual(str(sm[s]), str(sm_lazy[s]))
+
+    # ignore lists changed after an update apply right away, like controlsd ignoring a missing camera
+    services = ["carState", "roadCameraState"]
+    sm = messaging.SubMaster(services, frequency=100.)
+    sm_lazy = messaging.SubMaster(services, frequency=100., lazy=True)
+    for i in range(300):
+      msgs = [messaging.log_from_bytes(messaging.new_message("carState", valid=True).to_bytes())]
+      sm.update_msgs(1. + i * 0.01, msgs)
+      sm_lazy.update_msgs(1. + i * 0.01, msgs)
+    self.assertFalse(sm_lazy.all_checks())
+    sm.ignore_alive.append("roadCameraState")
+    sm_lazy.ignore_alive.append("roadCameraState")
+    self.assertTrue(sm.all_checks())
+    self.assertTrue(sm_lazy.all_checks())
+    self.assertTrue(sm_lazy.all_checks(["roadCameraState", ]))
+
   def test_alive(self):
     pass
 
@@ -158,6 +200,27 @@ class TestPubMaster(unittest.TestCase):
           msg = msg.to_bytes()
         self.assertEqual(msg, recvd, i)
 
+  def test_new_message(self):
+    pm = messaging.PubMaster(["carState", "liveTracks"])
+    for _ in range(3):
+      msg, expected = pm.new_message("carState", valid=True), messaging.new_message("carState", valid=True)
+      self.assertGreater(msg.logMonoTime, 0)
+      msg.logMonoTime = expected.logMonoTime
+      self.assertEqual(msg.to_bytes(), expected.to_bytes())
+
+      # filling it doesn't change the template
+      msg.carState.vEgo = 10.
+      msg.carState.init("buttonEvents", 10)
+
+    # the first segment fits the largest message sent so far
+    msg = pm.new_message("liveTracks", 0)
+    msg.init("liveTracks", 2000)
+    self.assertGreater(len(msg.to_segments()), 1)
+    pm.send("liveTracks", msg)
+    msg = pm.new_message("liveTracks", 0)
+    msg.init("liveTracks", 2000)
+    self.assertEqual(len(msg.to_segments()), 1)
+
 
 if __name__ == "__main__":
   unittest.main()
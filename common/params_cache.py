@@ -0,0 +1,160 @@
+"""Change-driven params reads for daemons that poll params in a loop.
+
+A ParamsWatcher wakes up on inotify events from the params directory, and
+CachedParams keeps the decoded value of each key, re-reading and decoding
+a key from disk only when it has changed.
+"""
+import ctypes
+import os
+import select
+import struct
+import time
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from openpilot.common.params import Params
+from openpilot.common.threadname import LINUX
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+# params are written to a temp file and renamed into place, removed with unlink
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+RESET_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+if LINUX:
+  libc = ctypes.CDLL('libc.so.6', use_errno=True)
+
+
+def decode_bool(dat: bytes | None) -> bool:
+  return dat == b"1"
+
+
+def decode_int(default: int) -> Callable[[bytes | None], int]:
+  def decode(dat: bytes | None) -> int:
+    try:
+      return int(dat)  # type: ignore[arg-type]
+    except (ValueError, TypeError):
+      return default
+  return decode
+
+
+class ParamsWatcher:
+  """Reports which params changed on disk. Falls back to reporting every key as
+  changed after the timeout when inotify is unavailable."""
+  def __init__(self, params: Params | None = None):
+    self.params = params if params is not None else Params()
+    self.path = self.params.get_param_path()
+    self.fd = -1
+    if LINUX:
+      self._add_watch()
+
+  def _add_watch(self) -> bool:
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+      return False
+    if libc.inotify_add_watch(fd, self.path.encode(), WATCH_MASK) < 0:
+      os.close(fd)
+      return False
+    self.fd = fd
+    return True
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __del__(self):
+    self.close()
+
+  def fileno(self) -> int:
+    return self.fd
+
+  def read_changes(self, timeout: float | None = 0.) -> set[str] | None:
+    """Wait up to timeout seconds for changes, and return the names of changed keys.
+    None means the changes could not be tracked and all keys should be re-read."""
+    if self.fd < 0 and not (LINUX and self._add_watch()):
+      if timeout:
+        time.sleep(timeout)
+      return None
+
+    r, _, _ = select.select((self.fd,), (), (), timeout)
+    if not r:
+      return set()
+
+    changed: set[str] | None = set()
+    while True:
+      try:
+        buf = os.read(self.fd, 4096)
+      except BlockingIOError:
+        break
+
+      offset = 0
+      while offset < len(buf):
+        _, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+        name = buf[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+        offset += EVENT_HEADER.size + length
+
+        if mask & RESET_MASK:
+          changed = None
+        elif changed is not None and name:
+          changed.add(name.decode())
+
+    # the watch was dropped or events were lost, start over with a fresh watch
+    if changed is None:
+      self.close()
+      self._add_watch()
+    return changed
+
+
+class CachedParams:
+  """Decoded values of a fixed set of params, updated only when they change.
+
+  Each key maps to a decoder taking the raw value (None when unset). The
+  generation counter is bumped every time any of the cached values changes.
+  """
+  def __init__(self, decoders: dict[str, Callable[[bytes | None], Any]], params: Params | None = None):
+    self.params = params if params is not None else Params()
+    for k in decoders:
+      self.params.check_key(k)
+
+    self.decoders = decoders
+    self.generation = 0
+    self.values: dict[str, Any] = {}
+
+    # start watching before the initial read so no update can be missed
+    self.watcher = ParamsWatcher(self.params)
+    self._refresh(decoders.keys())
+
+  def _refresh(self, keys: Iterable[str]) -> set[str]:
+    updated = set()
+    for k in keys:
+      val = self.decoders[k](self.params.get(k))
+      if k not in self.values or self.values[k] != val:
+        self.values[k] = val
+        updated.add(k)
+
+    if updated:
+      self.generation += 1
+    return updated
+
+  def update(self, timeout: float | None = 0.) -> set[str]:
+    """Wait up to timeout seconds for a change and return the keys whose value changed."""
+    changed = self.watcher.read_changes(timeout)
+    keys = self.decoders.keys() if changed is None else changed & self.decoders.keys()
+    return self._refresh(keys)
+
+  def __getitem__(self, key: str) -> Any:
+    return self.values[key]
+
+  def close(self) -> None:
+    self.watcher.close()
@@ -0,0 +1,50 @@
+from openpilot.common.params import Params
+from openpilot.common.params_cache import CachedParams, ParamsWatcher, decode_bool, decode_int
+
+
+class TestParamsCache:
+  def setup_method(self):
+    self.params = Params()
+    self.params.remove("IsMetric")
+    self.params.remove("LongitudinalPersonality")
+
+  def test_initial_values(self):
+    self.params.put_bool("IsMetric", True)
+    cached = CachedParams({"IsMetric": decode_bool, "LongitudinalPersonality": decode_int(1)})
+    assert cached["IsMetric"]
+    assert cached["LongitudinalPersonality"] == 1
+    assert cached.generation == 1
+
+  def test_no_change(self):
+    cached = CachedParams({"IsMetric": decode_bool})
+    assert cached.update(timeout=0.05) == set()
+    assert cached.generation == 1
+
+  def test_put_and_remove(self):
+    cached = CachedParams({"IsMetric": decode_bool, "LongitudinalPersonality": decode_int(1)})
+
+    self.params.put_bool("IsMetric", True)
+    assert cached.update(timeout=1.) == {"IsMetric"}
+    assert cached["IsMetric"]
+    assert cached.generation == 2
+
+    self.params.put("LongitudinalPersonality", "2")
+    assert cached.update(timeout=1.) == {"LongitudinalPersonality"}
+    assert cached["LongitudinalPersonality"] == 2
+
+    self.params.remove("IsMetric")
+    assert cached.update(timeout=1.) == {"IsMetric"}
+    assert not cached["IsMetric"]
+    assert cached.generation == 4
+
+  def test_unrelated_key(self):
+    cached = CachedParams({"IsMetric": decode_bool})
+    self.params.put("DongleId", "cb38263377b873ee")
+    assert cached.update(timeout=0.1) == set()
+    assert cached.generation == 1
+
+  def test_watcher_reports_key(self):
+    watcher = ParamsWatcher()
+    self.params.put_bool("IsMetric", True)
+    assert "IsMetric" in watcher.read_changes(timeout=1.)
+    watcher.close()
@@ -1,18 +1,82 @@
-from openpilot.common.transformations.orientation import numpy_wrap
-from openpilot.common.transformations.transformations import (ecef2geodetic_single,
-                                                    geodetic2ecef_single)
+import numpy as np
+
+from openpilot.common.transformations.orientation import as_float_array, fill_output
 from openpilot.common.transformations.transformations import LocalCoord as LocalCoord_single
 
+# WGS84 ellipsoid, same constants as coordinates.cc
+a = 6378137
+b = 6356752.3142
+esq = 6.69437999014 * 0.001
+e1sq = 6.73949674228 * 0.001
+
+
+def geodetic2ecef(geodetic, out: np.ndarray | None = None) -> np.ndarray:
+  # float32 input gives float32 output, but the math runs in double like the Cython version
+  geodetic = as_float_array(geodetic)
+  dtype, geodetic = geodetic.dtype, geodetic.astype(np.float64, copy=False)
+  lat, lon, alt = np.radians(geodetic[..., 0]), np.radians(geodetic[..., 1]), geodetic[..., 2]
+  xi = np.sqrt(1.0 - esq * np.sin(lat) ** 2)
+  x = (a / xi + alt) * np.cos(lat) * np.cos(lon)
+  y = (a / xi + alt) * np.cos(lat) * np.sin(lon)
+  z = (a / xi * (1.0 - esq) + alt) * np.sin(lat)
+  return fill_output((x, y, z), (3,), dtype, out)
+
+
+def ecef2geodetic(ecef, out: np.ndarray | None = None) -> np.ndarray:
+  # Convert from ECEF to geodetic using Ferrari's methods
+  # https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#Ferrari.27s_solution
+  # G ** 3 overflows float32 for real ECEF positions, so always compute in double
+  ecef = as_float_array(ecef)
+  dtype, ecef = ecef.dtype, ecef.astype(np.float64, copy=False)
+  x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+
+  r = np.sqrt(x * x + y * y)
+  Esq = a * a - b * b
+  F = 54 * b * b * z * z
+  G = r * r + (1 - esq) * z * z - esq * Esq
+  C = (esq * esq * F * r * r) / (G ** 3)
+  S = np.cbrt(1 + C + np.sqrt(C * C + 2 * C))
+  P = F / (3 * (S + 1 / S + 1) ** 2 * G * G)
+  Q = np.sqrt(1 + 2 * esq * esq * P)
+  r_0 = -(P * esq * r) / (1 + Q) + np.sqrt(0.5 * a * a * (1 + 1.0 / Q) - P * (1 - esq) * z * z / (Q * (1 + Q)) - 0.5 * P * r * r)
+  U = np.sqrt((r - esq * r_0) ** 2 + z * z)
+  V = np.sqrt((r - esq * r_0) ** 2 + (1 - esq) * z * z)
+  Z_0 = b * b * z / (a * V)
+  h = U * (1 - b * b / (a * V))
+
+  lat = np.degrees(np.arctan((z + e1sq * Z_0) / r))
+  lon = np.degrees(np.arctan2(y, x))
+  return fill_output((lat, lon, h), (3,), dtype, out)
+
 
 class LocalCoord(LocalCoord_single):
-  ecef2ned = numpy_wrap(LocalCoord_single.ecef2ned_single, (3,), (3,))
-  ned2ecef = numpy_wrap(LocalCoord_single.ned2ecef_single, (3,), (3,))
-  geodetic2ned = numpy_wrap(LocalCoord_single.geodetic2ned_single, (3,), (3,))
-  ned2geodetic = numpy_wrap(LocalCoord_single.ned2geodetic_single, (3,), (3,))
+  def __init__(self, geodetic=None, ecef=None):
+    super().__init__(geodetic=geodetic, ecef=ecef)
+    self.init_ecef = np.array(self.ned2ecef_single([0, 0, 0]))
+    self._ecef2ned_matrix = self.ecef2ned_matrix
+    self._ned2ecef_matrix = self.ned2ecef_matrix
+
+  def ecef2ned(self, ecef, out: np.ndarray | None = None) -> np.ndarray:
+    ecef = as_float_array(ecef)
+    ned = (ecef.astype(np.float64, copy=False) - self.init_ecef) @ self._ecef2ned_matrix.T
+    return fill_output((ned[..., 0], ned[..., 1], ned[..., 2]), (3,), ecef.dtype, out)
+
+  def ned2ecef(self, ned, out: np.ndarray | None = None) -> np.ndarray:
+    ned = as_float_array(ned)
+    ecef = ned.astype(np.float64, copy=False) @ self._ned2ecef_matrix.T + self.init_ecef
+    return fill_output((ecef[..., 0], ecef[..., 1], ecef[..., 2]), (3,), ned.dtype, out)
+
+  def geodetic2ned(self, geodetic, out: np.ndarray | None = None) -> np.ndarray:
+    # the intermediate ECEF stays in double, only the result takes the input dtype
+    geodetic = as_float_array(geodetic)
+    ned = self.ecef2ned(geodetic2ecef(geodetic.astype(np.float64, copy=False)))
+    return fill_output((ned[..., 0], ned[..., 1], ned[..., 2]), (3,), geodetic.dtype, out)
 
+  def ned2geodetic(self, ned, out: np.ndarray | None = None) -> np.ndarray:
+    ned = as_float_array(ned)
+    geodetic = ecef2geodetic(self.ned2ecef(ned.astype(np.float64, copy=False)))
+    return fill_output((geodetic[..., 0], geodetic[..., 1], geodetic[..., 2]), (3,), ned.dtype, out)
 
-geodetic2ecef = numpy_wrap(geodetic2ecef_single, (3,), (3,))
-ecef2geodetic = numpy_wrap(ecef2geodetic_single, (3,), (3,))
 
 geodetic_from_ecef = ecef2geodetic
 ecef_from_geodetic = geodetic2ecef
@@ -2,13 +2,7 @@ import numpy as np
 from collections.abc import Callable
 
 from openpilot.common.transformations.transformations import (ecef_euler_from_ned_single,
-                                                    euler2quat_single,
-                                                    euler2rot_single,
-                                                    ned_euler_from_ecef_single,
-                                                    quat2euler_single,
-                                                    quat2rot_single,
-                                                    rot2euler_single,
-                                                    rot2quat_single)
+                                                    ned_euler_from_ecef_single)
 
 
 def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]:
@@ -33,12 +27,119 @@ def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]
   return f
 
 
-euler2quat = numpy_wrap(euler2quat_single, (3,), (4,))
-quat2euler = numpy_wrap(quat2euler_single, (4,), (3,))
-quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3))
-rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,))
-euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3))
-rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,))
+def as_float_array(inp) -> np.ndarray:
+  """Convert the input to a float32 or float64 array, other dtypes are converted to float64"""
+  inp = np.asarray(inp)
+  return inp if inp.dtype in (np.float32, np.float64) else inp.astype(np.float64)
+
+
+def fill_output(components, output_shape, dtype, out: np.ndarray | None = None) -> np.ndarray:
+  """Write each component into its index of the trailing output dimensions, for the whole batch at once"""
+  shape = np.shape(components[0]) + output_shape
+  if out is None:
+    out = np.empty(shape, dtype=dtype)
+  elif out.shape != shape:
+    raise ValueError(f"out has shape {out.shape}, expected {shape}")
+
+  for idx, component in zip(np.ndindex(output_shape), components, strict=True):
+    out[(..., *idx)] = component
+  return out
+
+
+def ensure_unique(w, x, y, z):
+  # quaternion with a positive real part, like ensure_unique in orientation.cc
+  sign = np.where(w > 0, 1, -1).astype(w.dtype)
+  return w * sign, x * sign, y * sign, z * sign
+
+
+def _euler2quat(euler):
+  half = euler / 2
+  cr, cp, cy = np.cos(half[..., 0]), np.cos(half[..., 1]), np.cos(half[..., 2])
+  sr, sp, sy = np.sin(half[..., 0]), np.sin(half[..., 1]), np.sin(half[..., 2])
+  return ensure_unique(cr * cp * cy + sr * sp * sy,
+                       sr * cp * cy - cr * sp * sy,
+                       cr * sp * cy + sr * cp * sy,
+                       cr * cp * sy - sr * sp * cy)
+
+
+def _quat2euler(w, x, y, z):
+  gamma = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+  theta = np.arcsin(np.clip(2 * (w * y - z * x), -1.0, 1.0))
+  psi = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+  return gamma, theta, psi
+
+
+def _quat2rot(w, x, y, z):
+  # same as Eigen's toRotationMatrix, which doesn't normalize the quaternion
+  tx, ty, tz = 2 * x, 2 * y, 2 * z
+  twx, twy, twz = tx * w, ty * w, tz * w
+  txx, txy, txz = tx * x, ty * x, tz * x
+  tyy, tyz, tzz = ty * y, tz * y, tz * z
+  return (1 - (tyy + tzz), txy - twz, txz + twy,
+          txy + twz, 1 - (txx + tzz), tyz - twx,
+          txz - twy, tyz + twx, 1 - (txx + tyy))
+
+
+def _rot2quat(rot):
+  # same as Eigen's Quaternion from rotation matrix constructor, using the largest of w, x, y, z as pivot
+  # https://gitlab.com/libeigen/eigen/-/blob/master/Eigen/src/Geometry/Quaternion.h
+  m = rot
+  trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+  diag = np.stack([m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]], axis=-1)
+
+  q = np.empty(trace.shape + (4,), dtype=rot.dtype)
+  pos = trace > 0
+  t = np.sqrt(trace[pos] + 1)
+  q[pos, 0] = 0.5 * t
+  t = 0.5 / t
+  q[pos, 1] = (m[pos, 2, 1] - m[pos, 1, 2]) * t
+  q[pos, 2] = (m[pos, 0, 2] - m[pos, 2, 0]) * t
+  q[pos, 3] = (m[pos, 1, 0] - m[pos, 0, 1]) * t
+
+  pivot = np.where(diag[..., 1] > diag[..., 0], 1, 0)
+  pivot = np.where(diag[..., 2] > np.take_along_axis(diag, pivot[..., None], axis=-1)[..., 0], 2, pivot)
+  for i in range(3):
+    sel = ~pos & (pivot == i)
+    j, k = (i + 1) % 3, (i + 2) % 3
+    t = np.sqrt(m[sel, i, i] - m[sel, j, j] - m[sel, k, k] + 1)
+    q[sel, 1 + i] = 0.5 * t
+    t = 0.5 / t
+    q[sel, 0] = (m[sel, k, j] - m[sel, j, k]) * t
+    q[sel, 1 + j] = (m[sel, j, i] + m[sel, i, j]) * t
+    q[sel, 1 + k] = (m[sel, k, i] + m[sel, i, k]) * t
+  return ensure_unique(q[..., 0], q[..., 1], q[..., 2], q[..., 3])
+
+
+def euler2quat(euler, out: np.ndarray | None = None) -> np.ndarray:
+  euler = as_float_array(euler)
+  return fill_output(_euler2quat(euler), (4,), euler.dtype, out)
+
+
+def quat2euler(quat, out: np.ndarray | None = None) -> np.ndarray:
+  quat = as_float_array(quat)
+  return fill_output(_quat2euler(quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]), (3,), quat.dtype, out)
+
+
+def quat2rot(quat, out: np.ndarray | None = None) -> np.ndarray:
+  quat = as_float_array(quat)
+  return fill_output(_quat2rot(quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]), (3, 3), quat.dtype, out)
+
+
+def rot2quat(rot, out: np.ndarray | None = None) -> np.ndarray:
+  rot = as_float_array(rot)
+  return fill_output(_rot2quat(rot), (4,), rot.dtype, out)
+
+
+def euler2rot(euler, out: np.ndarray | None = None) -> np.ndarray:
+  euler = as_float_array(euler)
+  return fill_output(_quat2rot(*_euler2quat(euler)), (3, 3), euler.dtype, out)
+
+
+def rot2euler(rot, out: np.ndarray | None = None) -> np.ndarray:
+  rot = as_float_array(rot)
+  return fill_output(_quat2euler(*_rot2quat(rot)), (3,), rot.dtype, out)
+
+
 ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,))
 ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,))
 
@@ -1,6 +1,7 @@
 import numpy as np
 
 import openpilot.common.transformations.coordinates as coord
+from openpilot.common.transformations.transformations import geodetic2ecef_single, ecef2geodetic_single
 
 geodetic_positions = np.array([[37.7610403, -122.4778699, 115],
                                  [27.4840915, -68.5867592, 2380],
@@ -102,3 +103,45 @@ class TestNED:
     np.testing.assert_allclose(converter.ned2ecef(ned_offsets_batch),
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
+
+  def test_batch_matches_single(self):
+    # the vectorized conversions against the Cython implementations they replace
+    rng = np.random.default_rng(0)
+    geodetic = np.column_stack([rng.uniform(-89, 89, 1000), rng.uniform(-180, 180, 1000), rng.uniform(-100, 5000, 1000)])
+    ecef = np.array([geodetic2ecef_single(g) for g in geodetic])
+    np.testing.assert_allclose(coord.geodetic2ecef(geodetic), ecef, rtol=1e-9)
+    np.testing.assert_allclose(coord.ecef2geodetic(ecef), [ecef2geodetic_single(e) for e in ecef], rtol=1e-9, atol=1e-6)
+
+    converter = coord.LocalCoord.from_geodetic(geodetic[0])
+    ecef_offset = ecef[0] + rng.uniform(-1000, 1000, (1000, 3))
+    ned = np.array([converter.ecef2ned_single(e) for e in ecef_offset])
+    np.testing.assert_allclose(converter.ecef2ned(ecef_offset), ned, rtol=1e-9, atol=1e-7)
+    np.testing.assert_allclose(converter.ned2ecef(ned), [converter.ned2ecef_single(n) for n in ned], rtol=1e-9, atol=1e-7)
+
+  def test_out_and_dtype(self):
+    out = np.empty_like(ecef_positions)
+    assert coord.geodetic2ecef(geodetic_positions, out=out) is out
+    np.testing.assert_allclose(ecef_positions, out, rtol=1e-9)
+
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    out = np.empty_like(ned_offsets_batch)
+    assert converter.ecef2ned(ecef_positions_offset_batch, out=out) is out
+    np.testing.assert_allclose(ned_offsets_batch, out, rtol=1e-9, atol=1e-7)
+
+    assert coord.geodetic2ecef(geodetic_positions.astype(np.float32)).dtype == np.float32
+    np.testing.assert_allclose(ecef_positions, coord.geodetic2ecef(geodetic_positions.astype(np.float32)), rtol=1e-6)
+
+  def test_float32_matches_float64(self):
+    # float32 in, float32 out, but computed in double: only the output rounding may differ
+    ecef32 = ecef_positions.astype(np.float32)
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    ned32 = ned_offsets_batch.astype(np.float32)
+    with np.errstate(over='raise'):
+      geodetic = coord.ecef2geodetic(ecef32)
+      ned = converter.ecef2ned(ecef32)
+      ned_geodetic = converter.ned2geodetic(ned32)
+
+    assert geodetic.dtype == ned.dtype == ned_geodetic.dtype == np.float32
+    np.testing.assert_allclose(geodetic, coord.ecef2geodetic(ecef32.astype(np.float64)), rtol=1e-6, atol=1e-4)
+    np.testing.assert_allclose(ned, converter.ecef2ned(ecef32.astype(np.float64)), rtol=1e-6, atol=1e-3)
+    np.testing.assert_allclose(ned_geodetic, converter.ned2geodetic(ned32.astype(np.float64)), rtol=1e-6, atol=1e-4)
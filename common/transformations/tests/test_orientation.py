@@ -3,6 +3,8 @@ import numpy as np
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
                                                ned_euler_from_ecef
+from openpilot.common.transformations.transformations import euler2quat_single, quat2euler_single, euler2rot_single, \
+                                               rot2euler_single, rot2quat_single, quat2rot_single
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -59,3 +61,34 @@ class TestOrientation:
       np.testing.assert_allclose(ned_eulers[i], ned_euler_from_ecef(ecef_positions[i], eulers[i]), rtol=1e-7)
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
     # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+
+  def test_batch_matches_single(self):
+    # the vectorized conversions against the Cython implementations they replace
+    rng = np.random.default_rng(0)
+    batch_eulers = rng.uniform(-np.pi, np.pi, (1000, 3))
+    batch_quats = rng.normal(size=(1000, 4))
+    batch_quats /= np.linalg.norm(batch_quats, axis=1, keepdims=True)
+    batch_rots = np.array([quat2rot_single(q) for q in batch_quats])
+
+    conversions = [
+      (euler2quat, euler2quat_single, batch_eulers),
+      (euler2rot, euler2rot_single, batch_eulers),
+      (quat2euler, quat2euler_single, batch_quats),
+      (quat2rot, quat2rot_single, batch_quats),
+      (rot2quat, rot2quat_single, batch_rots),
+      (rot2euler, rot2euler_single, batch_rots),
+    ]
+    for batch_f, single_f, inputs in conversions:
+      expected = np.array([single_f(inp) for inp in inputs])
+      np.testing.assert_allclose(batch_f(inputs), expected, rtol=1e-9, atol=1e-12, err_msg=batch_f.__name__)
+      np.testing.assert_allclose(batch_f(inputs[0]), expected[0], rtol=1e-9, atol=1e-12, err_msg=batch_f.__name__)
+
+  def test_out_and_dtype(self):
+    out = np.empty((len(eulers), 4))
+    assert euler2quat(eulers, out=out) is out
+    np.testing.assert_allclose(quats, out, rtol=1e-7)
+
+    quats_f32 = euler2quat(eulers.astype(np.float32))
+    assert quats_f32.dtype == np.float32
+    np.testing.assert_allclose(quats, quats_f32, rtol=1e-5, atol=1e-6)
+    assert euler2rot(eulers.astype(np.float32)).dtype == np.float32
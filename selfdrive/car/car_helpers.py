@@ -1,11 +1,11 @@
 import os
 import time
-from collections.abc import Callable
+from collections.abc import Callable, Mapping
 
 from cereal import car
 from openpilot.common.params import Params
 from openpilot.selfdrive.car.interfaces import get_interface_attr
-from openpilot.selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
+from openpilot.selfdrive.car.fingerprints import ALL_FINGERPRINT_CARS_MASK, cars_from_mask, get_compatible_cars_mask
 from openpilot.selfdrive.car.vin import get_vin, is_valid_vin, VIN_UNKNOWN
 from openpilot.selfdrive.car.fw_versions import get_fw_versions_ordered, get_present_ecus, match_fw_to_car, set_obd_multiplexing
 from openpilot.selfdrive.car.mock.values import CAR as MOCK
@@ -43,16 +43,36 @@ def get_one_can(logcan):
       return can
 
 
+def load_interface(brand_name):
+  path = f'openpilot.selfdrive.car.{brand_name}'
+  CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+  CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
+  CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
+  return CarInterface, CarController, CarState
+
+
+class CarInterfaces(Mapping):
+  """Maps each platform to its (CarInterface, CarController, CarState). A brand's interface
+  modules are only imported the first time one of its platforms is looked up."""
+  def __init__(self, brand_names):
+    self.brands = {model_name: brand_name for brand_name, model_names in brand_names.items() for model_name in model_names}
+    self.loaded = {}
+
+  def __getitem__(self, model_name):
+    brand_name = self.brands[model_name]
+    if brand_name not in self.loaded:
+      self.loaded[brand_name] = load_interface(brand_name)
+    return self.loaded[brand_name]
+
+  def __iter__(self):
+    return iter(self.brands)
+
+  def __len__(self):
+    return len(self.brands)
+
+
 def load_interfaces(brand_names):
-  ret = {}
-  for brand_name in brand_names:
-    path = f'openpilot.selfdrive.car.{brand_name}'
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
-    CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
-    CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
-    for model_name in brand_names[brand_name]:
-      ret[model_name] = (CarInterface, CarController, CarState)
-  return ret
+  return CarInterfaces(brand_names)
 
 
 def _get_interface_names() -> dict[str, list[str]]:
@@ -71,7 +91,8 @@ interfaces = load_interfaces(interface_names)
 
 def can_fingerprint(next_can: Callable) -> tuple[str | None, dict[int, dict]]:
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  # bitset of candidate cars, attempt fingerprint on both bus 0 and 1
+  candidate_cars = dict.fromkeys([0, 1], ALL_FINGERPRINT_CARS_MASK)
   frame = 0
   car_fingerprint = None
   done = False
@@ -87,20 +108,19 @@ def can_fingerprint(next_can: Callable) -> tuple[str | None, dict[int, dict]]:
           finger[can.src] = {}
         finger[can.src][can.address] = len(can.dat)
 
-      for b in candidate_cars:
-        # Ignore extended messages and VIN query response.
-        if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+      # Ignore extended messages and VIN query response.
+      if can.src in candidate_cars and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
+        candidate_cars[can.src] &= get_compatible_cars_mask(can.address, len(can.dat))
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
     for b in candidate_cars:
-      if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+      if candidate_cars[b].bit_count() == 1 and frame > FRAME_FINGERPRINT:
         # fingerprint done
-        car_fingerprint = candidate_cars[b][0]
+        car_fingerprint = cars_from_mask(candidate_cars[b])[0]
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+    failed = (all(cc == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
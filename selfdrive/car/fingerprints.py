@@ -1,3 +1,5 @@
+from collections.abc import Iterable
+
 from openpilot.selfdrive.car.interfaces import get_interface_attr
 from openpilot.selfdrive.car.body.values import CAR as BODY
 from openpilot.selfdrive.car.chrysler.values import CAR as CHRYSLER
@@ -25,6 +27,44 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_index() -> tuple[list[str], dict[tuple[int, int], int]]:
+  # maps each (address, length) to a bitset of the cars with that message in any of their fingerprints
+  cars = list(_FINGERPRINTS.keys())
+  index: dict[tuple[int, int], int] = {}
+  for bit, car_name in enumerate(cars):
+    for fingerprint in _FINGERPRINTS[car_name]:
+      # add alien debug address
+      for address, length in (fingerprint | _DEBUG_ADDRESS).items():
+        index[(address, length)] = index.get((address, length), 0) | (1 << bit)
+  return cars, index
+
+
+_FINGERPRINT_CARS, _FINGERPRINT_INDEX = _build_fingerprint_index()
+_FINGERPRINT_CAR_BITS = {car_name: 1 << bit for bit, car_name in enumerate(_FINGERPRINT_CARS)}
+ALL_FINGERPRINT_CARS_MASK = (1 << len(_FINGERPRINT_CARS)) - 1
+
+
+def get_compatible_cars_mask(address: int, length: int) -> int:
+  """Returns the bitset of cars that could have sent a message with this address and length."""
+  # ignore addresses that are more than 11 bits
+  if address >= 0x800:
+    return ALL_FINGERPRINT_CARS_MASK
+  return _FINGERPRINT_INDEX.get((address, length), 0)
+
+
+def eliminate_incompatible_frames(frames: Iterable[tuple[int, int]], candidates: int = ALL_FINGERPRINT_CARS_MASK) -> int:
+  """Removes cars that could not have sent any of the (address, length) frames from the candidates bitset."""
+  for address, length in frames:
+    candidates &= get_compatible_cars_mask(address, length)
+    if not candidates:
+      break
+  return candidates
+
+
+def cars_from_mask(candidates: int) -> list[str]:
+  return [car_name for car_name, bit in _FINGERPRINT_CAR_BITS.items() if candidates & bit]
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -35,18 +75,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  compatible = get_compatible_cars_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if compatible & _FINGERPRINT_CAR_BITS[car_name]]
 
 
 def all_known_cars():
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from collections import defaultdict
-from collections.abc import Iterator
-from typing import Any, Protocol, TypeVar
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Protocol
 
 from tqdm import tqdm
 import capnp
@@ -12,9 +13,10 @@ from openpilot.common.params import Params
 from openpilot.common.swaglog import cloudlog
 from openpilot.selfdrive.car.ecu_addrs import get_ecu_addrs
 from openpilot.selfdrive.car.fingerprints import FW_VERSIONS
-from openpilot.selfdrive.car.fw_query_definitions import AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from openpilot.selfdrive.car.fw_query_definitions import AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions, \
+                                                         Request
 from openpilot.selfdrive.car.interfaces import get_interface_attr
-from openpilot.selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from openpilot.selfdrive.car.isotp_parallel_query import IsoTpQueryScheduler
 
 Ecu = car.CarParams.Ecu
 ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.abs, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
@@ -26,13 +28,6 @@ VERSIONS = get_interface_attr('FW_VERSIONS', ignore_none=True)
 MODEL_TO_BRAND = {c: b for b, e in VERSIONS.items() for c in e}
 REQUESTS = [(brand, config, r) for brand, config in FW_QUERY_CONFIGS.items() for r in config.requests]
 
-T = TypeVar('T')
-
-
-def chunks(l: list[T], n: int = 128) -> Iterator[list[T]]:
-  for i in range(0, len(l), n):
-    yield l[i:i + n]
-
 
 def is_brand(brand: str, filter_brand: str | None) -> bool:
   """Returns if brand matches filter_brand or no brand filter is specified"""
@@ -53,51 +48,113 @@ class MatchFwToCar(Protocol):
     ...
 
 
-def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True, exclude: str = None) -> set[str]:
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
+EcuKey = tuple[int, int, int | None]  # (ecu type, address, sub-address)
+FwKey = tuple[int, int | None, bytes]  # (address, sub-address, fw version)
+
+
+@dataclass(frozen=True)
+class FwMatchIndex:
+  """Inverted index of the FW versions database for one brand, or all brands"""
+  # (addr, sub_addr, fw) -> all cars that have this FW response on the address, for fuzzy matching
+  fuzzy: dict[FwKey, tuple[str, ...]]
+  # (addr, sub_addr, fw) -> (car, ecu) pairs that accept this FW response, for exact matching
+  exact: dict[FwKey, tuple[tuple[str, EcuKey], ...]]
+  # car -> its ECUs that need to match for an exact match, and whether each one can be missing
+  ecus: dict[str, tuple[tuple[EcuKey, bool], ...]]
+
+  def match_fuzzy(self, live_fw_versions: LiveFwVersions, exclude: str = None) -> tuple[str | None, int]:
+    """Returns the car all uniquely matched ECUs point to, and the number of uniquely matched ECUs"""
+    matched_ecus = set()
+    match: str | None = None
+    for addr, versions in live_fw_versions.items():
+      ecu_key = (addr[0], addr[1])
+      for version in versions:
+        # All cars that have this FW response on the specified address
+        candidates = self.fuzzy.get((*ecu_key, version), ())
+        if exclude is not None and exclude in candidates:
+          candidates = tuple(c for c in candidates if c != exclude)
+
+        if len(candidates) == 1:
+          matched_ecus.add(ecu_key)
+          if match is None:
+            match = candidates[0]
+          # We uniquely matched two different cars. No fuzzy match possible
+          elif match != candidates[0]:
+            return None, 0
+
+    return match, len(matched_ecus)
+
+  def match_exact(self, live_fw_versions: LiveFwVersions) -> set[str]:
+    matched = set()
+    for addr, versions in live_fw_versions.items():
+      for version in versions:
+        matched.update(self.exact.get((*addr, version), ()))
+
+    present_addrs = {addr for addr, versions in live_fw_versions.items() if len(versions)}
+    return {candidate for candidate, ecus in self.ecus.items()
+            if all((candidate, ecu) in matched or (can_be_missing and ecu[1:] not in present_addrs) for ecu, can_be_missing in ecus)}
+
+
+def build_fw_match_index(match_brand: str = None, extra_fw_versions: dict = None) -> FwMatchIndex:
+  if extra_fw_versions is None:
+    extra_fw_versions = {}
+
+  fuzzy: defaultdict[FwKey, list[str]] = defaultdict(list)
+  exact: defaultdict[FwKey, list[tuple[str, EcuKey]]] = defaultdict(list)
+  ecus: dict[str, tuple[tuple[EcuKey, bool], ...]] = {}
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
   for candidate, fw_by_addr in FW_VERSIONS.items():
     if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
       continue
 
-    if candidate == exclude:
-      continue
+    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+    candidate_ecus = []
+    for ecu, fws in fw_by_addr.items():
+      ecu_type, addr, sub_addr = ecu
 
-    for addr, fws in fw_by_addr.items():
       # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
       # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
       # impossible to get 3 matching versions, even if two models with shared parts are released at the same
       # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
+      if ecu_type not in FUZZY_EXCLUDE_ECUS:
+        for f in fws:
+          fuzzy[(addr, sub_addr, f)].append(candidate)
+
+      # Virtual debug ecu doesn't need to match the database
+      if ecu_type == Ecu.debug:
         continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
-
-  matched_ecus = set()
-  match: str | None = None
-  for addr, versions in live_fw_versions.items():
-    ecu_key = (addr[0], addr[1])
-    for version in versions:
-      # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
-
-      if len(candidates) == 1:
-        matched_ecus.add(ecu_key)
-        if match is None:
-          match = candidates[0]
-        # We uniquely matched two different cars. No fuzzy match possible
-        elif match != candidates[0]:
-          return set()
+
+      # Some models can sometimes miss an ecu, or show on two different addresses
+      # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+      # Non essential ecus can also be missing, but if present they need to match the database
+      can_be_missing = candidate in config.non_essential_ecus.get(ecu_type, []) or ecu_type not in ESSENTIAL_ECUS
+      candidate_ecus.append((ecu, can_be_missing))
+      for f in set(fws) | set(extra_fw_versions.get(candidate, {}).get(ecu, [])):
+        exact[(addr, sub_addr, f)].append((candidate, ecu))
+
+    ecus[candidate] = tuple(candidate_ecus)
+
+  return FwMatchIndex({k: tuple(v) for k, v in fuzzy.items()}, {k: tuple(v) for k, v in exact.items()}, ecus)
+
+
+@cache
+def get_fw_match_index(match_brand: str = None) -> FwMatchIndex:
+  """Returns the match index for the brand, built on first use"""
+  return build_fw_match_index(match_brand)
+
+
+def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True, exclude: str = None) -> set[str]:
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+
+  match, matched_ecus = get_fw_match_index(match_brand).match_fuzzy(live_fw_versions, exclude)
 
   # Note that it is possible to match to a candidate without all its ECUs being present
   # if there are enough matches. FIXME: parameterize this or require all ECUs to exist like exact matching
-  if match and len(matched_ecus) >= 2:
+  if match and matched_ecus >= 2:
     if log:
-      cloudlog.error(f"Fingerprinted {match} using fuzzy match. {len(matched_ecus)} matching ECUs")
+      cloudlog.error(f"Fingerprinted {match} using fuzzy match. {matched_ecus} matching ECUs")
     return {match}
   else:
     return set()
@@ -108,44 +165,25 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str = N
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  if extra_fw_versions is None:
-    extra_fw_versions = {}
-
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
+  if extra_fw_versions:
+    index = build_fw_match_index(match_brand, extra_fw_versions)
+  else:
+    index = get_fw_match_index(match_brand)
+  return index.match_exact(live_fw_versions)
 
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
 
-  return set(candidates.keys()) - invalid
+def build_fw_dicts(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder]) -> dict[str, dict[AddrType, set[bytes]]]:
+  """build_fw_dict for every brand, in one pass over the FW versions"""
+  fw_versions_dicts: dict[str, defaultdict[AddrType, set[bytes]]] = {brand: defaultdict(set) for brand in VERSIONS.keys()}
+  for fw in fw_versions:
+    if fw.brand in fw_versions_dicts and not fw.logging:
+      sub_addr = fw.subAddress if fw.subAddress != 0 else None
+      fw_versions_dicts[fw.brand][(fw.address, sub_addr)].add(fw.fwVersion)
+  return {brand: dict(fw_versions_dict) for brand, fw_versions_dict in fw_versions_dicts.items()}
 
 
-def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vin: str,
-                    allow_exact: bool = True, allow_fuzzy: bool = True, log: bool = True) -> tuple[bool, set[str]]:
+def match_fw_dicts_to_car(fw_versions_dicts: dict[str, LiveFwVersions], vin: str,
+                          allow_exact: bool = True, allow_fuzzy: bool = True, log: bool = True) -> tuple[bool, set[str]]:
   # Try exact matching first
   exact_matches: list[tuple[bool, MatchFwToCar]] = []
   if allow_exact:
@@ -156,8 +194,7 @@ def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vi
   for exact_match, match_func in exact_matches:
     # For each brand, attempt to fingerprint using all FW returned from its queries
     matches: set[str] = set()
-    for brand in VERSIONS.keys():
-      fw_versions_dict = build_fw_dict(fw_versions, filter_brand=brand)
+    for brand, fw_versions_dict in fw_versions_dicts.items():
       matches |= match_func(fw_versions_dict, match_brand=brand, log=log)
 
       # If specified and no matches so far, fall back to brand's fuzzy fingerprinting function
@@ -171,6 +208,30 @@ def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vi
   return True, set()
 
 
+def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vin: str,
+                    allow_exact: bool = True, allow_fuzzy: bool = True, log: bool = True) -> tuple[bool, set[str]]:
+  return match_fw_dicts_to_car(build_fw_dicts(fw_versions), vin, allow_exact, allow_fuzzy, log)
+
+
+def match_fw_to_car_batch(fw_lists: list[list[capnp.lib.capnp._DynamicStructBuilder]], vins: list[str],
+                          allow_exact: bool = True, allow_fuzzy: bool = True, log: bool = True) -> list[tuple[bool, set[str]]]:
+  """match_fw_to_car for many carFw lists at once, such as those of every segment of many routes.
+  All lists are matched against the same cached indexes, and lists with the same FW versions and VIN are matched once."""
+  assert len(fw_lists) == len(vins), "need one VIN per FW list"
+
+  results: dict[tuple[str, frozenset], tuple[bool, set[str]]] = {}
+  matches = []
+  for fw_versions, vin in zip(fw_lists, vins, strict=True):
+    fw_versions_dicts = build_fw_dicts(fw_versions)
+    key = (vin, frozenset((brand, addr, frozenset(versions)) for brand, fw_versions_dict in fw_versions_dicts.items()
+                          for addr, versions in fw_versions_dict.items()))
+    if key not in results:
+      results[key] = match_fw_dicts_to_car(fw_versions_dicts, vin, allow_exact, allow_fuzzy, log)
+    exact_match, candidates = results[key]
+    matches.append((exact_match, set(candidates)))
+  return matches
+
+
 def get_present_ecus(logcan, sendcan, num_pandas: int = 1) -> set[EcuAddrBusType]:
   params = Params()
   # queries are split by OBD multiplexing mode
@@ -272,9 +333,8 @@ def get_fw_versions(logcan, sendcan, query_brand: str = None, extra: OfflineFwVe
     versions.update(extra)
 
   # Extract ECU addresses to query from fingerprints
-  # ECUs using a subaddress need be queried one by one, the rest can be done in parallel
+  # ECUs using a subaddress are queried one by one by the scheduler, as they share a transmit address
   addrs = []
-  parallel_addrs = []
   ecu_types = {}
 
   for brand, brand_versions in versions.items():
@@ -283,55 +343,66 @@ def get_fw_versions(logcan, sendcan, query_brand: str = None, extra: OfflineFwVe
       a = (brand, addr, sub_addr)
       if a not in ecu_types:
         ecu_types[a] = ecu_type
+        addrs.append(a)
+
+  # One query per request and ECU, so each ECU is sent its next request as soon as it has responded.
+  # Queries on the OBD port need the multiplexing mode set, other buses don't depend on it
+  queries: list[tuple[bool | None, str, FwQueryConfig, Request, AddrType]] = []
+  for brand, config, r in REQUESTS:
+    # Skip query if not in brand or no panda available
+    if not is_brand(brand, query_brand) or r.bus > num_pandas * 4 - 1:
+      continue
 
-      if sub_addr is None:
-        if a not in parallel_addrs:
-          parallel_addrs.append(a)
-      else:
-        if [a] not in addrs:
-          addrs.append([a])
+    obd_multiplexing = r.obd_multiplexing if r.bus % 4 == 1 else None
+    for b, a, s in addrs:
+      if b in (brand, 'any') and (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus):
+        queries.append((obd_multiplexing, brand, config, r, (a, s)))
 
-  addrs.insert(0, parallel_addrs)
+  # Run queries grouped by OBD multiplexing mode, queries independent of the mode are run with the first group
+  modes = list(dict.fromkeys(q[0] for q in queries if q[0] is not None)) or [None]
+  query_groups = {mode: [i for i, q in enumerate(queries) if q[0] == mode or (q[0] is None and mode == modes[0])] for mode in modes}
 
   # Get versions and build capnp list to put into CarParams
+  versions_by_query: dict[int, tuple[AddrType, bytes]] = {}
+  with tqdm(total=len(queries), disable=not progress) as pbar:
+    for obd_multiplexing, query_idxs in query_groups.items():
+      if obd_multiplexing is not None:
+        set_obd_multiplexing(params, obd_multiplexing)
+
+      scheduler = IsoTpQueryScheduler(sendcan, logcan, debug=debug)
+      query_idx = {}
+      for i in query_idxs:
+        _, _, _, r, addr = queries[i]
+        query_idx[scheduler.add_query(r.bus, [addr], r.request, r.response, r.rx_offset)] = i
+
+      # A query that raises is yielded without data by the scheduler, this only catches receive errors
+      try:
+        for query, data in scheduler.run(timeout):
+          pbar.update()
+          for addr, version in data.items():
+            versions_by_query[query_idx[query]] = (addr, version)
+      except Exception:
+        cloudlog.exception("FW query exception")
+
   car_fw = []
-  requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
-    for addr_chunk in chunks(addr_group):
-      for brand, config, r in requests:
-        # Skip query if no panda available
-        if r.bus > num_pandas * 4 - 1:
-          continue
-
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(params, r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, r.bus, query_addrs, r.request, r.response, r.rx_offset, debug=debug)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = car.CarParams.CarFw.new_message()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          cloudlog.exception("FW query exception")
+  for i, ((tx_addr, sub_addr), version) in sorted(versions_by_query.items()):
+    _, brand, config, r, _ = queries[i]
+    f = car.CarParams.CarFw.new_message()
+
+    f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
+    f.fwVersion = version
+    f.address = tx_addr
+    f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+    f.request = r.request
+    f.brand = brand
+    f.bus = r.bus
+    f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+    f.obdMultiplexing = r.obd_multiplexing
+
+    if sub_addr is not None:
+      f.subAddress = sub_addr
+
+    car_fw.append(f)
 
   return car_fw
 
@@ -5,7 +5,7 @@ import tomllib
 from abc import abstractmethod, ABC
 from enum import StrEnum
 from typing import Any, NamedTuple
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
 from functools import cache
 
 from cereal import car
@@ -46,6 +46,41 @@ GEAR_SHIFTER_MAP: dict[str, car.CarState.GearShifter] = {
 }
 
 
+# numpy dtype of each capnp field type, enums are stored as their raw value
+CAPNP_DTYPES = {
+  'bool': np.bool_, 'float32': np.float32, 'float64': np.float64, 'enum': np.uint16,
+  'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+  'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+}
+
+
+def get_field_dtype(schema, field: str):
+  """Returns the numpy dtype of a (dotted) field of a capnp struct schema"""
+  *parents, name = field.split('.')
+  for parent in parents:
+    schema = schema.fields[parent].schema
+  return CAPNP_DTYPES[schema.fields[name].proto.slot.type.which()]
+
+
+def get_field_value(struct, field: str):
+  for name in field.split('.'):
+    struct = getattr(struct, name)
+  return struct.raw if hasattr(struct, 'raw') else struct
+
+
+def group_fields(schema, fields: Sequence[str]) -> dict[tuple[str, ...], list[tuple[str, str, bool]]]:
+  """Groups (dotted) fields by their parent struct, so each struct is read once per message: parent path -> (field, name, is enum)"""
+  groups: dict[tuple[str, ...], list[tuple[str, str, bool]]] = {}
+  for field in fields:
+    *parents, name = field.split('.')
+    parent_schema = schema
+    for parent in parents:
+      parent_schema = parent_schema.fields[parent].schema
+    is_enum = parent_schema.fields[name].proto.slot.type.which() == 'enum'
+    groups.setdefault(tuple(parents), []).append((field, name, is_enum))
+  return groups
+
+
 class LatControlInputs(NamedTuple):
   lateral_acceleration: float
   roll_compensation: float
@@ -231,6 +266,15 @@ class CarInterfaceBase(ABC):
     pass
 
   def update(self, c: car.CarControl, can_strings: list[bytes]) -> car.CarState:
+    ret = self._update_car_state(c, can_strings)
+
+    # copy back for next iteration
+    if self.CS is not None:
+      self.CS.out = ret.as_reader()
+
+    return ret
+
+  def _update_car_state(self, c: car.CarControl, can_strings: list[bytes]) -> car.CarState:
     # parse can
     for cp in self.can_parsers:
       if cp is not None:
@@ -256,12 +300,37 @@ class CarInterfaceBase(ABC):
     if ret.cruiseState.speedCluster == 0:
       ret.cruiseState.speedCluster = ret.cruiseState.speed
 
-    # copy back for next iteration
-    if self.CS is not None:
-      self.CS.out = ret.as_reader()
-
     return ret
 
+  def update_batch(self, c: car.CarControl, can_packets: Sequence[list[bytes]], fields: Sequence[str]) -> dict[str, np.ndarray]:
+    """
+    Runs update over a whole log of CAN packets for offline tools, returning the requested (dotted) carState
+    fields as one array per field. Each step's carState builder is read once and kept only as the previous
+    state of the next step, the realtime reader copy is skipped.
+    """
+    columns = {field: np.empty(len(can_packets), dtype=get_field_dtype(car.CarState.schema, field)) for field in fields}
+    groups = [(parents, [(name, is_enum, columns[field]) for field, name, is_enum in group])
+              for parents, group in group_fields(car.CarState.schema, fields).items()]
+
+    ret = None
+    for i, can_strings in enumerate(can_packets):
+      ret = self._update_car_state(c, can_strings)
+      if self.CS is not None:
+        self.CS.out = ret
+
+      for parents, group in groups:
+        struct = ret
+        for parent in parents:
+          struct = struct._get(parent)
+        for name, is_enum, column in group:
+          value = struct._get(name)
+          column[i] = value.raw if is_enum else value
+
+    # leave the interface as the realtime path would
+    if self.CS is not None and ret is not None:
+      self.CS.out = ret.as_reader()
+    return columns
+
 
   def create_common_events(self, cs_out, extra_gears=None, pcm_enable=True, allow_enable=True,
                            enable_buttons=(ButtonType.accelCruise, ButtonType.decelCruise)):
@@ -1,5 +1,5 @@
 import time
-from collections import defaultdict
+from collections.abc import Iterator
 from functools import partial
 
 import cereal.messaging as messaging
@@ -8,11 +8,43 @@ from openpilot.selfdrive.pandad import can_list_to_can_capnp
 from openpilot.selfdrive.car.fw_query_definitions import AddrType
 from panda.python.uds import CanClient, IsoTpMessage, FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
 
+CanFrame = tuple[int, int, bytes, int]
+
+
+class CanRxBuffer:
+  """Receives from the can socket once for any number of queries, keeping only
+  frames on the (bus, address) pairs that are being listened to"""
+  def __init__(self, logcan: messaging.SubSocket) -> None:
+    self.logcan = logcan
+    self.frames: dict[tuple[int, int], list[CanFrame]] = {}
+
+  def listen(self, bus: int, addrs: list[int]) -> None:
+    for addr in addrs:
+      self.frames[(bus, addr)] = []
+
+  def unlisten(self, bus: int, addrs: list[int]) -> None:
+    for addr in addrs:
+      self.frames.pop((bus, addr), None)
+
+  def rx(self) -> None:
+    """Drain can socket and sort messages into buffers based on bus and address"""
+    for dat in messaging.drain_sock_raw(self.logcan, wait_for_one=True):
+      for msg in messaging.log_from_bytes(dat).can:
+        frames = self.frames.get((msg.src, msg.address))
+        if frames is not None:
+          frames.append((msg.address, msg.busTime, msg.dat, msg.src))
+
+  def drain(self) -> None:
+    messaging.drain_sock_raw(self.logcan)
+    for frames in self.frames.values():
+      frames.clear()
+
 
 class IsoTpParallelQuery:
   def __init__(self, sendcan: messaging.PubSocket, logcan: messaging.SubSocket, bus: int, addrs: list[int] | list[AddrType],
                request: list[bytes], response: list[bytes], response_offset: int = 0x8,
-               functional_addrs: list[int] = None, debug: bool = False, response_pending_timeout: float = 10) -> None:
+               functional_addrs: list[int] = None, debug: bool = False, response_pending_timeout: float = 10,
+               rx_buffer: CanRxBuffer = None) -> None:
     self.sendcan = sendcan
     self.logcan = logcan
     self.bus = bus
@@ -21,22 +53,13 @@ class IsoTpParallelQuery:
     self.functional_addrs = functional_addrs or []
     self.debug = debug
     self.response_pending_timeout = response_pending_timeout
+    self.rx_buffer = rx_buffer if rx_buffer is not None else CanRxBuffer(logcan)
 
     real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
     for tx_addr, _ in real_addrs:
       assert tx_addr not in FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
 
     self.msg_addrs = {tx_addr: get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
-    self.msg_buffer: dict[int, list[tuple[int, int, bytes, int]]] = defaultdict(list)
-
-  def rx(self):
-    """Drain can socket and sort messages into buffers based on address"""
-    can_packets = messaging.drain_sock(self.logcan, wait_for_one=True)
-
-    for packet in can_packets:
-      for msg in packet.can:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
-          self.msg_buffer[msg.address].append((msg.address, msg.busTime, msg.dat, msg.src))
 
   def _can_tx(self, tx_addr, dat, bus):
     """Helper function to send single message"""
@@ -45,27 +68,18 @@ class IsoTpParallelQuery:
 
   def _can_rx(self, addr, sub_addr=None):
     """Helper function to retrieve message with specified address and subadress from buffer"""
-    keep_msgs = []
+    frames = self.rx_buffer.frames.get((self.bus, addr), [])
 
     if sub_addr is None:
-      msgs = self.msg_buffer[addr]
+      msgs = frames[:]
+      frames.clear()
     else:
       # Filter based on subadress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[2][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
+      msgs = [m for m in frames if m[2][0] == sub_addr]
+      frames[:] = [m for m in frames if m[2][0] != sub_addr]
 
-    self.msg_buffer[addr] = keep_msgs
     return msgs
 
-  def _drain_rx(self):
-    messaging.drain_sock_raw(self.logcan)
-    self.msg_buffer = defaultdict(list)
-
   def _create_isotp_msg(self, tx_addr: int, sub_addr: int | None, rx_addr: int):
     can_client = CanClient(self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
                            self.bus, sub_addr=sub_addr, debug=self.debug)
@@ -76,98 +90,213 @@ class IsoTpParallelQuery:
     # as well as reduces chances we process messages from previous queries
     return IsoTpMessage(can_client, timeout=0, separation_time=0.01, debug=self.debug, max_len=max_len)
 
-  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
-    self._drain_rx()
+  def start(self, timeout: float) -> None:
+    """Sends the first request to all addresses, responses are handled by update"""
+    self.timeout = timeout
+    self.rx_buffer.listen(self.bus, list(self.msg_addrs.values()))
 
     # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
+    self.msgs = {}
+    self.request_counter = {}
+    self.request_done = {}
     for tx_addr, rx_addr in self.msg_addrs.items():
-      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
+      self.msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+      self.request_counter[tx_addr] = 0
+      self.request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
       for addr in self.functional_addrs:
         self._create_isotp_msg(addr, None, -1).send(self.request[0])
 
-    # Send first frame (single or first) to all addresses and receive asynchronously in the loop below.
+    # Send first frame (single or first) to all addresses and receive asynchronously in update.
     # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
-    for msg in msgs.values():
+    for msg in self.msgs.values():
       msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
 
-    results = {}
+    self.results: dict[AddrType, bytes] = {}
+    self.addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
+    self.response_timeouts = {tx_addr: time.monotonic() + timeout for tx_addr in self.msg_addrs}
+
+  def update(self) -> bool:
+    """Processes received frames, sending follow-up requests. Returns True when all requests are done (finished or timed out)"""
+    cur_time = time.monotonic()
+    for tx_addr, msg in self.msgs.items():
+      if self.request_done[tx_addr]:
+        continue
+
+      try:
+        dat, rx_in_progress = msg.recv()
+      except Exception:
+        cloudlog.exception(f"Error processing UDS response: {tx_addr}")
+        self.request_done[tx_addr] = True
+        continue
+
+      # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
+      if rx_in_progress:
+        self.addrs_responded.add(tx_addr)
+        self.response_timeouts[tx_addr] = cur_time + self.timeout
+
+      if dat is None:
+        continue
+
+      # Log unexpected empty responses
+      if len(dat) == 0:
+        cloudlog.error(f"iso-tp query empty response: {tx_addr}")
+        self.request_done[tx_addr] = True
+        continue
+
+      counter = self.request_counter[tx_addr]
+      expected_response = self.response[counter]
+      response_valid = dat.startswith(expected_response)
+
+      if response_valid:
+        if counter + 1 < len(self.request):
+          self.response_timeouts[tx_addr] = cur_time + self.timeout
+          msg.send(self.request[counter + 1])
+          self.request_counter[tx_addr] += 1
+        else:
+          self.results[tx_addr] = dat[len(expected_response):]
+          self.request_done[tx_addr] = True
+      else:
+        error_code = dat[2] if len(dat) > 2 else -1
+        if error_code == 0x78:
+          self.response_timeouts[tx_addr] = cur_time + self.response_pending_timeout
+          cloudlog.error(f"iso-tp query response pending: {tx_addr}")
+        else:
+          self.request_done[tx_addr] = True
+          cloudlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+
+    # Mark request done if address timed out
+    for tx_addr in self.response_timeouts:
+      if cur_time - self.response_timeouts[tx_addr] > 0:
+        if not self.request_done[tx_addr]:
+          if self.request_counter[tx_addr] > 0:
+            cloudlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+          elif tx_addr in self.addrs_responded:
+            cloudlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+          # TODO: handle functional addresses
+          # else:
+          #   cloudlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+        self.request_done[tx_addr] = True
+
+    return all(self.request_done.values())
+
+  def needs_update(self, cur_time: float) -> bool:
+    """Returns if there are received frames to process, or a response may have timed out"""
+    return any(len(self.rx_buffer.frames.get((self.bus, rx_addr), ())) for rx_addr in self.msg_addrs.values()) or \
+           any(cur_time > self.response_timeouts[tx_addr] for tx_addr, done in self.request_done.items() if not done)
+
+  def finish(self) -> dict[AddrType, bytes]:
+    self.rx_buffer.unlisten(self.bus, list(self.msg_addrs.values()))
+    return self.results
+
+  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+    self.rx_buffer.drain()
+    self.start(timeout)
+
     start_time = time.monotonic()
-    addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
     while True:
-      self.rx()
+      self.rx_buffer.rx()
 
-      for tx_addr, msg in msgs.items():
-        try:
-          dat, rx_in_progress = msg.recv()
-        except Exception:
-          cloudlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
-        if rx_in_progress:
-          addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
-
-        if dat is None:
-          continue
-
-        # Log unexpected empty responses
-        if len(dat) == 0:
-          cloudlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat.startswith(expected_response)
-
-        if response_valid:
-          if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
-        else:
-          error_code = dat[2] if len(dat) > 2 else -1
-          if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
-            cloudlog.error(f"iso-tp query response pending: {tx_addr}")
+      if self.update():
+        break
+
+      if time.monotonic() - start_time > total_timeout:
+        cloudlog.error("iso-tp query timeout while receiving data")
+        break
+
+    return self.finish()
+
+
+class IsoTpQueryScheduler:
+  """Runs many queries from one receive loop. Each query starts as soon as no running query uses
+  its addresses, so requests to one ECU are sent in order as soon as it has responded, while
+  requests to different ECUs and buses are interleaved."""
+  def __init__(self, sendcan: messaging.PubSocket, logcan: messaging.SubSocket, max_active: int = 128, debug: bool = False) -> None:
+    self.sendcan = sendcan
+    self.logcan = logcan
+    self.max_active = max_active
+    self.debug = debug
+    self.rx_buffer = CanRxBuffer(logcan)
+    self.queries: list[IsoTpParallelQuery] = []
+
+  def add_query(self, bus: int, addrs: list[int] | list[AddrType], request: list[bytes], response: list[bytes],
+                response_offset: int = 0x8) -> IsoTpParallelQuery:
+    query = IsoTpParallelQuery(self.sendcan, self.logcan, bus, addrs, request, response, response_offset,
+                               debug=self.debug, rx_buffer=self.rx_buffer)
+    self.queries.append(query)
+    return query
+
+  @staticmethod
+  def _query_resources(query: IsoTpParallelQuery) -> set[tuple[int, int]]:
+    # ECUs behind one transmit address (sub-addresses) are queried one at a time
+    return {(query.bus, tx_addr) for tx_addr, _ in query.msg_addrs} | {(query.bus, rx_addr) for rx_addr in query.msg_addrs.values()}
+
+  @staticmethod
+  def _fail(query: IsoTpParallelQuery) -> dict[AddrType, bytes]:
+    # A failed query is done without data, the other queries keep running
+    cloudlog.exception(f"iso-tp query exception: {query.bus} - {list(query.msg_addrs)}")
+    try:
+      query.finish()
+    except Exception:
+      cloudlog.exception("iso-tp query exception while finishing")
+    return {}
+
+  def run(self, timeout: float, total_timeout: float = 60.) -> Iterator[tuple[IsoTpParallelQuery, dict[AddrType, bytes]]]:
+    """Yields each query with its results as soon as it is done, a query that raises is yielded without results"""
+    pending = [(query, self._query_resources(query)) for query in self.queries]
+    self.queries = []
+    active: dict[IsoTpParallelQuery, set[tuple[int, int]]] = {}
+    busy: set[tuple[int, int]] = set()
+
+    self.rx_buffer.drain()
+    start_time = time.monotonic()
+    while len(pending) or len(active):
+      # Start queries in order, a query can't overtake an earlier one that's waiting on the same address
+      if len(pending) and len(active) < self.max_active:
+        blocked = set(busy)
+        waiting = []
+        failed = []
+        for query, resources in pending:
+          if len(active) < self.max_active and not (resources & blocked):
+            try:
+              query.start(timeout)
+            except Exception:
+              # logged while handling the exception, so the traceback is kept
+              failed.append((query, self._fail(query)))
+              continue
+            active[query] = resources
+            busy |= resources
           else:
-            request_done[tx_addr] = True
-            cloudlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+            waiting.append((query, resources))
+          blocked |= resources
+        pending = waiting
+        for query, results in failed:
+          yield query, results
 
-      # Mark request done if address timed out
+      self.rx_buffer.rx()
+
+      # Queries without new frames or timeouts have nothing to do
       cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              cloudlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              cloudlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   cloudlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
-
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
-        break
+      for query in list(active):
+        try:
+          done = query.needs_update(cur_time) and query.update()
+          results = query.finish() if done else None
+        except Exception:
+          done, results = True, self._fail(query)
+        if done:
+          busy -= active.pop(query)
+          yield query, results
 
-      if cur_time - start_time > total_timeout:
+      if time.monotonic() - start_time > total_timeout:
         cloudlog.error("iso-tp query timeout while receiving data")
+        for query in active:
+          try:
+            results = query.finish()
+          except Exception:
+            results = self._fail(query)
+          yield query, results
+        for query, _ in pending:
+          cloudlog.error(f"iso-tp query not started before timeout: {query.bus} - {list(query.msg_addrs)}")
         break
-
-    return results
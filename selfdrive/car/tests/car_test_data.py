@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Preprocessed CAN data of the car test routes, cached on disk.
+
+Reading a segment through LogReader and re-serializing every can event dominates
+the runtime of test_models, so the parts the tests need are extracted once per
+segment and stored in a compressed npz file in the download cache, which is
+shared between test processes. Build the caches for all test routes in parallel
+with: ./car_test_data.py -j 8
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import NamedTuple
+
+import numpy as np
+
+from cereal import car
+from openpilot.common.basedir import BASEDIR
+from openpilot.common.realtime import DT_CTRL
+from openpilot.selfdrive.car import gen_empty_fingerprint
+from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT
+from openpilot.selfdrive.car.fingerprints import MIGRATION
+from openpilot.selfdrive.car.tests.routes import CarTestRoute, routes
+from openpilot.selfdrive.test.helpers import read_segment_list
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.logreader import LogReader, internal_source, openpilotci_source
+from openpilot.tools.lib.route import SegmentName
+
+SafetyModel = car.CarParams.SafetyModel
+
+# bump when the extracted data or file format changes
+CACHE_VERSION = 2
+NO_CACHE = os.environ.get("NO_CAR_TEST_CACHE", "0") == "1"
+
+
+class CanPacket(NamedTuple):
+  log_mono_time: int
+  dat: bytes  # serialized can event, as passed to CarInterface.update
+  frames: list[tuple[int, bytes, int]]  # (address, dat, src)
+
+
+@dataclass
+class CarTestData:
+  can_msgs: list[CanPacket]
+  fingerprint: dict[int, dict[int, int]]
+  car_fw: list
+  experimental_long: bool = False
+  elm_frame: int | None = None
+  car_safety_mode_frame: int | None = None
+  live_car_fingerprint: str | None = None  # platform of the live carParams, as logged
+  on_bucket: bool = True  # whether the segment was read from the preserved CI bucket
+
+  @property
+  def car_fingerprint(self) -> str | None:
+    # migrated when used, so the cache doesn't go stale when MIGRATION changes
+    if self.live_car_fingerprint is None:
+      return None
+    return MIGRATION.get(self.live_car_fingerprint, self.live_car_fingerprint)
+
+  @classmethod
+  def from_logreader(cls, lr) -> 'CarTestData':
+    data = cls([], gen_empty_fingerprint(), [])
+    can_msgs = []
+    for msg in lr:
+      if msg.which() == "can":
+        can_msgs.append(msg)
+        if len(can_msgs) <= FRAME_FINGERPRINT:
+          for m in msg.can:
+            if m.src < 64:
+              data.fingerprint[m.src][m.address] = len(m.dat)
+
+      elif msg.which() == "carParams":
+        data.car_fw = list(msg.carParams.carFw)
+        if msg.carParams.openpilotLongitudinalControl:
+          data.experimental_long = True
+        if data.live_car_fingerprint is None:
+          data.live_car_fingerprint = msg.carParams.carFingerprint
+
+      # Log which can frame the panda safety mode left ELM327, for CAN validity checks
+      elif msg.which() == 'pandaStates':
+        for ps in msg.pandaStates:
+          if data.elm_frame is None and ps.safetyModel != SafetyModel.elm327:
+            data.elm_frame = len(can_msgs)
+          if data.car_safety_mode_frame is None and ps.safetyModel not in \
+            (SafetyModel.elm327, SafetyModel.noOutput):
+            data.car_safety_mode_frame = len(can_msgs)
+
+      elif msg.which() == 'pandaStateDEPRECATED':
+        if data.elm_frame is None and msg.pandaStateDEPRECATED.safetyModel != SafetyModel.elm327:
+          data.elm_frame = len(can_msgs)
+        if data.car_safety_mode_frame is None and msg.pandaStateDEPRECATED.safetyModel not in \
+          (SafetyModel.elm327, SafetyModel.noOutput):
+          data.car_safety_mode_frame = len(can_msgs)
+
+    if len(can_msgs) <= int(50 / DT_CTRL):
+      raise Exception("no can data found")
+
+    # frame markers above are indexes in log order, the packets are replayed in logMonoTime order
+    data.can_msgs = [CanPacket(m.logMonoTime, m.as_builder().to_bytes(), [(f.address, f.dat, f.src) for f in m.can])
+                     for m in sorted(can_msgs, key=lambda m: m.logMonoTime)]
+    return data
+
+  def save(self, path: str) -> None:
+    frames = [f for m in self.can_msgs for f in m.frames]
+    fingerprint = [(bus, addr, size) for bus, addrs in self.fingerprint.items() for addr, size in addrs.items()]
+    meta = {
+      'experimental_long': self.experimental_long,
+      'elm_frame': self.elm_frame,
+      'car_safety_mode_frame': self.car_safety_mode_frame,
+      'live_car_fingerprint': self.live_car_fingerprint,
+    }
+
+    arrays = {
+      'meta': np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+      'log_mono_time': np.array([m.log_mono_time for m in self.can_msgs], dtype=np.uint64),
+      'packet_offsets': np.cumsum([0] + [len(m.dat) for m in self.can_msgs], dtype=np.int64),
+      'packet_data': np.frombuffer(b''.join(m.dat for m in self.can_msgs), dtype=np.uint8),
+      'frame_offsets': np.cumsum([0] + [len(m.frames) for m in self.can_msgs], dtype=np.int64),
+      'address': np.array([f[0] for f in frames], dtype=np.uint32),
+      'src': np.array([f[2] for f in frames], dtype=np.uint8),
+      'dat_offsets': np.cumsum([0] + [len(f[1]) for f in frames], dtype=np.int64),
+      'dat': np.frombuffer(b''.join(f[1] for f in frames), dtype=np.uint8),
+      'fingerprint': np.array(fingerprint, dtype=np.uint32).reshape(-1, 3),
+      'car_fw': np.frombuffer(car.CarParams.new_message(carFw=self.car_fw).to_bytes(), dtype=np.uint8),
+    }
+
+    # written to a temporary file and renamed, so concurrent readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.npz', delete=False) as f:
+      np.savez_compressed(f, **arrays)
+    os.replace(f.name, path)
+
+  @classmethod
+  def load(cls, path: str) -> 'CarTestData':
+    with np.load(path) as npz:
+      arrays = {k: npz[k] for k in npz.files}
+
+    meta = json.loads(arrays['meta'].tobytes())
+    packet_data = arrays['packet_data'].tobytes()
+    packet_offsets = arrays['packet_offsets'].tolist()
+    dat = arrays['dat'].tobytes()
+    dat_offsets = arrays['dat_offsets'].tolist()
+    frames = [(addr, dat[dat_offsets[i]:dat_offsets[i + 1]], src) for i, (addr, src) in
+              enumerate(zip(arrays['address'].tolist(), arrays['src'].tolist(), strict=True))]
+    frame_offsets = arrays['frame_offsets'].tolist()
+
+    can_msgs = [CanPacket(t, packet_data[packet_offsets[i]:packet_offsets[i + 1]], frames[frame_offsets[i]:frame_offsets[i + 1]])
+                for i, t in enumerate(arrays['log_mono_time'].tolist())]
+
+    fingerprint = gen_empty_fingerprint()
+    for bus, addr, size in arrays['fingerprint'].tolist():
+      fingerprint[bus][addr] = size
+
+    with car.CarParams.from_bytes(arrays['car_fw'].tobytes()) as CP:
+      car_fw = [fw.as_builder() for fw in CP.carFw]
+
+    return cls(can_msgs, fingerprint, car_fw, **meta)
+
+
+def get_cache_path(segment: str, source_name: str) -> str:
+  # the source is part of the key, a segment read from the CI bucket and from elsewhere are cached separately
+  return os.path.join(Paths.download_cache_root(), "car_test_data",
+                      f"{segment.replace('|', '_').replace('/', '--')}.{source_name}.v{CACHE_VERSION}.npz")
+
+
+def read_segment(segment: str, internal: bool = False, on_bucket: bool = True) -> CarTestData:
+  """Returns the test data of a segment, from the cache if it was read before from the same source"""
+  source = None
+  source_name = "any"
+  if on_bucket:
+    source = internal_source if internal else openpilotci_source
+    source_name = "internal" if internal else "ci"
+
+  path = get_cache_path(segment, source_name)
+  if not NO_CACHE and os.path.isfile(path):
+    try:
+      data = CarTestData.load(path)
+      data.on_bucket = on_bucket
+      return data
+    except Exception:
+      pass
+
+  data = CarTestData.from_logreader(LogReader(segment, default_source=source))
+  data.on_bucket = on_bucket
+
+  if not NO_CACHE:
+    data.save(path)
+  return data
+
+
+def get_car_test_data(test_route: CarTestRoute, internal: bool = False) -> CarTestData:
+  test_segs = (2, 1, 0)
+  if test_route.segment is not None:
+    test_segs = (test_route.segment,)
+
+  for seg in test_segs:
+    try:
+      return read_segment(f"{test_route.route}/{seg}", internal)
+    except Exception:
+      pass
+
+  # Route is not in CI bucket, assume either user has access (private), or it is public
+  # test_route_on_ci_bucket will fail when running in CI
+  if not internal:
+    for seg in test_segs:
+      try:
+        return read_segment(f"{test_route.route}/{seg}", on_bucket=False)
+      except Exception:
+        pass
+
+  raise Exception(f"Route: {repr(test_route.route)} with segments: {test_segs} not found or no CAN msgs found. Is it uploaded and public?")
+
+
+def _cache_route(args: tuple[CarTestRoute, bool]) -> tuple[CarTestRoute, str | None]:
+  test_route, internal = args
+  try:
+    get_car_test_data(test_route, internal)
+    return test_route, None
+  except Exception as e:
+    return test_route, str(e)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Build the CAN data caches of the car test routes",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of routes to read in parallel")
+  parser.add_argument("--seg-list", help="segment list to cache instead of the test routes, as INTERNAL_SEG_LIST")
+  parser.add_argument("--seg-cnt", type=int, default=0, help="number of random segments to cache from the list")
+  args = parser.parse_args()
+
+  if args.seg_list:
+    segment_list = read_segment_list(os.path.join(BASEDIR, args.seg_list))
+    segment_list = random.sample(segment_list, args.seg_cnt or len(segment_list))
+    test_routes = []
+    for platform, segment in segment_list:
+      segment_name = SegmentName(segment)
+      test_routes.append(CarTestRoute(segment_name.route_name.canonical_name, platform, segment=segment_name.segment_num))
+  else:
+    test_routes = routes
+
+  # the cache is written to the shared download cache, where the tests read it from
+  os.environ.setdefault("COMMA_CACHE", Paths.download_cache_root().rstrip("/"))
+  with Pool(args.jobs) as pool:
+    for test_route, error in pool.imap_unordered(_cache_route, [(r, bool(args.seg_list)) for r in test_routes]):
+      print(f"{test_route.car_model}: {test_route.route} {error or 'cached'}")
@@ -2,7 +2,8 @@ from parameterized import parameterized
 
 from cereal import log, messaging
 from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from openpilot.selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from openpilot.selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS, _DEBUG_ADDRESS, cars_from_mask, \
+                                                eliminate_incompatible_cars, eliminate_incompatible_frames, is_valid_for_fingerprint
 
 
 class TestCanFingerprint:
@@ -24,6 +25,25 @@ class TestCanFingerprint:
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_fingerprint_index(self):
+    """Tests the (address, length) index against checking every fingerprint of every car"""
+    messages = {(address, length) for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints
+                for address, length in fingerprint.items()}
+    messages |= {(address, length + 1) for address, length in list(messages)[::10]}
+    messages |= {(0x800, 8), (1880, 8)}
+
+    for address, length in sorted(messages):
+      msg = log.CanData(address=address, dat=b'\x00' * length)
+      expected = [car_model for car_model, fingerprints in FINGERPRINTS.items()
+                  if any(is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS) for fingerprint in fingerprints)]
+      assert eliminate_incompatible_cars(msg, list(FINGERPRINTS)) == expected
+      assert cars_from_mask(eliminate_incompatible_frames([(address, length)])) == expected
+
+  @parameterized.expand(list(FINGERPRINTS.items()))
+  def test_eliminate_incompatible_frames(self, car_model, fingerprints):
+    for fingerprint in fingerprints:
+      assert car_model in cars_from_mask(eliminate_incompatible_frames(fingerprint.items()))
+
   def test_timing(self, subtests):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
@@ -8,10 +8,11 @@ from parameterized import parameterized
 from cereal import car, messaging
 from openpilot.common.realtime import DT_CTRL
 from openpilot.selfdrive.car import gen_empty_fingerprint
-from openpilot.selfdrive.car.car_helpers import interfaces
+from openpilot.selfdrive.car.car_helpers import interfaces, interface_names, load_interfaces
 from openpilot.selfdrive.car.fingerprints import all_known_cars
 from openpilot.selfdrive.car.fw_versions import FW_VERSIONS, FW_QUERY_CONFIGS
 from openpilot.selfdrive.car.interfaces import get_interface_attr
+from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
 from openpilot.selfdrive.controls.lib.latcontrol_angle import LatControlAngle
 from openpilot.selfdrive.controls.lib.latcontrol_pid import LatControlPID
 from openpilot.selfdrive.controls.lib.latcontrol_torque import LatControlTorque
@@ -156,3 +157,12 @@ class TestCarInterfaces:
     ret = get_interface_attr('FINGERPRINTS', ignore_none=True)
     none_brands_in_ret = none_brands.intersection(ret)
     assert len(none_brands_in_ret) == 0, f'Brands with None values in ignore_none=True result: {none_brands_in_ret}'
+
+  def test_interfaces_loaded_lazily(self):
+    lazy_interfaces = load_interfaces(interface_names)
+    assert set(all_known_cars()) <= set(lazy_interfaces)
+    assert len(lazy_interfaces.loaded) == 0
+
+    # only the brand of the looked up platform is loaded
+    assert lazy_interfaces[TOYOTA.TOYOTA_RAV4] == interfaces[TOYOTA.TOYOTA_RAV4]
+    assert set(lazy_interfaces.loaded) == {'toyota'}
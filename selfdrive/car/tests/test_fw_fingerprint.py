@@ -1,5 +1,6 @@
 import pytest
 import random
+import sys
 import time
 from collections import defaultdict
 from parameterized import parameterized
@@ -8,7 +9,9 @@ from cereal import car
 from openpilot.selfdrive.car.car_helpers import interfaces
 from openpilot.selfdrive.car.fingerprints import FW_VERSIONS
 from openpilot.selfdrive.car.fw_versions import ESSENTIAL_ECUS, FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                                match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_present_ecus
+                                                match_fw_to_car, match_fw_to_car_exact, get_brand_ecu_matches, get_fw_match_index, \
+                                                get_fw_versions, get_present_ecus, match_fw_to_car_batch, build_fw_dicts
+from openpilot.selfdrive.car.isotp_parallel_query import IsoTpQueryScheduler
 from openpilot.selfdrive.car.vin import get_vin
 
 CarFw = car.CarParams.CarFw
@@ -102,6 +105,45 @@ class TestFwFingerprint:
       elif len(matches):
         self.assertFingerprints(matches, car_model)
 
+  def test_fw_match_index(self, subtests):
+    # Asserts the match index is complete, and that an unknown FW version on an essential ECU invalidates the car
+    for brand, cars in VERSIONS.items():
+      index = get_fw_match_index(brand)
+      assert set(index.ecus) == set(cars)
+      for car_model, ecus in cars.items():
+        with subtests.test(car_model=car_model.value):
+          live_fw_versions = {(addr, sub_addr): set(fws) for (_, addr, sub_addr), fws in ecus.items()}
+          assert car_model in index.match_exact(live_fw_versions)
+
+          essential_ecus = [ecu for ecu, can_be_missing in index.ecus[car_model] if not can_be_missing]
+          if len(essential_ecus):
+            addr = essential_ecus[0][1:]
+            live_fw_versions[addr] = {b'\xde\xad'}
+            assert car_model not in index.match_exact(live_fw_versions)
+            assert car_model in match_fw_to_car_exact(live_fw_versions, brand, extra_fw_versions={car_model: {essential_ecus[0]: [b'\xde\xad']}})
+
+  def test_match_batch(self):
+    # Asserts the batch API matches each FW list like match_fw_to_car, including repeated lists
+    random.seed(0)
+    fw_lists, vins = [], []
+    for brand, cars in VERSIONS.items():
+      for ecus in cars.values():
+        fw = [{"ecu": ecu_name, "fwVersion": random.choice(fw_versions), 'brand': brand, "address": addr,
+               "subAddress": 0 if sub_addr is None else sub_addr} for (ecu_name, addr, sub_addr), fw_versions in ecus.items()]
+        # every other car has an unknown version on one ECU, which only allows a fuzzy match
+        if len(fw_lists) % 2:
+          fw[0]["fwVersion"] = b'\xde\xad'
+        fw_lists.append(car.CarParams.new_message(carFw=fw).carFw)
+        vins.append("1" * 17)
+    fw_lists += fw_lists[:10] + [[]]
+    vins += vins[:10] + ["1" * 17]
+
+    batch_matches = match_fw_to_car_batch(fw_lists, vins, log=False)
+    assert len(batch_matches) == len(fw_lists)
+    for fw, vin, batch_match in zip(fw_lists, vins, batch_matches, strict=True):
+      assert batch_match == match_fw_to_car(fw, vin, log=False)
+      assert build_fw_dicts(fw) == {brand: build_fw_dict(fw, filter_brand=brand) for brand in VERSIONS}
+
   def test_fw_version_lists(self, subtests):
     for car_model, ecus in FW_VERSIONS.items():
       with subtests.test(car_model=car_model.value):
@@ -221,11 +263,19 @@ class TestFwFingerprintTiming:
     self.total_time += timeout
     return {}
 
+  def fake_rx(self):
+    """No ECUs respond, pandad sends can at 100Hz"""
+    self.total_time += 0.01
+
+  def fake_monotonic(self):
+    return self.total_time
+
   def _benchmark_brand(self, brand, num_pandas, mocker):
     fake_socket = FakeSocket()
     self.total_time = 0
     mocker.patch("openpilot.selfdrive.car.fw_versions.set_obd_multiplexing", self.fake_set_obd_multiplexing)
-    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data)
+    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.CanRxBuffer.rx", self.fake_rx)
+    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.time", monotonic=self.fake_monotonic)
     for _ in range(self.N):
       # Treat each brand as the most likely (aka, the first) brand with OBD multiplexing initially on
       self.current_obd_multiplexing = True
@@ -268,27 +318,49 @@ class TestFwFingerprintTiming:
         self._assert_timing(self.total_time / self.N, vin_ref_times[name])
         print(f'get_vin {name} case, query time={self.total_time / self.N} seconds')
 
+  def test_scheduler_query_exception(self, mocker):
+    # A query that raises is done without data, without stopping the queries after it
+    fake_socket = FakeSocket()
+    self.total_time = 0.0
+    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.CanRxBuffer.rx", self.fake_rx)
+    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.time", monotonic=self.fake_monotonic)
+
+    scheduler = IsoTpQueryScheduler(fake_socket, fake_socket)
+    queries = [scheduler.add_query(0, [addr], [b'\x22\xf1\x90'], [b'\x62\xf1\x90']) for addr in (0x7e0, 0x7e0, 0x7e1, 0x7e2)]
+    mocker.patch.object(queries[0], "start", side_effect=Exception)
+    mocker.patch.object(queries[2], "update", side_effect=Exception)
+    # each failure is logged while its exception is handled, so the traceback is logged with it
+    logged_exceptions = []
+    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.cloudlog.exception", lambda *_: logged_exceptions.append(sys.exc_info()[0]))
+
+    results = list(scheduler.run(0.1))
+    assert len(logged_exceptions) >= 2 and None not in logged_exceptions
+    assert {query for query, _ in results} == set(queries)
+    assert all(data == {} for _, data in results)
+    # the failed query released its address, the next query on it ran to its timeout
+    assert self.total_time < 0.5
+
   def test_fw_query_timing(self, subtests, mocker):
-    total_ref_time = {1: 7.2, 2: 7.8}
+    total_ref_time = {1: 5.6, 2: 5.6}
     brand_ref_times = {
       1: {
-        'gm': 1.0,
+        'gm': 1.1,
         'body': 0.1,
-        'chrysler': 0.3,
-        'ford': 1.5,
-        'honda': 0.45,
-        'hyundai': 0.65,
+        'chrysler': 0.2,
+        'ford': 1.2,
+        'honda': 0.4,
+        'hyundai': 0.6,
         'mazda': 0.1,
-        'nissan': 0.8,
-        'subaru': 0.65,
-        'tesla': 0.3,
-        'toyota': 0.7,
-        'volkswagen': 0.65,
+        'nissan': 0.45,
+        'subaru': 0.6,
+        'tesla': 0.2,
+        'toyota': 0.45,
+        'volkswagen': 0.25,
       },
       2: {
-        'ford': 1.6,
-        'hyundai': 1.15,
-        'tesla': 0.3,
+        'ford': 1.2,
+        'hyundai': 0.6,
+        'tesla': 0.2,
       }
     }
 
@@ -1,4 +1,3 @@
-import capnp
 import os
 import importlib
 import pytest
@@ -6,6 +5,7 @@ import random
 import unittest # noqa: TID251
 from collections import defaultdict, Counter
 import hypothesis.strategies as st
+import numpy as np
 from hypothesis import Phase, given, settings
 from parameterized import parameterized_class
 
@@ -13,16 +13,16 @@ from cereal import messaging, log, car
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.params import Params
 from openpilot.common.realtime import DT_CTRL
-from openpilot.selfdrive.car import gen_empty_fingerprint
 from openpilot.selfdrive.car.card import Car
-from openpilot.selfdrive.car.fingerprints import all_known_cars, MIGRATION
-from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, interfaces
+from openpilot.selfdrive.car.fingerprints import all_known_cars
+from openpilot.selfdrive.car.car_helpers import interfaces
+from openpilot.selfdrive.car.interfaces import get_field_value
 from openpilot.selfdrive.car.honda.values import CAR as HONDA, HondaFlags
+from openpilot.selfdrive.car.tests.car_test_data import CanPacket, CarTestData, get_car_test_data
 from openpilot.selfdrive.car.tests.routes import non_tested_cars, routes, CarTestRoute
 from openpilot.selfdrive.car.values import Platform
 from openpilot.selfdrive.test.helpers import read_segment_list
 from openpilot.system.hardware.hw import DEFAULT_DOWNLOAD_CACHE_ROOT
-from openpilot.tools.lib.logreader import LogReader, internal_source, openpilotci_source
 from openpilot.tools.lib.route import SegmentName
 
 from panda.tests.libpanda import libpanda_py
@@ -38,6 +38,11 @@ INTERNAL_SEG_CNT = int(os.environ.get("INTERNAL_SEG_CNT", "0"))
 MAX_EXAMPLES = int(os.environ.get("MAX_EXAMPLES", "300"))
 CI = os.environ.get("CI", None) is not None
 
+CAR_STATE_FIELDS = ['vEgo', 'aEgo', 'vEgoRaw', 'vEgoCluster', 'standstill', 'steeringAngleDeg', 'steeringRateDeg',
+                    'steeringTorque', 'steeringPressed', 'gas', 'gasPressed', 'brake', 'brakePressed', 'gearShifter',
+                    'leftBlinker', 'rightBlinker', 'cruiseState.enabled', 'cruiseState.available', 'cruiseState.speed',
+                    'cruiseState.speedCluster', 'canValid', 'canTimeout']
+
 
 def get_test_cases() -> list[tuple[str, CarTestRoute | None]]:
   # build list of test cases
@@ -68,88 +73,22 @@ class TestCarModelBase(unittest.TestCase):
   test_route: CarTestRoute | None = None
   test_route_on_bucket: bool = True  # whether the route is on the preserved CI bucket
 
-  can_msgs: list[capnp.lib.capnp._DynamicStructReader]
+  can_msgs: list[CanPacket]
   fingerprint: dict[int, dict[int, int]]
   elm_frame: int | None
   car_safety_mode_frame: int | None
 
   @classmethod
-  def get_testing_data_from_logreader(cls, lr):
-    car_fw = []
-    can_msgs = []
-    cls.elm_frame = None
-    cls.car_safety_mode_frame = None
-    cls.fingerprint = gen_empty_fingerprint()
-    experimental_long = False
-    for msg in lr:
-      if msg.which() == "can":
-        can_msgs.append(msg)
-        if len(can_msgs) <= FRAME_FINGERPRINT:
-          for m in msg.can:
-            if m.src < 64:
-              cls.fingerprint[m.src][m.address] = len(m.dat)
-
-      elif msg.which() == "carParams":
-        car_fw = msg.carParams.carFw
-        if msg.carParams.openpilotLongitudinalControl:
-          experimental_long = True
-        if cls.platform is None and not cls.test_route_on_bucket:
-          live_fingerprint = msg.carParams.carFingerprint
-          cls.platform = MIGRATION.get(live_fingerprint, live_fingerprint)
-
-      # Log which can frame the panda safety mode left ELM327, for CAN validity checks
-      elif msg.which() == 'pandaStates':
-        for ps in msg.pandaStates:
-          if cls.elm_frame is None and ps.safetyModel != SafetyModel.elm327:
-            cls.elm_frame = len(can_msgs)
-          if cls.car_safety_mode_frame is None and ps.safetyModel not in \
-            (SafetyModel.elm327, SafetyModel.noOutput):
-            cls.car_safety_mode_frame = len(can_msgs)
-
-      elif msg.which() == 'pandaStateDEPRECATED':
-        if cls.elm_frame is None and msg.pandaStateDEPRECATED.safetyModel != SafetyModel.elm327:
-          cls.elm_frame = len(can_msgs)
-        if cls.car_safety_mode_frame is None and msg.pandaStateDEPRECATED.safetyModel not in \
-          (SafetyModel.elm327, SafetyModel.noOutput):
-          cls.car_safety_mode_frame = len(can_msgs)
-
-    if len(can_msgs) > int(50 / DT_CTRL):
-      return car_fw, can_msgs, experimental_long
-
-    raise Exception("no can data found")
-
-  @classmethod
-  def get_testing_data(cls):
-    test_segs = (2, 1, 0)
-    if cls.test_route.segment is not None:
-      test_segs = (cls.test_route.segment,)
-
-    is_internal = len(INTERNAL_SEG_LIST)
-
-    for seg in test_segs:
-      segment_range = f"{cls.test_route.route}/{seg}"
-
-      try:
-        lr = LogReader(segment_range, default_source=internal_source if is_internal else openpilotci_source)
-        return cls.get_testing_data_from_logreader(lr)
-      except Exception:
-        pass
-
-    # Route is not in CI bucket, assume either user has access (private), or it is public
-    # test_route_on_ci_bucket will fail when running in CI
-    if not is_internal:
-      cls.test_route_on_bucket = False
-
-      for seg in test_segs:
-        segment_range = f"{cls.test_route.route}/{seg}"
-        try:
-          lr = LogReader(segment_range)
-          return cls.get_testing_data_from_logreader(lr)
-        except Exception:
-          pass
-
-    raise Exception(f"Route: {repr(cls.test_route.route)} with segments: {test_segs} not found or no CAN msgs found. Is it uploaded and public?")
+  def get_testing_data(cls) -> CarTestData:
+    data = get_car_test_data(cls.test_route, internal=len(INTERNAL_SEG_LIST) > 0)
+    cls.test_route_on_bucket = data.on_bucket
+    if cls.platform is None and not cls.test_route_on_bucket:
+      cls.platform = data.car_fingerprint
 
+    cls.fingerprint = data.fingerprint
+    cls.elm_frame = data.elm_frame
+    cls.car_safety_mode_frame = data.car_safety_mode_frame
+    return data
 
   @classmethod
   def setUpClass(cls):
@@ -162,15 +101,15 @@ class TestCarModelBase(unittest.TestCase):
         raise unittest.SkipTest
       raise Exception(f"missing test route for {cls.platform}")
 
-    car_fw, can_msgs, experimental_long = cls.get_testing_data()
+    data = cls.get_testing_data()
 
     # if relay is expected to be open in the route
     cls.openpilot_enabled = cls.car_safety_mode_frame is not None
 
-    cls.can_msgs = sorted(can_msgs, key=lambda msg: msg.logMonoTime)
+    cls.can_msgs = data.can_msgs
 
     cls.CarInterface, cls.CarController, cls.CarState = interfaces[cls.platform]
-    cls.CP = cls.CarInterface.get_params(cls.platform,  cls.fingerprint, car_fw, experimental_long, docs=False)
+    cls.CP = cls.CarInterface.get_params(cls.platform,  cls.fingerprint, data.car_fw, data.experimental_long, docs=False)
     assert cls.CP
     assert cls.CP.carFingerprint == cls.platform
 
@@ -217,8 +156,8 @@ class TestCarModelBase(unittest.TestCase):
     CC = car.CarControl.new_message().as_reader()
 
     for i, msg in enumerate(self.can_msgs):
-      CS = self.CI.update(CC, (msg.as_builder().to_bytes(),))
-      self.CI.apply(CC, msg.logMonoTime)
+      CS = self.CI.update(CC, (msg.dat,))
+      self.CI.apply(CC, msg.log_mono_time)
 
       if CS.canValid:
         can_valid = True
@@ -229,6 +168,24 @@ class TestCarModelBase(unittest.TestCase):
 
     self.assertEqual(can_invalid_cnt, 0)
 
+  def test_car_interface_batch(self):
+    # the offline batch path must match the realtime path step for step, checked on 10s from the middle of the segment
+    CC = car.CarControl.new_message().as_reader()
+    start = len(self.can_msgs) // 2
+    can_packets = [[msg.dat] for msg in self.can_msgs[start:start + int(10 / DT_CTRL)]]
+
+    CI = self.CarInterface(self.CP.copy(), self.CarController, self.CarState)
+    expected = {field: [] for field in CAR_STATE_FIELDS}
+    for can_strings in can_packets:
+      CS = CI.update(CC, can_strings)
+      for field, values in expected.items():
+        values.append(get_field_value(CS, field))
+
+    CI = self.CarInterface(self.CP.copy(), self.CarController, self.CarState)
+    columns = CI.update_batch(CC, can_packets, CAR_STATE_FIELDS)
+    for field, values in expected.items():
+      np.testing.assert_array_equal(columns[field], np.array(values, dtype=columns[field].dtype), err_msg=field)
+
   def test_radar_interface(self):
     RadarInterface = importlib.import_module(f'selfdrive.car.{self.CP.carName}.radar_interface').RadarInterface
     RI = RadarInterface(self.CP)
@@ -238,7 +195,7 @@ class TestCarModelBase(unittest.TestCase):
     # start parsing CAN messages after we've left ELM mode and can expect CAN traffic
     error_cnt = 0
     for i, msg in enumerate(self.can_msgs[self.elm_frame:]):
-      rr = RI.update((msg.as_builder().to_bytes(),))
+      rr = RI.update((msg.dat,))
       if rr is not None and i > 50:
         error_cnt += car.RadarData.Error.canError in rr.errors
     self.assertEqual(error_cnt, 0)
@@ -247,22 +204,22 @@ class TestCarModelBase(unittest.TestCase):
     if self.CP.dashcamOnly:
       self.skipTest("no need to check panda safety for dashcamOnly")
 
-    start_ts = self.can_msgs[0].logMonoTime
+    start_ts = self.can_msgs[0].log_mono_time
 
     failed_addrs = Counter()
     for can in self.can_msgs:
       # update panda timer
-      t = (can.logMonoTime - start_ts) / 1e3
+      t = (can.log_mono_time - start_ts) / 1e3
       self.safety.set_timer(int(t))
 
       # run all msgs through the safety RX hook
-      for msg in can.can:
-        if msg.src >= 64:
+      for address, dat, src in can.frames:
+        if src >= 64:
           continue
 
-        to_send = libpanda_py.make_CANPacket(msg.address, msg.src % 4, msg.dat)
+        to_send = libpanda_py.make_CANPacket(address, src % 4, dat)
         if self.safety.safety_rx_hook(to_send) != 1:
-          failed_addrs[hex(msg.address)] += 1
+          failed_addrs[hex(address)] += 1
 
       # ensure all msgs defined in the addr checks are valid
       self.safety.safety_tick_current_safety_config()
@@ -397,9 +354,9 @@ class TestCarModelBase(unittest.TestCase):
 
     # warm up pass, as initial states may be different
     for can in self.can_msgs[:300]:
-      self.CI.update(CC, (can.as_builder().to_bytes(), ))
-      for msg in filter(lambda m: m.src in range(64), can.can):
-        to_send = libpanda_py.make_CANPacket(msg.address, msg.src % 4, msg.dat)
+      self.CI.update(CC, (can.dat, ))
+      for address, dat, src in filter(lambda f: f[2] in range(64), can.frames):
+        to_send = libpanda_py.make_CANPacket(address, src % 4, dat)
         self.safety.safety_rx_hook(to_send)
 
     controls_allowed_prev = False
@@ -407,9 +364,9 @@ class TestCarModelBase(unittest.TestCase):
     checks = defaultdict(int)
     card = Car(CI=self.CI)
     for idx, can in enumerate(self.can_msgs):
-      CS = self.CI.update(CC, (can.as_builder().to_bytes(), ))
-      for msg in filter(lambda m: m.src in range(64), can.can):
-        to_send = libpanda_py.make_CANPacket(msg.address, msg.src % 4, msg.dat)
+      CS = self.CI.update(CC, (can.dat, ))
+      for address, dat, src in filter(lambda f: f[2] in range(64), can.frames):
+        to_send = libpanda_py.make_CANPacket(address, src % 4, dat)
         ret = self.safety.safety_rx_hook(to_send)
         self.assertEqual(1, ret, f"safety rx failed ({ret=}): {to_send}")
 
@@ -15,6 +15,7 @@ from openpilot.common.conversions import Conversions as CV
 from openpilot.common.git import get_short_branch
 from openpilot.common.numpy_fast import clip
 from openpilot.common.params import Params
+from openpilot.common.params_cache import CachedParams, decode_bool, decode_int
 from openpilot.common.realtime import config_realtime_process, Priority, Ratekeeper, DT_CTRL
 from openpilot.common.swaglog import cloudlog
 
@@ -99,7 +100,7 @@ class Controls:
                                    'managerState', 'liveParameters', 'radarState', 'liveTorqueParameters',
                                    'testJoystick'] + self.camera_packets + self.sensor_packets,
                                   ignore_alive=ignore, ignore_avg_freq=ignore+['radarState', 'testJoystick'], ignore_valid=['testJoystick', ],
-                                  frequency=int(1/DT_CTRL))
+                                  frequency=int(1/DT_CTRL), lazy=True)
 
     self.joystick_mode = self.params.get_bool("JoystickDebugMode")
 
@@ -730,7 +731,7 @@ class Controls:
     curvature = -self.VM.calc_curvature(steer_angle_without_offset, CS.vEgo, lp.roll)
 
     # controlsState
-    dat = messaging.new_message('controlsState')
+    dat = self.pm.new_message('controlsState')
     dat.valid = CS.canValid
     controlsState = dat.controlsState
     if current_alert:
@@ -776,14 +777,14 @@ class Controls:
 
     # onroadEvents - logged every second or on change
     if (self.sm.frame % int(1. / DT_CTRL) == 0) or (self.events.names != self.events_prev):
-      ce_send = messaging.new_message('onroadEvents', len(self.events))
+      ce_send = self.pm.new_message('onroadEvents', len(self.events))
       ce_send.valid = True
       ce_send.onroadEvents = self.events.to_msg()
       self.pm.send('onroadEvents', ce_send)
     self.events_prev = self.events.names.copy()
 
     # carControl
-    cc_send = messaging.new_message('carControl')
+    cc_send = self.pm.new_message('carControl')
     cc_send.valid = CS.canValid
     cc_send.carControl = CC
     self.pm.send('carControl', cc_send)
@@ -817,13 +818,22 @@ class Controls:
       return log.LongitudinalPersonality.standard
 
   def params_thread(self, evt):
-    while not evt.is_set():
-      self.is_metric = self.params.get_bool("IsMetric")
-      self.experimental_mode = self.params.get_bool("ExperimentalMode") and self.CP.openpilotLongitudinalControl
-      self.personality = self.read_personality_param()
-      if self.CP.notCar:
-        self.joystick_mode = self.params.get_bool("JoystickDebugMode")
-      time.sleep(0.1)
+    cached_params = CachedParams({
+      "IsMetric": decode_bool,
+      "ExperimentalMode": decode_bool,
+      "LongitudinalPersonality": decode_int(log.LongitudinalPersonality.standard),
+      "JoystickDebugMode": decode_bool,
+    }, self.params)
+    try:
+      while not evt.is_set():
+        self.is_metric = cached_params["IsMetric"]
+        self.experimental_mode = cached_params["ExperimentalMode"] and self.CP.openpilotLongitudinalControl
+        self.personality = cached_params["LongitudinalPersonality"]
+        if self.CP.notCar:
+          self.joystick_mode = cached_params["JoystickDebugMode"]
+        cached_params.update(timeout=0.1)
+    finally:
+      cached_params.close()
 
   def controlsd_thread(self):
     e = threading.Event()
@@ -51,7 +51,13 @@ class Events:
   def __init__(self):
     self.events: list[int] = []
     self.static_events: list[int] = []
-    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+    # bitset of the current events, to check event types against EVENT_TYPE_MASKS
+    self.event_bits = 0
+    self.static_event_bits = 0
+    # number of consecutive cycles each event has been active for, only active events are kept
+    self.event_counters: dict[int, int] = {}
+    self._msg_events: list[int] = []
+    self._msg: list[car.CarEvent] = []
 
   @property
   def names(self) -> list[int]:
@@ -63,20 +69,26 @@ class Events:
   def add(self, event_name: int, static: bool=False) -> None:
     if static:
       bisect.insort(self.static_events, event_name)
+      self.static_event_bits |= 1 << event_name
     bisect.insort(self.events, event_name)
+    self.event_bits |= 1 << event_name
 
   def clear(self) -> None:
-    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
+    self.event_counters = {e: self.event_counters.get(e, 0) + 1 for e in self.events}
     self.events = self.static_events.copy()
+    self.event_bits = self.static_event_bits
 
   def contains(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return bool(self.event_bits & EVENT_TYPE_MASKS[event_type])
 
   def create_alerts(self, event_types: list[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
+    if not any(self.event_bits & EVENT_TYPE_MASKS[et] for et in event_types):
+      return ret
+
     for e in self.events:
       types = EVENTS[e].keys()
       for et in event_types:
@@ -85,7 +97,7 @@ class Events:
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
 
-          if DT_CTRL * (self.event_counters[e] + 1) >= alert.creation_delay:
+          if DT_CTRL * (self.event_counters.get(e, 0) + 1) >= alert.creation_delay:
             alert.alert_type = f"{EVENT_NAME[e]}/{et}"
             alert.event_type = et
             ret.append(alert)
@@ -93,17 +105,14 @@ class Events:
 
   def add_from_msg(self, events):
     for e in events:
-      bisect.insort(self.events, e.name.raw)
+      self.add(e.name.raw)
 
   def to_msg(self):
-    ret = []
-    for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}):
-        setattr(event, event_type, True)
-      ret.append(event)
-    return ret
+    # the list is rebuilt only when the events changed, each event's message is built once
+    if self.events != self._msg_events:
+      self._msg_events = self.events.copy()
+      self._msg = [get_event_msg(event_name) for event_name in self.events]
+    return self._msg
 
 
 class Alert:
@@ -955,6 +964,37 @@ EVENTS: dict[int, dict[str, Alert | AlertCallbackType]] = {
 }
 
 
+# bitset of the events that have an alert of each event type
+EVENT_TYPE_MASKS: dict[str, int] = {}
+EVENT_MSGS: dict[int, car.CarEvent] = {}
+
+
+def update_event_tables() -> None:
+  """Builds the per event type masks and event messages from EVENTS, must be called again if EVENTS is changed"""
+  EVENT_TYPE_MASKS.clear()
+  for name, et in vars(ET).items():
+    if not name.startswith('_'):
+      EVENT_TYPE_MASKS[et] = 0
+  for event_name, alerts in EVENTS.items():
+    for et in alerts:
+      EVENT_TYPE_MASKS[et] |= 1 << event_name
+  EVENT_MSGS.clear()
+
+
+def get_event_msg(event_name: int) -> car.CarEvent:
+  event = EVENT_MSGS.get(event_name)
+  if event is None:
+    event = car.CarEvent.new_message()
+    event.name = event_name
+    for event_type in EVENTS.get(event_name, {}):
+      setattr(event, event_type, True)
+    EVENT_MSGS[event_name] = event
+  return event
+
+
+update_event_tables()
+
+
 if __name__ == '__main__':
   # print all alerts by type and priority
   from cereal.services import SERVICE_LIST
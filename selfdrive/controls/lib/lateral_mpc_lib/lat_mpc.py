@@ -6,6 +6,8 @@ import numpy as np
 from casadi import SX, vertcat, sin, cos
 # WARNING: imports outside of constants will not trigger a rebuild
 from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.common.realtime import DT_MDL
+from openpilot.selfdrive.controls.lib.mpc_helpers import SolverStats, shift_solution
 
 if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
@@ -23,6 +25,7 @@ SPEED_OFFSET = 10.0
 MODEL_NAME = 'lat'
 ACADOS_SOLVER_TYPE = 'SQP_RTI'
 N = 32
+T_IDXS = np.array(ModelConstants.T_IDXS[:N+1])
 
 def gen_lat_model():
   model = AcadosModel()
@@ -122,16 +125,22 @@ def gen_lat_ocp():
 
   # set prediction horizon
   ocp.solver_options.tf = Tf
-  ocp.solver_options.shooting_nodes = np.array(ModelConstants.T_IDXS)[:N+1]
+  ocp.solver_options.shooting_nodes = T_IDXS
 
   ocp.code_export_directory = EXPORT_DIR
   return ocp
 
 
 class LateralMpc:
-  def __init__(self, x0=None):
+  def __init__(self, x0=None, dt=DT_MDL, warm_start=False, collect_stats=False):
     if x0 is None:
       x0 = np.zeros(X_DIM)
+    self.dt = dt
+    # start each solve from the previous solution shifted by dt
+    self.warm_start = warm_start
+    # reading the acados stats costs time on every solve, so only benchmarks turn it on
+    self.collect_stats = collect_stats
+    self.stats = SolverStats()
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.reset(x0)
 
@@ -166,6 +175,12 @@ class LateralMpc:
       self.solver.cost_set(i, 'W', W)
     self.solver.cost_set(N, 'W', W[:COST_E_DIM,:COST_E_DIM])
 
+  def set_initial_guess(self, x_guess, u_guess):
+    for i in range(N+1):
+      self.solver.set(i, 'x', np.ascontiguousarray(x_guess[i]))
+    for i in range(N):
+      self.solver.set(i, 'u', np.ascontiguousarray(u_guess[i]))
+
   def run(self, x0, p, y_pts, heading_pts, yaw_rate_pts):
     x0_cp = np.copy(x0)
     p_cp = np.copy(p)
@@ -185,6 +200,9 @@ class LateralMpc:
     t = time.monotonic()
     self.solution_status = self.solver.solve()
     self.solve_time = time.monotonic() - t
+    if self.collect_stats:
+      qp_iter = int(self.solver.get_stats('statistics')[-1][-1])  # SQP_RTI specific
+      self.stats.update(self.solve_time, float(self.solver.get_stats('time_qp')[0]), qp_iter, self.solution_status != 0)
 
     for i in range(N+1):
       self.x_sol[i] = self.solver.get(i, 'x')
@@ -192,6 +210,15 @@ class LateralMpc:
       self.u_sol[i] = self.solver.get(i, 'u')
     self.cost = self.solver.get_cost()
 
+    if self.warm_start and self.solution_status == 0:
+      x_guess, u_guess = shift_solution(T_IDXS, self.dt, self.x_sol, self.u_sol)
+      # express the shifted path in the frame of the car at the start of the next solve
+      dx, dy = x_guess[:,0] - x_guess[0,0], x_guess[:,1] - x_guess[0,1]
+      c, s = np.cos(x_guess[0,2]), np.sin(x_guess[0,2])
+      x_guess[:,0], x_guess[:,1] = c * dx + s * dy, c * dy - s * dx
+      x_guess[:,2] -= x_guess[0,2]
+      self.set_initial_guess(x_guess, u_guess)
+
 
 if __name__ == "__main__":
   ocp = gen_lat_ocp()
@@ -10,6 +10,7 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.selfdrive.modeld.constants import index_function
 from openpilot.selfdrive.car.interfaces import ACCEL_MIN
 from openpilot.selfdrive.controls.radard import _LEAD_ACCEL_TAU
+from openpilot.selfdrive.controls.lib.mpc_helpers import SolverStats, shift_solution
 
 if __name__ == '__main__':  # generating code
   from openpilot.third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
@@ -24,6 +25,7 @@ EXPORT_DIR = os.path.join(LONG_MPC_DIR, "c_generated_code")
 JSON_FILE = os.path.join(LONG_MPC_DIR, "acados_ocp_long.json")
 
 SOURCES = ['lead0', 'lead1', 'cruise', 'e2e']
+MODES = ['acc', 'blended']
 
 X_DIM = 3
 U_DIM = 1
@@ -221,9 +223,16 @@ def gen_long_ocp():
 
 
 class LongitudinalMpc:
-  def __init__(self, mode='acc', dt=DT_MDL):
+  def __init__(self, mode='acc', dt=DT_MDL, warm_start=False, collect_stats=False):
     self.mode = mode
     self.dt = dt
+    # start each solve from the previous solution shifted by dt, and after
+    # a reset from the last solution of the same mode and plan source
+    self.warm_start = warm_start
+    self.solution_cache: dict[tuple[str, str], tuple[np.ndarray, np.ndarray]] = {}
+    # reading the QP iterations costs time on every solve, so only benchmarks turn it on
+    self.collect_stats = collect_stats
+    self.stats = {mode: SolverStats() for mode in MODES}
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.reset()
     self.source = SOURCES[2]
@@ -249,6 +258,7 @@ class LongitudinalMpc:
     self.status = False
     self.crash_cnt = 0.0
     self.solution_status = 0
+    self.cold_start = True
     # timers
     self.solve_time = 0.0
     self.time_qp_solution = 0.0
@@ -287,6 +297,12 @@ class LongitudinalMpc:
       raise NotImplementedError(f'Planner mode {self.mode} not recognized in planner cost set')
     self.set_cost_weights(cost_weights, constraint_cost_weights)
 
+  def set_initial_guess(self, x_guess, u_guess):
+    for i in range(N+1):
+      self.solver.set(i, 'x', np.ascontiguousarray(x_guess[i]))
+    for i in range(N):
+      self.solver.set(i, 'u', np.ascontiguousarray(u_guess[i]))
+
   def set_cur_state(self, v, a):
     v_prev = self.x0[1]
     self.x0[1] = v
@@ -419,6 +435,11 @@ class LongitudinalMpc:
       self.solver.set(i, 'p', self.params[i])
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
+    cache_key = (self.mode, self.source)
+    if self.warm_start and self.cold_start and cache_key in self.solution_cache:
+      x_cached, u_cached = self.solution_cache[cache_key]
+      self.set_initial_guess(x_cached + (self.x0 - x_cached[0]), u_cached)
+    self.cold_start = False
 
     self.solution_status = self.solver.solve()
     self.solve_time = float(self.solver.get_stats('time_tot')[0])
@@ -426,7 +447,9 @@ class LongitudinalMpc:
     self.time_linearization = float(self.solver.get_stats('time_lin')[0])
     self.time_integrator = float(self.solver.get_stats('time_sim')[0])
 
-    # qp_iter = self.solver.get_stats('statistics')[-1][-1] # SQP_RTI specific
+    if self.collect_stats:
+      qp_iter = int(self.solver.get_stats('statistics')[-1][-1])  # SQP_RTI specific
+      self.stats[self.mode].update(self.solve_time, self.time_qp_solution, qp_iter, self.solution_status != 0)
     # print(f"long_mpc timings: tot {self.solve_time:.2e}, qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e}, \
     # integrator {self.time_integrator:.2e}, qp_iter {qp_iter}")
     # res = self.solver.get_residuals()
@@ -451,6 +474,11 @@ class LongitudinalMpc:
         cloudlog.warning(f"Long mpc reset, solution_status: {self.solution_status}")
       self.reset()
       # reset = 1
+    elif self.warm_start:
+      self.solution_cache[cache_key] = (self.x_sol.copy(), self.u_sol.copy())
+      x_guess, u_guess = shift_solution(T_IDXS, self.dt, self.x_sol, self.u_sol)
+      x_guess[:,0] -= x_guess[0,0]
+      self.set_initial_guess(x_guess, u_guess)
     # print(f"long_mpc timings: total internal {self.solve_time:.2e}, external: {(time.monotonic() - t0):.2e} qp {self.time_qp_solution:.2e}, \
     # lin {self.time_linearization:.2e} qp_iter {qp_iter}, reset {reset}")
 
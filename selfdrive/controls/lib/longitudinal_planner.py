@@ -3,7 +3,6 @@ import math
 import numpy as np
 from openpilot.common.numpy_fast import clip, interp
 
-import cereal.messaging as messaging
 from openpilot.common.conversions import Conversions as CV
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.realtime import DT_MDL
@@ -16,6 +15,7 @@ from openpilot.selfdrive.controls.lib.drive_helpers import V_CRUISE_MAX, CONTROL
 from openpilot.common.swaglog import cloudlog
 
 LON_MPC_STEP = 0.2  # first step is 0.2s
+MPC_STATS_LOG_FRAMES = 1200  # log the solver stats once a minute, when they are collected
 A_CRUISE_MIN = -1.2
 A_CRUISE_MAX_VALS = [1.6, 1.2, 0.8, 0.6]
 A_CRUISE_MAX_BP = [0., 10.0, 25., 40.]
@@ -65,9 +65,9 @@ def get_accel_from_plan(CP, long_plan):
 
 
 class LongitudinalPlanner:
-  def __init__(self, CP, init_v=0.0, init_a=0.0, dt=DT_MDL):
+  def __init__(self, CP, init_v=0.0, init_a=0.0, dt=DT_MDL, collect_mpc_stats=False):
     self.CP = CP
-    self.mpc = LongitudinalMpc(dt=dt)
+    self.mpc = LongitudinalMpc(dt=dt, collect_stats=collect_mpc_stats)
     self.fcw = False
     self.dt = dt
 
@@ -79,6 +79,7 @@ class LongitudinalPlanner:
     self.a_desired_trajectory = np.zeros(CONTROL_N)
     self.j_desired_trajectory = np.zeros(CONTROL_N)
     self.solverExecutionTime = 0.0
+    self.mpc_stats_frame = 0
 
   @staticmethod
   def parse_model(model_msg, model_error):
@@ -152,13 +153,19 @@ class LongitudinalPlanner:
     if self.fcw:
       cloudlog.info("FCW triggered")
 
+    self.mpc_stats_frame += 1
+    if self.mpc.collect_stats and self.mpc_stats_frame % MPC_STATS_LOG_FRAMES == 0:
+      cloudlog.event("longitudinal mpc stats", **{mode: stats.to_dict() for mode, stats in self.mpc.stats.items()})
+      for stats in self.mpc.stats.values():
+        stats.clear()
+
     # Interpolate 0.05 seconds and save as starting point for next iteration
     a_prev = self.a_desired
     self.a_desired = float(interp(self.dt, ModelConstants.T_IDXS[:CONTROL_N], self.a_desired_trajectory))
     self.v_desired_filter.x = self.v_desired_filter.x + self.dt * (self.a_desired + a_prev) / 2.0
 
   def publish(self, sm, pm):
-    plan_send = messaging.new_message('longitudinalPlan')
+    plan_send = pm.new_message('longitudinalPlan')
 
     plan_send.valid = sm.all_checks(service_list=['carState', 'controlsState'])
 
@@ -0,0 +1,64 @@
+import bisect
+
+import numpy as np
+
+# upper edges of the solve time histogram bins in seconds, 0.1ms to 100ms
+SOLVE_TIME_BINS = np.geomspace(1e-4, 1e-1, 31).tolist()
+MAX_QP_ITER = 20
+
+
+class SolverStats:
+  """Solve time histogram, QP iterations and resets of an acados solver, accumulated since the last clear()"""
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.count = 0
+    self.resets = 0
+    self.solve_time_total = 0.0
+    self.solve_time_max = 0.0
+    self.qp_time_total = 0.0
+    self.qp_iter_total = 0
+    self.solve_time_hist = [0] * (len(SOLVE_TIME_BINS) + 1)
+    self.qp_iter_hist = [0] * (MAX_QP_ITER + 1)
+
+  def update(self, solve_time: float, qp_time: float, qp_iter: int, reset: bool):
+    solve_time, qp_time = float(solve_time), float(qp_time)
+    self.count += 1
+    self.resets += int(reset)
+    self.solve_time_total += solve_time
+    self.solve_time_max = max(self.solve_time_max, solve_time)
+    self.qp_time_total += qp_time
+    self.qp_iter_total += qp_iter
+    self.solve_time_hist[bisect.bisect_left(SOLVE_TIME_BINS, solve_time)] += 1
+    self.qp_iter_hist[min(qp_iter, MAX_QP_ITER)] += 1
+
+  def solve_time_percentile(self, q: float) -> float:
+    # upper edge of the histogram bin holding the q-th percentile, inf if it's past the last bin
+    if self.count == 0:
+      return 0.0
+    idx = int(np.searchsorted(np.cumsum(self.solve_time_hist), q / 100 * self.count))
+    return SOLVE_TIME_BINS[idx] if idx < len(SOLVE_TIME_BINS) else float('inf')
+
+  def to_dict(self) -> dict:
+    count = max(self.count, 1)
+    return {
+      'count': self.count,
+      'resets': self.resets,
+      'solve_time_mean_ms': self.solve_time_total / count * 1e3,
+      'solve_time_max_ms': self.solve_time_max * 1e3,
+      'solve_time_p50_ms': self.solve_time_percentile(50) * 1e3,
+      'solve_time_p99_ms': self.solve_time_percentile(99) * 1e3,
+      'qp_time_mean_ms': self.qp_time_total / count * 1e3,
+      'qp_iter_mean': self.qp_iter_total / count,
+      'solve_time_hist': list(self.solve_time_hist),
+      'qp_iter_hist': list(self.qp_iter_hist),
+    }
+
+
+def shift_solution(t_idxs: np.ndarray, dt: float, x_sol: np.ndarray, u_sol: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Solution trajectories sampled dt later, as the initial guess for the next solve. The tail is held constant."""
+  t = t_idxs + dt
+  x = np.column_stack([np.interp(t, t_idxs, x_sol[:, i]) for i in range(x_sol.shape[1])])
+  u = np.column_stack([np.interp(t[:-1], t_idxs[:-1], u_sol[:, i]) for i in range(u_sol.shape[1])])
+  return x, u
@@ -0,0 +1,35 @@
+import numpy as np
+
+from openpilot.selfdrive.controls.lib.mpc_helpers import SOLVE_TIME_BINS, SolverStats, shift_solution
+
+
+class TestMpcHelpers:
+  def test_solver_stats(self):
+    stats = SolverStats()
+    solve_times = np.random.default_rng(0).lognormal(np.log(2e-3), 0.5, 1000)
+    for i, solve_time in enumerate(solve_times):
+      stats.update(solve_time, solve_time / 2, i % 3, solve_time > 1e-2)
+
+    d = stats.to_dict()
+    assert d['count'] == 1000 and sum(d['solve_time_hist']) == 1000
+    assert d['resets'] == np.sum(solve_times > 1e-2)
+    assert d['qp_iter_hist'][:3] == [334, 333, 333]
+    assert d['solve_time_max_ms'] == np.max(solve_times) * 1e3
+
+    # percentiles are the upper edge of the bin they fall in
+    for q in (50, 99):
+      p = stats.solve_time_percentile(q)
+      assert p in SOLVE_TIME_BINS
+      assert SOLVE_TIME_BINS[SOLVE_TIME_BINS.index(p) - 1] < np.percentile(solve_times, q) <= p
+
+    stats.clear()
+    assert stats.to_dict()['count'] == 0
+
+  def test_shift_solution(self):
+    t_idxs = np.array([0., 0.2, 0.5, 1.0, 2.0])
+    x_sol = np.column_stack([t_idxs ** 2, 2 * t_idxs])
+    u_sol = t_idxs[:-1, None]
+    x, u = shift_solution(t_idxs, 0.1, x_sol, u_sol)
+    np.testing.assert_allclose(x[:-1, 1], 2 * (t_idxs[:-1] + 0.1))
+    np.testing.assert_allclose(x[-1], x_sol[-1])
+    np.testing.assert_allclose(u[:, 0], [0.1, 0.3, 0.6, 1.0])
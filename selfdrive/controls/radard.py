@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 import importlib
-import math
 from collections import deque
 from typing import Any
 
 import capnp
+import numpy as np
 from cereal import messaging, log, car
 from openpilot.common.numpy_fast import interp
 from openpilot.common.params import Params
@@ -17,9 +17,6 @@ from openpilot.common.simple_kalman import KF1D
 # Default lead acceleration decay set to 50% at 1s
 _LEAD_ACCEL_TAU = 1.5
 
-# radar tracks
-SPEED, ACCEL = 0, 1     # Kalman filter states enum
-
 # stationary qualification parameters
 V_EGO_STATIONARY = 4.   # no stationary object flag below this speed
 
@@ -49,101 +46,106 @@ class KalmanParams:
     self.K = [[interp(dt, dts, K0)], [interp(dt, dts, K1)]]
 
 
-class Track:
-  def __init__(self, identifier: int, v_lead: float, kalman_params: KalmanParams):
-    self.identifier = identifier
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel: float, y_rel: float, v_rel: float, v_lead: float, measured: float):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+class Tracks:
+  """Radar tracks stored as parallel arrays, in the order the tracks were first seen"""
+  def __init__(self, kalman_params: KalmanParams):
+    # same precomputed gains as a KF1D per track, applied to all tracks at once
+    kf = KF1D([[0.0], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+    self.A_K = (kf.A_K_0, kf.A_K_1, kf.A_K_2, kf.A_K_3)
+    self.K = (kf.K0_0, kf.K1_0)
+
+    self.identifier = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)    # LONG_DIST
+    self.yRel = np.zeros(0)    # -LAT_DIST
+    self.vRel = np.zeros(0)    # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.vLeadK = np.zeros(0)  # Kalman filter states
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+
+  def __len__(self):
+    return len(self.identifier)
+
+  def update(self, ar_pts: dict[int, tuple[float, float, float]], v_ego: float):
+    ids = np.fromiter(ar_pts.keys(), dtype=np.int64, count=len(ar_pts))
+    pts = np.array(list(ar_pts.values()), dtype=np.float64).reshape(-1, 3)
+
+    # remove missing points, new tracks go at the end
+    keep = np.isin(self.identifier, ids)
+    identifier = self.identifier[keep]
+    new_ids = ids[~np.isin(ids, identifier)]
+    self.identifier = np.concatenate((identifier, new_ids))
+
+    sorter = np.argsort(ids)
+    pts = pts[sorter[np.searchsorted(ids, self.identifier, sorter=sorter)]]
+    self.dRel, self.yRel, self.vRel = pts.T
+    self.vLead = self.vRel + v_ego
+
+    # computed velocity and accelerations, new tracks start at the measured speed
+    x0, x1 = self.vLeadK[keep], self.aLeadK[keep]
+    meas = self.vLead[:len(identifier)]
+    self.vLeadK = np.concatenate((self.A_K[0] * x0 + self.A_K[1] * x1 + self.K[0] * meas, self.vLead[len(identifier):]))
+    self.aLeadK = np.concatenate((self.A_K[2] * x0 + self.A_K[3] * x1 + self.K[1] * meas, np.zeros(len(new_ids))))
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
-
-    self.cnt += 1
-
-  def get_key_for_cluster(self):
-    # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
+    a_lead_tau = np.concatenate((self.aLeadTau[keep], np.full(len(new_ids), _LEAD_ACCEL_TAU)))
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
 
-  def reset_a_lead(self, aLeadK: float, aLeadTau: float):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
-
-  def get_RadarState(self, model_prob: float = 0.0):
+  def get_RadarState(self, idx: int, model_prob: float = 0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
-      "aLeadTau": float(self.aLeadTau),
+      "dRel": float(self.dRel[idx]),
+      "yRel": float(self.yRel[idx]),
+      "vRel": float(self.vRel[idx]),
+      "vLead": float(self.vLead[idx]),
+      "vLeadK": float(self.vLeadK[idx]),
+      "aLeadK": float(self.aLeadK[idx]),
+      "aLeadTau": float(self.aLeadTau[idx]),
       "status": True,
-      "fcw": self.is_potential_fcw(model_prob),
+      "fcw": is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "radarTrackId": self.identifier,
+      "radarTrackId": int(self.identifier[idx]),
     }
 
-  def potential_low_speed_lead(self, v_ego: float):
+  def potential_low_speed_leads(self, v_ego: float) -> np.ndarray:
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
+    if v_ego >= V_EGO_STATIONARY:
+      return np.zeros(0, dtype=int)
+    return np.flatnonzero((np.abs(self.yRel) < 1.0) & (0.75 < self.dRel) & (self.dRel < 25))
+
+  def get_live_tracks(self) -> list[dict[str, Any]]:
+    order = np.argsort(self.identifier)
+    return [{"trackId": tid, "dRel": d, "yRel": y, "vRel": v} for tid, d, y, v in
+            zip(*(a[order].tolist() for a in (self.identifier, self.dRel, self.yRel, self.vRel)), strict=True)]
 
-  def is_potential_fcw(self, model_prob: float):
-    return model_prob > .9
 
-  def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
+def is_potential_fcw(model_prob: float):
+  return model_prob > .9
 
 
-def laplacian_pdf(x: float, mu: float, b: float):
+def laplacian_pdf(x: np.ndarray, mu: float, b: float):
   b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
+  return np.exp(-np.abs(x-mu)/b)
 
 
-def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: dict[int, Track]):
+def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: Tracks) -> int | None:
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
-
-    # This isn't exactly right, but it's a good heuristic
-    return prob_d * prob_y * prob_v
+  prob_d = laplacian_pdf(tracks.dRel, offset_vision_dist, lead.xStd[0])
+  prob_y = laplacian_pdf(tracks.yRel, -lead.y[0], lead.yStd[0])
+  prob_v = laplacian_pdf(tracks.vRel + v_ego, lead.v[0], lead.vStd[0])
 
-  track = max(tracks.values(), key=prob)
+  # This isn't exactly right, but it's a good heuristic
+  idx = int(np.argmax(prob_d * prob_y * prob_v))
+  d_rel, v_rel = tracks.dRel[idx], tracks.vRel[idx]
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  dist_sane = abs(d_rel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(v_rel + v_ego - lead.v[0]) < 10) or (v_ego + v_rel > 3)
   if dist_sane and vel_sane:
-    return track
+    return idx
   else:
     return None
 
@@ -166,7 +168,7 @@ def get_RadarState_from_vision(lead_msg: capnp._DynamicStructReader, v_ego: floa
   }
 
 
-def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capnp._DynamicStructReader,
+def get_lead(v_ego: float, ready: bool, tracks: Tracks, lead_msg: capnp._DynamicStructReader,
              model_v_ego: float, low_speed_override: bool = True) -> dict[str, Any]:
   # Determine leads, this is where the essential logic happens
   if len(tracks) > 0 and ready and lead_msg.prob > .5:
@@ -176,18 +178,18 @@ def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capn
 
   lead_dict = {'status': False}
   if track is not None:
-    lead_dict = track.get_RadarState(lead_msg.prob)
+    lead_dict = tracks.get_RadarState(track, lead_msg.prob)
   elif (track is None) and ready and (lead_msg.prob > .5):
     lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
 
   if low_speed_override:
-    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
+    low_speed_tracks = tracks.potential_low_speed_leads(v_ego)
     if len(low_speed_tracks) > 0:
-      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
+      closest_track = low_speed_tracks[np.argmin(tracks.dRel[low_speed_tracks])]
 
       # Only choose new track if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
-        lead_dict = closest_track.get_RadarState()
+      if (not lead_dict['status']) or (tracks.dRel[closest_track] < lead_dict['dRel']):
+        lead_dict = tracks.get_RadarState(closest_track)
 
   return lead_dict
 
@@ -196,8 +198,8 @@ class RadarD:
   def __init__(self, radar_ts: float, delay: int = 0):
     self.current_time = 0.0
 
-    self.tracks: dict[int, Track] = {}
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     self.v_ego = 0.0
     self.v_ego_hist = deque([0.0], maxlen=delay+1)
@@ -225,24 +227,11 @@ class RadarD:
 
     ar_pts = {}
     for pt in radar_points:
-      ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
-
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
+      ar_pts[pt.trackId] = (pt.dRel, pt.yRel, pt.vRel)
 
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(ids, v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    # align v_ego by a fixed time to align it with the radar measurement
+    self.tracks.update(ar_pts, self.v_ego_hist[0])
 
     # *** publish radarState ***
     self.radar_state_valid = sm.all_checks() and len(radar_errors) == 0
@@ -263,22 +252,16 @@ class RadarD:
   def publish(self, pm: messaging.PubMaster, lag_ms: float):
     assert self.radar_state is not None
 
-    radar_msg = messaging.new_message("radarState")
+    radar_msg = pm.new_message("radarState")
     radar_msg.valid = self.radar_state_valid
     radar_msg.radarState = self.radar_state
     radar_msg.radarState.cumLagMs = lag_ms
     pm.send("radarState", radar_msg)
 
     # publish tracks for UI debugging (keep last)
-    tracks_msg = messaging.new_message('liveTracks', len(self.tracks))
+    tracks_msg = pm.new_message('liveTracks', 0)
     tracks_msg.valid = self.radar_state_valid
-    for index, tid in enumerate(sorted(self.tracks.keys())):
-      tracks_msg.liveTracks[index] = {
-        "trackId": tid,
-        "dRel": float(self.tracks[tid].dRel),
-        "yRel": float(self.tracks[tid].yRel),
-        "vRel": float(self.tracks[tid].vRel),
-      }
+    tracks_msg.liveTracks = self.tracks.get_live_tracks()
     pm.send('liveTracks', tracks_msg)
 
 
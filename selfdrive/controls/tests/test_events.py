@@ -0,0 +1,40 @@
+import random
+
+from cereal import car
+from openpilot.selfdrive.controls.lib.events import Events, ET, EVENTS
+
+EVENT_TYPES = [v for k, v in vars(ET).items() if not k.startswith('_')]
+
+
+class TestEvents:
+  def test_events(self):
+    random.seed(0)
+    event_names = sorted(EVENTS.keys())
+    events = Events()
+    static_event = random.choice(event_names)
+    events.add(static_event, static=True)
+
+    prev_names = [static_event]
+    counters = dict.fromkeys(event_names, 0)
+    for _ in range(1000):
+      counters = {e: (v + 1 if e in prev_names else 0) for e, v in counters.items()}
+      events.clear()
+      names = [static_event]
+      for e in random.choices(event_names, k=random.randint(0, 4)):
+        events.add(e)
+        names.append(e)
+      msgs = [car.CarEvent.new_message(name=e) for e in random.choices(event_names, k=random.randint(0, 2))]
+      events.add_from_msg(msgs)
+      names += [m.name.raw for m in msgs]
+
+      assert events.names == sorted(names)
+      assert len(events) == len(names)
+      for et in EVENT_TYPES:
+        assert events.contains(et) == any(et in EVENTS[e] for e in names)
+      for e in set(names):
+        assert events.event_counters.get(e, 0) == counters[e]
+
+      for e, msg in zip(events.names, events.to_msg(), strict=True):
+        assert msg.name.raw == e
+        assert all(getattr(msg, et) == (et in EVENTS[e]) for et in EVENT_TYPES)
+      prev_names = names
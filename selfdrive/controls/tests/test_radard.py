@@ -0,0 +1,40 @@
+import random
+
+from openpilot.common.simple_kalman import KF1D
+from openpilot.selfdrive.controls.radard import KalmanParams, Tracks, _LEAD_ACCEL_TAU
+
+
+class TestRadard:
+  def test_tracks(self):
+    # batched track updates match a KF1D per track
+    random.seed(0)
+    kalman_params = KalmanParams(0.05)
+    tracks = Tracks(kalman_params)
+    kfs: dict[int, KF1D] = {}
+    a_lead_tau: dict[int, float] = {}
+
+    for _ in range(500):
+      v_ego = random.uniform(0, 30)
+      track_ids = random.sample(range(32), random.randint(0, 16))
+      ar_pts = {tid: (random.uniform(0, 100), random.uniform(-5, 5), random.uniform(-10, 10)) for tid in track_ids}
+      tracks.update(ar_pts, v_ego)
+
+      kfs = {tid: kfs[tid] for tid in kfs if tid in ar_pts}
+      for tid, (_, _, v_rel) in ar_pts.items():
+        if tid in kfs:
+          kfs[tid].update(v_rel + v_ego)
+        else:
+          kfs[tid] = KF1D([[v_rel + v_ego], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+        a_lead_k = kfs[tid].x[1][0]
+        a_lead_tau[tid] = _LEAD_ACCEL_TAU if abs(a_lead_k) < 0.5 else a_lead_tau[tid] * 0.9
+
+      # tracks keep the order in which they were first seen
+      assert tracks.identifier.tolist() == list(kfs)
+      for idx, (tid, kf) in enumerate(kfs.items()):
+        state = tracks.get_RadarState(idx)
+        assert state['radarTrackId'] == tid
+        assert (state['dRel'], state['yRel'], state['vRel']) == ar_pts[tid]
+        assert (state['vLeadK'], state['aLeadK']) == (kf.x[0][0], kf.x[1][0])
+        assert state['aLeadTau'] == a_lead_tau[tid]
+
+      assert [t['trackId'] for t in tracks.get_live_tracks()] == sorted(ar_pts)
@@ -3,7 +3,7 @@ from openpilot.common.realtime import DT_CTRL
 from openpilot.selfdrive.car.car_helpers import interfaces
 from openpilot.selfdrive.controls.controlsd import Controls, SOFT_DISABLE_TIME
 from openpilot.selfdrive.controls.lib.events import Events, ET, Alert, Priority, AlertSize, AlertStatus, VisualAlert, \
-                                          AudibleAlert, EVENTS
+                                          AudibleAlert, EVENTS, update_event_tables
 from openpilot.selfdrive.car.mock.values import CAR as MOCK
 
 State = log.ControlsState.OpenpilotState
@@ -22,6 +22,7 @@ def make_event(event_types):
     event[ev] = Alert("", "", AlertStatus.normal, AlertSize.small, Priority.LOW,
                       VisualAlert.none, AudibleAlert.none, 1.)
   EVENTS[0] = event
+  update_event_tables()
   return 0
 
 
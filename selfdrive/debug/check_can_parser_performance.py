@@ -25,7 +25,7 @@ if __name__ == '__main__':
   CC = car.CarControl.new_message()
   ets = []
   for _ in tqdm(range(N_RUNS)):
-    msgs = [(m.as_builder().to_bytes(),) for m in tm.can_msgs]
+    msgs = [(m.dat,) for m in tm.can_msgs]
     start_t = time.process_time_ns()
     for msg in msgs:
       for cp in tm.CI.can_parsers:
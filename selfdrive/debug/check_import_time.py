@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+from openpilot.common.basedir import BASEDIR
+from openpilot.system.manager.process import PythonProcess
+from openpilot.system.manager.process_config import managed_processes
+
+
+def get_import_times(module: str) -> dict[str, tuple[int, int]]:
+  # returns {module: (self us, cumulative us)} as reported by python -X importtime
+  proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                        cwd=BASEDIR, capture_output=True, text=True, check=True)
+
+  times = {}
+  for line in proc.stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+    times[name.strip()] = (int(self_us), int(cumulative_us))
+  return times
+
+
+def brand_of(name: str) -> str | None:
+  # openpilot.selfdrive.car.<brand>.<module>
+  parts = name.removeprefix("openpilot.").split(".")
+  if len(parts) > 3 and parts[:2] == ["selfdrive", "car"]:
+    return parts[2]
+  return None
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Report the import time of managed python processes",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--top", type=int, default=10, help="number of slowest modules to show per process")
+  parser.add_argument("procs", nargs="*", help="managed processes to check, defaults to all python processes")
+  args = parser.parse_args()
+
+  procs = [p for p in managed_processes.values() if isinstance(p, PythonProcess)]
+  if args.procs:
+    procs = [p for p in procs if p.name in args.procs]
+
+  for p in procs:
+    times = get_import_times(p.module)
+    total = sum(self_us for self_us, _ in times.values())
+
+    brand_times: dict[str, int] = defaultdict(int)
+    for name, (self_us, _) in times.items():
+      if (brand := brand_of(name)) is not None:
+        brand_times[brand] += self_us
+
+    brand_ms = sum(brand_times.values()) / 1e3
+    print(f"{p.name} ({p.module}): {total / 1e3:.1f} ms, {len(times)} modules, {len(brand_times)} car brands ({brand_ms:.1f} ms)")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda x: x[1][0], reverse=True)[:args.top]:
+      print(f"  {self_us / 1e3:8.2f} ms self {cumulative_us / 1e3:8.2f} ms cumulative  {name}")
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Offline batch mode of calibrationd, paramsd and torqued.
+
+The input services of a segment are read once into columns, then each estimator runs in a tight loop over
+them, with the same update order and output rate as its realtime main loop. Estimators are checkpointed after
+every segment, so later segments continue from the state of the previous one. Routes are processed in parallel:
+
+  ./batch.py --output /tmp/estimates -j 8 <route> [<route> ...]
+"""
+import argparse
+import capnp
+import math
+import os
+import pickle
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from functools import partial
+from multiprocessing import Pool
+from typing import Any
+
+import numpy as np
+
+from cereal import car, log
+from openpilot.selfdrive.locationd.calibrationd import Calibrator
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+from openpilot.tools.lib.logreader import LogReader
+
+# service -> fields read from each message, dotted for nested structs
+Fields = dict[str, list[str]]
+# service -> field -> one value per message, along with the 't' (logMonoTime) and 'valid' columns
+Columns = dict[str, dict[str, np.ndarray]]
+
+CALIBRATIOND_FIELDS: Fields = {
+  'cameraOdometry': ['trans', 'rot', 'wideFromDeviceEuler', 'transStd', 'roadTransformTrans', 'roadTransformTransStd'],
+  'carState': ['vEgo'],
+  'carParams': ['notCar'],
+}
+PARAMSD_FIELDS: Fields = {
+  'liveLocationKalman': ['angularVelocityCalibrated.value', 'angularVelocityCalibrated.std', 'angularVelocityCalibrated.valid',
+                         'orientationNED.value', 'orientationNED.std', 'sensorsOK', 'posenetOK'],
+  'carState': ['steeringAngleDeg', 'vEgo'],
+}
+# liveParameters fields in the paramsd outputs
+LIVE_PARAMETERS_FIELDS = ['valid', 'sensorValid', 'steerRatio', 'stiffnessFactor', 'roll', 'angleOffsetAverageDeg', 'angleOffsetDeg',
+                          'steerRatioStd', 'stiffnessFactorStd', 'angleOffsetAverageStd', 'angleOffsetFastStd']
+TORQUED_FIELDS: Fields = {
+  'carControl': ['latActive'],
+  'carOutput': ['actuatorsOutput.steer'],
+  'carState': ['vEgo', 'steeringPressed'],
+  'liveLocationKalman': ['angularVelocityCalibrated.value', 'orientationNED.value'],
+}
+
+
+class RowView:
+  """Stands in for a message reader, reading the fields of the current row of a service's columns"""
+  def __init__(self, columns: dict[str, np.ndarray], row: list[int], prefix: str = '') -> None:
+    self._columns = columns
+    self._row = row
+    self._prefix = prefix
+    self._children: dict[str, RowView] = {}
+
+  def __getattr__(self, name: str) -> Any:
+    key = self._prefix + name
+    column = self._columns.get(key)
+    if column is not None:
+      return column[self._row[0]]
+    if name not in self._children:
+      self._children[name] = RowView(self._columns, self._row, key + '.')
+    return self._children[name]
+
+
+def get_field(struct, field: str) -> Any:
+  for name in field.split('.'):
+    struct = getattr(struct, name)
+  return list(struct) if isinstance(struct, capnp.lib.capnp._DynamicListReader) else struct
+
+
+def get_columns(msgs, fields: Fields) -> Columns:
+  """Reads the fields of the given services from messages into columns, floats are stored as float64 so
+  arithmetic on them matches the python floats of the realtime path"""
+  rows: dict[str, dict[str, list]] = {s: defaultdict(list) for s in fields}
+  for msg in msgs:
+    which = msg.which()
+    if which not in fields:
+      continue
+    service_rows = rows[which]
+    service_rows['t'].append(msg.logMonoTime)
+    service_rows['valid'].append(msg.valid)
+    struct = getattr(msg, which)
+    for name in fields[which]:
+      service_rows[name].append(get_field(struct, name))
+
+  columns: Columns = {}
+  for s, service_rows in rows.items():
+    columns[s] = {'t': np.array(service_rows['t'], dtype=np.int64), 'valid': np.array(service_rows['valid'], dtype=bool)}
+    for name in fields[s]:
+      column = np.array(service_rows[name])
+      columns[s][name] = column.astype(np.float64) if column.dtype.kind == 'f' else column
+  return columns
+
+
+@dataclass
+class EstimatorState:
+  estimator: Any
+  frame: int = -1  # SubMaster frame, continued across segments so outputs keep their rate and phase
+  # the latest message of each service and the services updated since the last poll, carried over to the next segment
+  last_rows: Columns = field(default_factory=dict)
+  pending: set[str] = field(default_factory=set)
+
+
+def replay_columns(columns: Columns, services: list[str], poll: str, state: EstimatorState) -> Iterator[tuple[int, dict[str, float], dict[str, Any], bool]]:
+  """
+  Emulates a SubMaster polling on poll. Yields the frame, the updated services with their time in seconds, a reader
+  per service positioned at its latest message and whether all latest messages are valid. As with conflated
+  sockets, only the latest message of each service since the previous poll is seen. The SubMaster's state is
+  kept in state, so the next segment continues where this one stopped.
+  """
+  views: dict[str, Any] = {}
+  valid: dict[str, bool] = {}
+  for s in services:
+    if s in state.last_rows:
+      views[s] = RowView(state.last_rows[s], [0])
+      valid[s] = bool(state.last_rows[s]['valid'][0])
+    else:
+      # services are not seen until their first message, like the SubMaster they read as a default message until then
+      views[s] = getattr(log.Event.new_message(**{s: {}}).as_reader(), s)
+      valid[s] = True
+  rows = {s: [-1] for s in services}
+  updated = {s: state.last_rows[s]['t'][0] * 1e-9 for s in services if s in state.pending}
+
+  times = np.concatenate([columns[s]['t'] for s in services])
+  service_idxs = np.concatenate([np.full(len(columns[s]['t']), i) for i, s in enumerate(services)])
+  row_idxs = np.concatenate([np.arange(len(columns[s]['t'])) for s in services])
+  order = np.argsort(times, kind='stable')
+
+  for service_idx, row_idx in zip(service_idxs[order].tolist(), row_idxs[order].tolist(), strict=True):
+    s = services[service_idx]
+    if rows[s][0] == -1:
+      views[s] = RowView(columns[s], rows[s])
+    rows[s][0] = row_idx
+    valid[s] = bool(columns[s]['valid'][row_idx])
+    updated[s] = columns[s]['t'][row_idx] * 1e-9
+
+    if s == poll:
+      state.frame += 1
+      yield state.frame, {u: updated[u] for u in services if u in updated}, views, all(valid.values())
+      updated = {}
+
+  for s in services:
+    if rows[s][0] != -1:
+      state.last_rows[s] = {k: v[rows[s][0]:rows[s][0] + 1].copy() for k, v in columns[s].items()}
+  state.pending = set(updated)
+
+
+def run_calibrationd(columns: Columns, CP: car.CarParams = None, state: EstimatorState = None) -> tuple[dict[str, list], EstimatorState]:
+  if state is None:
+    state = EstimatorState(Calibrator())
+  calibrator = state.estimator
+
+  outputs: dict[str, list] = defaultdict(list)
+  for frame, updated, sm, valid in replay_columns(columns, list(CALIBRATIOND_FIELDS), 'cameraOdometry', state):
+    calibrator.not_car = sm['carParams'].notCar
+
+    if 'cameraOdometry' in updated:
+      calibrator.handle_v_ego(sm['carState'].vEgo)
+      co = sm['cameraOdometry']
+      calibrator.handle_cam_odom(co.trans, co.rot, co.wideFromDeviceEuler, co.transStd, co.roadTransformTrans, co.roadTransformTransStd)
+
+    # 4Hz driven by cameraOdometry
+    if frame % 5 == 0:
+      msg = calibrator.get_msg(valid).liveCalibration
+      outputs['t'].append(updated['cameraOdometry'])
+      outputs['rpyCalib'].append(list(msg.rpyCalib))
+      outputs['calStatus'].append(msg.calStatus.raw)
+      outputs['calPerc'].append(msg.calPerc)
+      outputs['validBlocks'].append(msg.validBlocks)
+  return outputs, state
+
+
+def run_paramsd(columns: Columns, CP: car.CarParams, state: EstimatorState = None) -> tuple[dict[str, list], EstimatorState]:
+  # the filter is only built with the full build, so it's imported when used
+  from openpilot.selfdrive.locationd.paramsd import LiveParametersFilter, ParamsLearner
+
+  if state is None:
+    state = EstimatorState((ParamsLearner(CP, CP.steerRatio, 1.0, 0.0), LiveParametersFilter(CP)))
+  learner, params_filter = state.estimator
+
+  outputs: dict[str, list] = defaultdict(list)
+  for _, updated, sm, valid in replay_columns(columns, list(PARAMSD_FIELDS), 'liveLocationKalman', state):
+    if valid:
+      for which, t in sorted(updated.items(), key=lambda u: u[1]):
+        learner.handle_log(t, which, sm[which])
+
+    x = learner.kf.x
+    P = np.sqrt(learner.kf.P.diagonal())
+    if not all(map(math.isfinite, x)):
+      learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+      x = learner.kf.x
+
+    live_parameters = log.LiveParametersData.new_message()
+    params_filter.fill_msg(live_parameters, learner, x, P)
+    outputs['t'].append(updated['liveLocationKalman'])
+    for name in LIVE_PARAMETERS_FIELDS:
+      outputs[name].append(getattr(live_parameters, name))
+  state.estimator = (learner, params_filter)
+  return outputs, state
+
+
+def run_torqued(columns: Columns, CP: car.CarParams, state: EstimatorState = None) -> tuple[dict[str, list], EstimatorState]:
+  if state is None:
+    state = EstimatorState(TorqueEstimator(CP))
+  estimator = state.estimator
+
+  outputs: dict[str, list] = defaultdict(list)
+  for frame, updated, sm, valid in replay_columns(columns, list(TORQUED_FIELDS), 'liveLocationKalman', state):
+    if valid:
+      for which, t in updated.items():
+        estimator.handle_log(t, which, sm[which])
+
+    # 4Hz driven by liveLocationKalman
+    if frame % 5 == 0:
+      msg = estimator.get_msg(valid=valid).liveTorqueParameters
+      outputs['t'].append(updated['liveLocationKalman'])
+      outputs['liveValid'].append(msg.liveValid)
+      outputs['latAccelFactorRaw'].append(msg.latAccelFactorRaw)
+      outputs['latAccelOffsetRaw'].append(msg.latAccelOffsetRaw)
+      outputs['frictionCoefficientRaw'].append(msg.frictionCoefficientRaw)
+      outputs['latAccelFactorFiltered'].append(msg.latAccelFactorFiltered)
+      outputs['latAccelOffsetFiltered'].append(msg.latAccelOffsetFiltered)
+      outputs['frictionCoefficientFiltered'].append(msg.frictionCoefficientFiltered)
+      outputs['totalBucketPoints'].append(msg.totalBucketPoints)
+  return outputs, state
+
+
+# name -> (input fields, runner)
+ESTIMATORS: dict[str, tuple[Fields, Callable[[Columns, car.CarParams, EstimatorState | None], tuple[dict[str, list], EstimatorState]]]] = {
+  'calibrationd': (CALIBRATIOND_FIELDS, run_calibrationd),
+  'paramsd': (PARAMSD_FIELDS, run_paramsd),
+  'torqued': (TORQUED_FIELDS, run_torqued),
+}
+
+
+def save_checkpoint(path: str, checkpoint: Any) -> None:
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    pickle.dump(checkpoint, f)
+  os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Any:
+  with open(path, 'rb') as f:
+    return pickle.load(f)
+
+
+def process_route(route: str, estimators: list[str], output_dir: str) -> str:
+  """Runs the estimators over the segments of a route in order, resuming after the last checkpointed segment"""
+  route_dir = os.path.join(output_dir, route.replace('|', '_').replace('/', '_'))
+  os.makedirs(route_dir, exist_ok=True)
+
+  fields: Fields = defaultdict(list)
+  for name in estimators:
+    for s, service_fields in ESTIMATORS[name][0].items():
+      fields[s] += [f for f in service_fields if f not in fields[s]]
+
+  CP = None
+  states: dict[str, EstimatorState | None] = dict.fromkeys(estimators)
+  for i, segment in enumerate(LogReader(route).logreader_identifiers):
+    checkpoint_path = os.path.join(route_dir, f"{i}.checkpoint")
+    if os.path.isfile(checkpoint_path):
+      CP, states = load_checkpoint(checkpoint_path)
+      continue
+
+    msgs = list(LogReader(segment))
+    CP = next((m.carParams.as_builder() for m in msgs if m.which() == 'carParams'), CP)
+    columns = get_columns(msgs, fields)
+    del msgs
+
+    for name in estimators:
+      outputs, states[name] = ESTIMATORS[name][1](columns, CP, states[name])
+      np.savez_compressed(os.path.join(route_dir, f"{i}.{name}.npz"), **{k: np.array(v) for k, v in outputs.items()})
+    save_checkpoint(checkpoint_path, (CP, states))
+  return route
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run the parameter estimators over routes offline",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs="+")
+  parser.add_argument("--estimators", nargs="+", default=list(ESTIMATORS), choices=list(ESTIMATORS))
+  parser.add_argument("--output", required=True, help="directory for the outputs and checkpoints of each segment")
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of routes to process in parallel")
+  args = parser.parse_args()
+
+  with Pool(args.jobs) as pool:
+    for route in pool.imap_unordered(partial(process_route, estimators=args.estimators, output_dir=args.output), args.routes):
+      print(f"{route}: done")
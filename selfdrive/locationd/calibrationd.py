@@ -85,6 +85,16 @@ class Calibrator:
     self.reset(rpy_init, valid_blocks, wide_from_device_euler, height)
     self.update_status()
 
+  def __getstate__(self) -> dict:
+    # Params can't be pickled, it's reopened when restoring a checkpoint
+    state = self.__dict__.copy()
+    del state['params']
+    return state
+
+  def __setstate__(self, state: dict) -> None:
+    self.__dict__.update(state)
+    self.params = Params()
+
   def reset(self, rpy_init: np.ndarray = RPY_INIT,
                   valid_blocks: int = 0,
                   wide_from_device_euler_init: np.ndarray = WIDE_FROM_DEVICE_EULER_INIT,
@@ -5,19 +5,37 @@ from cereal import log
 
 
 class NPQueue:
+  """Fixed size FIFO of rows in a circular buffer, keeping the running sum of the outer products of its rows"""
   def __init__(self, maxlen: int, rowsize: int) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((maxlen, rowsize))
+    self.scatter = np.zeros((rowsize, rowsize))
+    self.idx = 0  # next row to overwrite
+    self.count = 0
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.count
+
+  @property
+  def arr(self) -> np.ndarray:
+    """Rows in insertion order, a view unless the buffer has wrapped around"""
+    if self.count < self.maxlen or self.idx == 0:
+      return self.buf[:self.count]
+    return np.concatenate((self.buf[self.idx:], self.buf[:self.idx]))
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    row = self.buf[self.idx]
+    if self.count == self.maxlen:
+      self.scatter -= np.outer(row, row)
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.count += 1
+    row[:] = pt
+    self.scatter += np.outer(row, row)
+    self.idx = (self.idx + 1) % self.maxlen
+
+    # recompute once per lap so rounding errors of the running sum don't accumulate
+    if self.idx == 0:
+      self.scatter = self.buf.T @ self.buf
 
 
 class PointBuckets:
@@ -42,10 +60,19 @@ class PointBuckets:
     raise NotImplementedError
 
   def get_points(self, num_points: int = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
     if num_points is None:
-      return points
-    return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
+      return np.vstack([x.arr for x in self.buckets.values()])
+
+    # sample from the bucket buffers directly, without stacking all points first
+    lengths = [len(x) for x in self.buckets.values()]
+    idxs = np.random.choice(sum(lengths), min(sum(lengths), num_points), replace=False)
+    bucket_idxs = np.searchsorted(np.cumsum(lengths), idxs, side='right')
+    offsets = np.cumsum([0] + lengths[:-1])
+    return np.vstack([x.buf[idxs[bucket_idxs == i] - offsets[i]] for i, x in enumerate(self.buckets.values())])
+
+  def get_scatter(self) -> np.ndarray:
+    """Sum of the outer products of all points, the normal matrix of the least squares fit"""
+    return sum(x.scatter for x in self.buckets.values())
 
   def load_points(self, points: list[list[float]]) -> None:
     for point in points:
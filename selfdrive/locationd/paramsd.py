@@ -2,6 +2,7 @@
 import os
 import math
 import json
+import capnp
 import numpy as np
 
 import cereal.messaging as messaging
@@ -31,12 +32,16 @@ class ParamsLearner:
   def __init__(self, CP, steer_ratio, stiffness_factor, angle_offset, P_initial=None):
     self.kf = CarKalman(GENERATED_DIR, steer_ratio, stiffness_factor, angle_offset, P_initial)
 
-    self.kf.filter.set_global("mass", CP.mass)
-    self.kf.filter.set_global("rotational_inertia", CP.rotationalInertia)
-    self.kf.filter.set_global("center_to_front", CP.centerToFront)
-    self.kf.filter.set_global("center_to_rear", CP.wheelbase - CP.centerToFront)
-    self.kf.filter.set_global("stiffness_front", CP.tireStiffnessFront)
-    self.kf.filter.set_global("stiffness_rear", CP.tireStiffnessRear)
+    self.kf_globals = {
+      "mass": CP.mass,
+      "rotational_inertia": CP.rotationalInertia,
+      "center_to_front": CP.centerToFront,
+      "center_to_rear": CP.wheelbase - CP.centerToFront,
+      "stiffness_front": CP.tireStiffnessFront,
+      "stiffness_rear": CP.tireStiffnessRear,
+    }
+    for name, value in self.kf_globals.items():
+      self.kf.filter.set_global(name, value)
 
     self.active = False
 
@@ -47,6 +52,21 @@ class ParamsLearner:
     self.steering_angle = 0.0
     self.roll_valid = False
 
+  def __getstate__(self):
+    # the filter can't be pickled, checkpoint its state instead
+    state = self.__dict__.copy()
+    kf = state.pop('kf')
+    state['kf_state'] = (kf.x.copy(), kf.P.copy(), kf.t)
+    return state
+
+  def __setstate__(self, state):
+    x, P, t = state.pop('kf_state')
+    self.__dict__.update(state)
+    self.kf = CarKalman(GENERATED_DIR)
+    for name, value in self.kf_globals.items():
+      self.kf.filter.set_global(name, value)
+    self.kf.init_state(x, covs=P, filter_time=t)
+
   def handle_log(self, t, which, msg):
     if which == 'liveLocationKalman':
       self.yaw_rate = msg.angularVelocityCalibrated.value[2]
@@ -117,6 +137,61 @@ def check_valid_with_hysteresis(current_valid: bool, val: float, threshold: floa
   return current_valid
 
 
+class LiveParametersFilter:
+  """Fills liveParameters from the learner's filter state, rate limiting the angle offsets and roll and
+  applying hysteresis to their validity. Its state outlives the learner being reset."""
+  def __init__(self, CP, angle_offset_average_deg: float = 0.0):
+    self.min_sr, self.max_sr = 0.5 * CP.steerRatio, 2.0 * CP.steerRatio
+    self.angle_offset_average = angle_offset_average_deg
+    self.angle_offset = angle_offset_average_deg
+    self.roll = 0.0
+    self.avg_offset_valid = True
+    self.total_offset_valid = True
+    self.roll_valid = True
+
+  def fill_msg(self, liveParameters: capnp._DynamicStructBuilder, learner: ParamsLearner, x: np.ndarray, P: np.ndarray, debug: bool = False) -> None:
+    self.angle_offset_average = clip(math.degrees(x[States.ANGLE_OFFSET].item()),
+                                     self.angle_offset_average - MAX_ANGLE_OFFSET_DELTA, self.angle_offset_average + MAX_ANGLE_OFFSET_DELTA)
+    self.angle_offset = clip(math.degrees(x[States.ANGLE_OFFSET].item() + x[States.ANGLE_OFFSET_FAST].item()),
+                             self.angle_offset - MAX_ANGLE_OFFSET_DELTA, self.angle_offset + MAX_ANGLE_OFFSET_DELTA)
+    self.roll = clip(float(x[States.ROAD_ROLL].item()), self.roll - ROLL_MAX_DELTA, self.roll + ROLL_MAX_DELTA)
+    roll_std = float(P[States.ROAD_ROLL].item())
+    if learner.active and learner.speed > LOW_ACTIVE_SPEED:
+      # Account for the opposite signs of the yaw rates
+      # At low speeds, bumping into a curb can cause the yaw rate to be very high
+      sensors_valid = bool(abs(learner.speed * (x[States.YAW_RATE].item() + learner.yaw_rate)) < LATERAL_ACC_SENSOR_THRESHOLD)
+    else:
+      sensors_valid = True
+    self.avg_offset_valid = check_valid_with_hysteresis(self.avg_offset_valid, self.angle_offset_average, OFFSET_MAX, OFFSET_LOWERED_MAX)
+    self.total_offset_valid = check_valid_with_hysteresis(self.total_offset_valid, self.angle_offset, OFFSET_MAX, OFFSET_LOWERED_MAX)
+    self.roll_valid = check_valid_with_hysteresis(self.roll_valid, self.roll, ROLL_MAX, ROLL_LOWERED_MAX)
+
+    liveParameters.posenetValid = True
+    liveParameters.sensorValid = sensors_valid
+    liveParameters.steerRatio = float(x[States.STEER_RATIO].item())
+    liveParameters.stiffnessFactor = float(x[States.STIFFNESS].item())
+    liveParameters.roll = self.roll
+    liveParameters.angleOffsetAverageDeg = self.angle_offset_average
+    liveParameters.angleOffsetDeg = self.angle_offset
+    liveParameters.valid = all((
+      self.avg_offset_valid,
+      self.total_offset_valid,
+      self.roll_valid,
+      roll_std < ROLL_STD_MAX,
+      0.2 <= liveParameters.stiffnessFactor <= 5.0,
+      self.min_sr <= liveParameters.steerRatio <= self.max_sr,
+    ))
+    liveParameters.steerRatioStd = float(P[States.STEER_RATIO].item())
+    liveParameters.stiffnessFactorStd = float(P[States.STIFFNESS].item())
+    liveParameters.angleOffsetAverageStd = float(P[States.ANGLE_OFFSET].item())
+    liveParameters.angleOffsetFastStd = float(P[States.ANGLE_OFFSET_FAST].item())
+    if debug:
+      liveParameters.filterState = log.LiveLocationKalman.Measurement.new_message()
+      liveParameters.filterState.value = x.tolist()
+      liveParameters.filterState.std = P.tolist()
+      liveParameters.filterState.valid = True
+
+
 def main():
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -175,12 +250,7 @@ def main():
     pInitial = np.array(params['filterState']['std']) if 'filterState' in params else None
 
   learner = ParamsLearner(CP, params['steerRatio'], params['stiffnessFactor'], math.radians(params['angleOffsetAverageDeg']), pInitial)
-  angle_offset_average = params['angleOffsetAverageDeg']
-  angle_offset = angle_offset_average
-  roll = 0.0
-  avg_offset_valid = True
-  total_offset_valid = True
-  roll_valid = True
+  params_filter = LiveParametersFilter(CP, params['angleOffsetAverageDeg'])
 
   while True:
     sm.update()
@@ -198,50 +268,9 @@ def main():
         learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
         x = learner.kf.x
 
-      angle_offset_average = clip(math.degrees(x[States.ANGLE_OFFSET].item()),
-                                  angle_offset_average - MAX_ANGLE_OFFSET_DELTA, angle_offset_average + MAX_ANGLE_OFFSET_DELTA)
-      angle_offset = clip(math.degrees(x[States.ANGLE_OFFSET].item() + x[States.ANGLE_OFFSET_FAST].item()),
-                          angle_offset - MAX_ANGLE_OFFSET_DELTA, angle_offset + MAX_ANGLE_OFFSET_DELTA)
-      roll = clip(float(x[States.ROAD_ROLL].item()), roll - ROLL_MAX_DELTA, roll + ROLL_MAX_DELTA)
-      roll_std = float(P[States.ROAD_ROLL].item())
-      if learner.active and learner.speed > LOW_ACTIVE_SPEED:
-        # Account for the opposite signs of the yaw rates
-        # At low speeds, bumping into a curb can cause the yaw rate to be very high
-        sensors_valid = bool(abs(learner.speed * (x[States.YAW_RATE].item() + learner.yaw_rate)) < LATERAL_ACC_SENSOR_THRESHOLD)
-      else:
-        sensors_valid = True
-      avg_offset_valid = check_valid_with_hysteresis(avg_offset_valid, angle_offset_average, OFFSET_MAX, OFFSET_LOWERED_MAX)
-      total_offset_valid = check_valid_with_hysteresis(total_offset_valid, angle_offset, OFFSET_MAX, OFFSET_LOWERED_MAX)
-      roll_valid = check_valid_with_hysteresis(roll_valid, roll, ROLL_MAX, ROLL_LOWERED_MAX)
-
-      msg = messaging.new_message('liveParameters')
-
+      msg = pm.new_message('liveParameters')
       liveParameters = msg.liveParameters
-      liveParameters.posenetValid = True
-      liveParameters.sensorValid = sensors_valid
-      liveParameters.steerRatio = float(x[States.STEER_RATIO].item())
-      liveParameters.stiffnessFactor = float(x[States.STIFFNESS].item())
-      liveParameters.roll = roll
-      liveParameters.angleOffsetAverageDeg = angle_offset_average
-      liveParameters.angleOffsetDeg = angle_offset
-      liveParameters.valid = all((
-        avg_offset_valid,
-        total_offset_valid,
-        roll_valid,
-        roll_std < ROLL_STD_MAX,
-        0.2 <= liveParameters.stiffnessFactor <= 5.0,
-        min_sr <= liveParameters.steerRatio <= max_sr,
-      ))
-      liveParameters.steerRatioStd = float(P[States.STEER_RATIO].item())
-      liveParameters.stiffnessFactorStd = float(P[States.STIFFNESS].item())
-      liveParameters.angleOffsetAverageStd = float(P[States.ANGLE_OFFSET].item())
-      liveParameters.angleOffsetFastStd = float(P[States.ANGLE_OFFSET_FAST].item())
-      if DEBUG:
-        liveParameters.filterState = log.LiveLocationKalman.Measurement.new_message()
-        liveParameters.filterState.value = x.tolist()
-        liveParameters.filterState.std = P.tolist()
-        liveParameters.filterState.valid = True
-
+      params_filter.fill_msg(liveParameters, learner, x, P, DEBUG)
       msg.valid = sm.all_checks()
 
       if sm.frame % 1200 == 0:  # once a minute
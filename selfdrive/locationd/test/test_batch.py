@@ -0,0 +1,177 @@
+import pickle
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import car
+from openpilot.selfdrive.locationd.batch import CALIBRATIOND_FIELDS, LIVE_PARAMETERS_FIELDS, PARAMSD_FIELDS, TORQUED_FIELDS, get_columns, \
+                                                run_calibrationd, run_paramsd, run_torqued
+from openpilot.selfdrive.locationd.calibrationd import Calibrator
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+
+DT = 0.05  # all services at 20Hz, so the realtime loop sees every message
+
+
+def get_car_params():
+  CP = car.CarParams.new_message(carName='toyota', steerActuatorDelay=0.1, steerRatio=15., mass=1500., wheelbase=2.7, centerToFront=1.2,
+                                 rotationalInertia=2500., tireStiffnessFront=1.5e5, tireStiffnessRear=1.7e5)
+  CP.lateralTuning.init('torque')
+  CP.lateralTuning.torque.friction = 0.1
+  CP.lateralTuning.torque.latAccelFactor = 2.0
+  return CP
+
+
+def get_calibrationd_msgs(n):
+  rng = np.random.default_rng(0)
+  msgs = []
+  for i in range(n):
+    t = int(i * DT * 1e9)
+    cs = messaging.new_message('carState', logMonoTime=t, valid=True)
+    cs.carState.vEgo = 20 + rng.normal()
+    msgs.append(cs)
+
+    co = messaging.new_message('cameraOdometry', logMonoTime=t + 1000, valid=True)
+    co.cameraOdometry.trans = [cs.carState.vEgo, 0.01 * cs.carState.vEgo, -0.02 * cs.carState.vEgo]
+    co.cameraOdometry.rot = [0., 0., float(rng.normal(0, 0.001))]
+    co.cameraOdometry.wideFromDeviceEuler = rng.normal(0, 0.01, 3).tolist()
+    co.cameraOdometry.transStd = [1e-3] * 3
+    co.cameraOdometry.roadTransformTrans = [0., 0., 1.2]
+    co.cameraOdometry.roadTransformTransStd = [1e-3] * 3
+    msgs.append(co)
+  return [m.as_reader() for m in msgs]
+
+
+def get_torqued_msgs(n):
+  rng = np.random.default_rng(0)
+  msgs = []
+  for i in range(n):
+    t = int(i * DT * 1e9)
+    steer = float(rng.uniform(-0.5, 0.5))
+
+    cc = messaging.new_message('carControl', logMonoTime=t, valid=True)
+    cc.carControl.latActive = True
+    co = messaging.new_message('carOutput', logMonoTime=t + 1000, valid=True)
+    co.carOutput.actuatorsOutput.steer = -steer
+    cs = messaging.new_message('carState', logMonoTime=t + 2000, valid=True)
+    cs.carState.vEgo = 25.
+    llk = messaging.new_message('liveLocationKalman', logMonoTime=t + 3000, valid=True)
+    llk.liveLocationKalman.angularVelocityCalibrated.value = [0., 0., (1.8 * steer + float(rng.normal(0, 0.05))) / 25.]
+    llk.liveLocationKalman.orientationNED.value = [0., 0., 0.]
+    msgs += [cc, co, cs, llk]
+  return [m.as_reader() for m in msgs]
+
+
+def get_paramsd_msgs(n):
+  rng = np.random.default_rng(0)
+  msgs = []
+  for i in range(n):
+    t = int(i * DT * 1e9)
+    steering_angle = 5 * np.sin(i * DT / 4)
+
+    cs = messaging.new_message('carState', logMonoTime=t, valid=True)
+    cs.carState.vEgo = 20.
+    cs.carState.steeringAngleDeg = float(steering_angle + 1.)
+    llk = messaging.new_message('liveLocationKalman', logMonoTime=t + 1000, valid=True)
+    llk.liveLocationKalman.angularVelocityCalibrated.value = [0., 0., float(20. * np.radians(steering_angle) / 15. / 2.7 + rng.normal(0, 0.001))]
+    llk.liveLocationKalman.angularVelocityCalibrated.std = [0.01] * 3
+    llk.liveLocationKalman.angularVelocityCalibrated.valid = True
+    llk.liveLocationKalman.orientationNED.value = [float(np.radians(2) + rng.normal(0, 0.001)), 0., 0.]
+    llk.liveLocationKalman.orientationNED.std = [0.005] * 3
+    llk.liveLocationKalman.sensorsOK = True
+    llk.liveLocationKalman.posenetOK = True
+    msgs += [cs, llk]
+  return [m.as_reader() for m in msgs]
+
+
+class TestBatch:
+  def test_calibrationd(self):
+    msgs = get_calibrationd_msgs(2000)
+
+    # realtime loop, driven by cameraOdometry
+    c = Calibrator()
+    expected = []
+    v_ego = 0.
+    frame = -1
+    for msg in msgs:
+      if msg.which() == 'carState':
+        v_ego = msg.carState.vEgo
+        continue
+      frame += 1
+      co = msg.cameraOdometry
+      c.handle_v_ego(v_ego)
+      c.handle_cam_odom(co.trans, co.rot, co.wideFromDeviceEuler, co.transStd, co.roadTransformTrans, co.roadTransformTransStd)
+      if frame % 5 == 0:
+        expected.append(list(c.get_msg(True).liveCalibration.rpyCalib))
+
+    outputs, state = run_calibrationd(get_columns(msgs, CALIBRATIOND_FIELDS))
+    np.testing.assert_allclose(outputs['rpyCalib'], expected)
+    assert state.estimator.valid_blocks == c.valid_blocks
+
+    # continuing from a checkpoint gives the same results as a single run, also when the segment boundary is
+    # between a carState and the cameraOdometry that reads it
+    outputs1, state1 = run_calibrationd(get_columns(msgs[:1001], CALIBRATIOND_FIELDS))
+    outputs2, _ = run_calibrationd(get_columns(msgs[1001:], CALIBRATIOND_FIELDS), state=pickle.loads(pickle.dumps(state1)))
+    np.testing.assert_allclose(outputs1['rpyCalib'] + outputs2['rpyCalib'], expected)
+
+  def test_paramsd(self):
+    # the filter is only built with the full build, so it's imported when used
+    from openpilot.selfdrive.locationd.paramsd import LiveParametersFilter, ParamsLearner
+
+    CP = get_car_params()
+    msgs = get_paramsd_msgs(4000)
+
+    # realtime loop, driven by liveLocationKalman
+    learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+    params_filter = LiveParametersFilter(CP)
+    expected = []
+    for msg in msgs:
+      which = msg.which()
+      learner.handle_log(msg.logMonoTime * 1e-9, which, getattr(msg, which))
+      if which == 'liveLocationKalman':
+        x = learner.kf.x
+        P = np.sqrt(learner.kf.P.diagonal())
+        lp = messaging.new_message('liveParameters').liveParameters
+        params_filter.fill_msg(lp, learner, x, P)
+        expected.append([getattr(lp, name) for name in LIVE_PARAMETERS_FIELDS])
+
+    def get_outputs(outputs):
+      return [list(row) for row in zip(*[outputs[name] for name in LIVE_PARAMETERS_FIELDS], strict=True)]
+
+    outputs, _ = run_paramsd(get_columns(msgs, PARAMSD_FIELDS), CP)
+    assert len(outputs['t']) == len(expected)
+    assert expected[-1][LIVE_PARAMETERS_FIELDS.index('valid')]
+    np.testing.assert_allclose(get_outputs(outputs), expected)
+
+    outputs1, state1 = run_paramsd(get_columns(msgs[:4001], PARAMSD_FIELDS), CP)
+    outputs2, _ = run_paramsd(get_columns(msgs[4001:], PARAMSD_FIELDS), CP, state=pickle.loads(pickle.dumps(state1)))
+    np.testing.assert_allclose(get_outputs(outputs1) + get_outputs(outputs2), expected)
+
+  def test_torqued(self):
+    CP = get_car_params()
+    msgs = get_torqued_msgs(4000)
+
+    # realtime loop, driven by liveLocationKalman
+    estimator = TorqueEstimator(CP)
+    expected = []
+    frame = -1
+    for msg in msgs:
+      which = msg.which()
+      estimator.handle_log(msg.logMonoTime * 1e-9, which, getattr(msg, which))
+      if which == 'liveLocationKalman':
+        frame += 1
+        if frame % 5 == 0:
+          ltp = estimator.get_msg().liveTorqueParameters
+          expected.append((ltp.latAccelFactorRaw, ltp.latAccelOffsetRaw, ltp.frictionCoefficientFiltered, ltp.totalBucketPoints))
+
+    def get_outputs(outputs):
+      return list(zip(outputs['latAccelFactorRaw'], outputs['latAccelOffsetRaw'], outputs['frictionCoefficientFiltered'],
+                      outputs['totalBucketPoints'], strict=True))
+
+    outputs, _ = run_torqued(get_columns(msgs, TORQUED_FIELDS), CP)
+    assert expected[-1][3] > 1000
+    np.testing.assert_allclose(get_outputs(outputs), expected)
+
+    # the updates received before the boundary are handled at the first poll of the next segment
+    outputs1, state1 = run_torqued(get_columns(msgs[:8002], TORQUED_FIELDS), CP)
+    outputs2, _ = run_torqued(get_columns(msgs[8002:], TORQUED_FIELDS), CP, state=pickle.loads(pickle.dumps(state1)))
+    np.testing.assert_allclose(get_outputs(outputs1) + get_outputs(outputs2), expected)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from cereal import car
+from openpilot.selfdrive.locationd.helpers import NPQueue
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator, FRICTION_FACTOR, POINTS_PER_BUCKET, STEER_BUCKET_BOUNDS, slope2rot
+
+
+def get_torque_estimator():
+  CP = car.CarParams.new_message(carName='toyota')
+  CP.lateralTuning.init('torque')
+  CP.lateralTuning.torque.friction = 0.1
+  CP.lateralTuning.torque.latAccelFactor = 2.5
+  return TorqueEstimator(CP)
+
+
+class TestTorqued:
+  def test_npqueue(self):
+    q = NPQueue(maxlen=5, rowsize=2)
+    for i in range(23):
+      q.append([i, -2 * i])
+      expected = np.array([[j, -2 * j] for j in range(max(0, i - 4), i + 1)], dtype=float)
+      np.testing.assert_array_equal(q.arr, expected)
+      np.testing.assert_allclose(q.scatter, expected.T @ expected)
+
+  def test_estimate_params(self):
+    # the fit from the running scatter matrix matches the total least squares fit over all points
+    estimator = get_torque_estimator()
+    rng = np.random.default_rng(0)
+    for _ in range(len(STEER_BUCKET_BOUNDS) * POINTS_PER_BUCKET * 2):
+      steer = rng.uniform(-0.5, 0.5)
+      estimator.filtered_points.add_point(steer, 2.3 * steer + 0.05 + rng.normal(0, 0.1))
+
+    points = estimator.filtered_points.get_points()
+    np.testing.assert_allclose(estimator.filtered_points.get_scatter(), points.T @ points)
+
+    _, _, v = np.linalg.svd(points, full_matrices=False)
+    slope, offset = -v.T[0:2, 2] / v.T[2, 2]
+    _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
+    np.testing.assert_allclose(estimator.estimate_params(), (slope, offset, np.std(spread) * FRICTION_FACTOR))
+
+    sample = estimator.filtered_points.get_points(600)
+    assert len({tuple(p) for p in sample}) == 600
+    assert {tuple(p) for p in sample} <= {tuple(p) for p in points}
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import numpy as np
 from collections import deque, defaultdict
+from functools import partial
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -15,8 +16,6 @@ HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
 MIN_POINTS_TOTAL = 4000
 MIN_POINTS_TOTAL_QLOG = 600
-FIT_POINTS_TOTAL = 2000
-FIT_POINTS_TOTAL_QLOG = 600
 MIN_VEL = 15  # m/s
 FRICTION_FACTOR = 1.5  # ~85% of data coverage
 FACTOR_SANITY = 0.3
@@ -56,14 +55,12 @@ class TorqueEstimator(ParameterEstimator):
     if decimated:
       self.min_bucket_points = MIN_BUCKET_POINTS / 10
       self.min_points_total = MIN_POINTS_TOTAL_QLOG
-      self.fit_points = FIT_POINTS_TOTAL_QLOG
       self.factor_sanity = FACTOR_SANITY_QLOG
       self.friction_sanity = FRICTION_SANITY_QLOG
 
     else:
       self.min_bucket_points = MIN_BUCKET_POINTS
       self.min_points_total = MIN_POINTS_TOTAL
-      self.fit_points = FIT_POINTS_TOTAL
       self.factor_sanity = FACTOR_SANITY
       self.friction_sanity = FRICTION_SANITY
 
@@ -129,7 +126,7 @@ class TorqueEstimator(ParameterEstimator):
   def reset(self):
     self.resets += 1.0
     self.decay = MIN_FILTER_DECAY
-    self.raw_points = defaultdict(lambda: deque(maxlen=self.hist_len))
+    self.raw_points = defaultdict(partial(deque, maxlen=self.hist_len))
     self.filtered_points = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS,
                                          min_points=self.min_bucket_points,
                                          min_points_total=self.min_points_total,
@@ -137,14 +134,20 @@ class TorqueEstimator(ParameterEstimator):
                                          rowsize=3)
 
   def estimate_params(self):
-    points = self.filtered_points.get_points(self.fit_points)
+    # points are [x, 1, y] rows, their scatter matrix S = P^T P is updated as points are added
+    S = self.filtered_points.get_scatter()
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
-      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
-      friction_coeff = np.std(spread) * FRICTION_FACTOR
+      # the right singular vector of P with the smallest singular value is the eigenvector of S with the smallest eigenvalue
+      _, v = np.linalg.eigh(S)
+      slope, offset = -v[0:2, 0] / v[2, 0]
+      # spread is the coordinate of each point perpendicular to the fit, its moments follow from S
+      w_x, w_y = slope2rot(slope)[:, 1]
+      w = np.array([w_x, 0., w_y])
+      n = S[1, 1]
+      spread_mean = w @ S[:, 1] / n
+      friction_coeff = np.sqrt(max(w @ S @ w / n - spread_mean ** 2, 0.)) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
       cloudlog.exception(f"Error computing live torque params: {e}")
       slope = offset = friction_coeff = np.nan
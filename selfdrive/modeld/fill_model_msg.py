@@ -1,4 +1,5 @@
 import os
+import time
 import capnp
 import numpy as np
 from cereal import log
@@ -14,32 +15,58 @@ class PublishState:
     self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
     self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
 
-def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
-  builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.z = z.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if z_std is not None:
-    builder.zStd = z_std.tolist()
-
-def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std=None):
-  builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.v = v.tolist()
-  builder.a = a.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if v_std is not None:
-    builder.vStd = v_std.tolist()
-  if a_std is not None:
-    builder.aStd = a_std.tolist()
+X_IDXS = np.array(ModelConstants.X_IDXS)
+T_IDXS = np.array(ModelConstants.T_IDXS)
+
+def fill_model_msg_constants(modelV2: capnp._DynamicStructBuilder) -> None:
+  # fields that are the same in every frame
+  for xyzt in (modelV2.position, modelV2.velocity, modelV2.acceleration, modelV2.orientation, modelV2.orientationRate):
+    xyzt.t = ModelConstants.T_IDXS
+  for lane_line in modelV2.init('laneLines', ModelConstants.NUM_LANE_LINES):
+    lane_line.x = ModelConstants.X_IDXS
+  for road_edge in modelV2.init('roadEdges', ModelConstants.NUM_ROAD_EDGES):
+    road_edge.x = ModelConstants.X_IDXS
+  for lead, prob_time in zip(modelV2.init('leadsV3', len(ModelConstants.LEAD_T_OFFSETS)), ModelConstants.LEAD_T_OFFSETS, strict=True):
+    lead.t = ModelConstants.LEAD_T_IDXS
+    lead.probTime = prob_time
+  modelV2.meta.init('disengagePredictions').t = ModelConstants.META_T_IDXS
+
+def get_model_msg_template() -> capnp._DynamicStructBuilder:
+  msg = log.Event.new_message(valid=False)
+  fill_model_msg_constants(msg.init('modelV2'))
+  return msg
+
+MODEL_MSG_TEMPLATE = get_model_msg_template()
+
+def new_model_msg() -> capnp._DynamicStructBuilder:
+  """A new modelV2 event for fill_model_msg, copied from a template with the fields that don't change between frames already filled in"""
+  msg = MODEL_MSG_TEMPLATE.copy()
+  msg.logMonoTime = int(time.monotonic() * 1e9)
+  return msg
+
+def get_plan_t_idxs(plan_x: np.ndarray) -> list[float]:
+  # times at X_IDXS according to model plan
+  plan_t = np.full(ModelConstants.IDX_N, np.nan)
+  plan_t[0] = 0.0
+  # the first plan point at or past each x, the running max keeps the search sorted if the plan goes backwards
+  plan_x = plan_x.astype(np.float64)
+  tidx = np.searchsorted(np.maximum.accumulate(plan_x[1:]), X_IDXS[1:])
+  # tidx is sorted, the plan doesn't extend past the x's from the first one without a point after it
+  n = int(tidx.searchsorted(ModelConstants.IDX_N - 1))
+  tidx = tidx[:n]
+
+  # interpolate to find `t` for each x the plan reaches
+  current_x_val = plan_x[tidx]
+  dx = plan_x[tidx+1] - current_x_val
+  valid = np.abs(dx) > 1e-9
+  p = (X_IDXS[1:n+1] - current_x_val) / np.where(valid, dx, 1.0)
+  p[~valid] = np.nan
+  plan_t[1:n+1] = p * T_IDXS[tidx+1] + (1 - p) * T_IDXS[tidx]
+
+  if n < ModelConstants.IDX_N - 1:
+    # if the Plan doesn't extend far enough, set plan_t to the max value (10s), later x's have no time
+    plan_t[n+1] = T_IDXS[-1]
+  return plan_t.tolist()
 
 def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str, np.ndarray], publish_state: PublishState,
                    vipc_frame_id: int, vipc_frame_id_extra: int, frame_id: int, frame_drop: float,
@@ -48,6 +75,9 @@ def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str,
   msg.valid = valid
 
   modelV2 = msg.modelV2
+  if len(modelV2.laneLines) == 0:
+    # not created with new_model_msg
+    fill_model_msg_constants(modelV2)
   modelV2.frameId = vipc_frame_id
   modelV2.frameIdExtra = vipc_frame_id_extra
   modelV2.frameAge = frame_age
@@ -55,78 +85,61 @@ def fill_model_msg(msg: capnp._DynamicStructBuilder, net_output_data: dict[str,
   modelV2.timestampEof = timestamp_eof
   modelV2.modelExecutionTime = model_execution_time
 
-  # plan
+  # plan, as lists of each plan column
+  plan = net_output_data['plan'][0].T.tolist()
+  plan_stds = net_output_data['plan_stds'][0,:,Plan.POSITION].T.tolist()
   position = modelV2.position
-  fill_xyzt(position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
-  velocity = modelV2.velocity
-  fill_xyzt(velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
-  acceleration = modelV2.acceleration
-  fill_xyzt(acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
-  orientation = modelV2.orientation
-  fill_xyzt(orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
-  orientation_rate = modelV2.orientationRate
-  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+  position.x, position.y, position.z = plan[Plan.POSITION]
+  position.xStd, position.yStd, position.zStd = plan_stds
+  for xyzt, plan_slice in ((modelV2.velocity, Plan.VELOCITY), (modelV2.acceleration, Plan.ACCELERATION),
+                           (modelV2.orientation, Plan.T_FROM_CURRENT_EULER), (modelV2.orientationRate, Plan.ORIENTATION_RATE)):
+    xyzt.x, xyzt.y, xyzt.z = plan[plan_slice]
 
   # lateral planning
   action = modelV2.action
   action.desiredCurvature = float(net_output_data['desired_curvature'][0,0])
 
-  # times at X_IDXS according to model plan
-  PLAN_T_IDXS = [np.nan] * ModelConstants.IDX_N
-  PLAN_T_IDXS[0] = 0.0
-  plan_x = net_output_data['plan'][0,:,Plan.POSITION][:,0].tolist()
-  for xidx in range(1, ModelConstants.IDX_N):
-    tidx = 0
-    # increment tidx until we find an element that's further away than the current xidx
-    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
-      tidx += 1
-    if tidx == ModelConstants.IDX_N - 1:
-      # if the Plan doesn't extend far enough, set plan_t to the max value (10s), then break
-      PLAN_T_IDXS[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
-      break
-    # interpolate to find `t` for the current xidx
-    current_x_val = plan_x[tidx]
-    next_x_val = plan_x[tidx+1]
-    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
-    PLAN_T_IDXS[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
+  plan_t_idxs = get_plan_t_idxs(net_output_data['plan'][0,:,Plan.POSITION][:,0])
 
   # lane lines
-  modelV2.init('laneLines', 4)
-  for i in range(4):
-    lane_line = modelV2.laneLines[i]
-    fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
+  lane_lines = net_output_data['lane_lines'][0].transpose(0, 2, 1).tolist()
+  for lane_line, (y, z) in zip(modelV2.laneLines, lane_lines, strict=True):
+    lane_line.t = plan_t_idxs
+    lane_line.y = y
+    lane_line.z = z
   modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
   modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
 
   # road edges
-  modelV2.init('roadEdges', 2)
-  for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
+  road_edges = net_output_data['road_edges'][0].transpose(0, 2, 1).tolist()
+  for road_edge, (y, z) in zip(modelV2.roadEdges, road_edges, strict=True):
+    road_edge.t = plan_t_idxs
+    road_edge.y = y
+    road_edge.z = z
   modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
 
   # leads
-  modelV2.init('leadsV3', 3)
-  for i in range(3):
-    lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
-    lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+  leads = net_output_data['lead'][0].transpose(0, 2, 1).tolist()
+  lead_stds = net_output_data['lead_stds'][0].transpose(0, 2, 1).tolist()
+  lead_probs = net_output_data['lead_prob'][0].tolist()
+  for lead, (x, y, v, a), (x_std, y_std, v_std, a_std), prob in zip(modelV2.leadsV3, leads, lead_stds, lead_probs, strict=True):
+    lead.x, lead.y, lead.v, lead.a = x, y, v, a
+    lead.xStd, lead.yStd, lead.vStd, lead.aStd = x_std, y_std, v_std, a_std
+    lead.prob = prob
 
   # meta
   meta = modelV2.meta
   meta.desireState = net_output_data['desire_state'][0].reshape(-1).tolist()
   meta.desirePrediction = net_output_data['desire_pred'][0].reshape(-1).tolist()
-  meta.engagedProb = net_output_data['meta'][0,Meta.ENGAGED].item()
-  meta.init('disengagePredictions')
+  meta_probs = net_output_data['meta'][0].tolist()
+  meta.engagedProb = meta_probs[Meta.ENGAGED][0]
   disengage_predictions = meta.disengagePredictions
-  disengage_predictions.t = ModelConstants.META_T_IDXS
-  disengage_predictions.brakeDisengageProbs = net_output_data['meta'][0,Meta.BRAKE_DISENGAGE].tolist()
-  disengage_predictions.gasDisengageProbs = net_output_data['meta'][0,Meta.GAS_DISENGAGE].tolist()
-  disengage_predictions.steerOverrideProbs = net_output_data['meta'][0,Meta.STEER_OVERRIDE].tolist()
-  disengage_predictions.brake3MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_3].tolist()
-  disengage_predictions.brake4MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_4].tolist()
-  disengage_predictions.brake5MetersPerSecondSquaredProbs = net_output_data['meta'][0,Meta.HARD_BRAKE_5].tolist()
+  disengage_predictions.brakeDisengageProbs = meta_probs[Meta.BRAKE_DISENGAGE]
+  disengage_predictions.gasDisengageProbs = meta_probs[Meta.GAS_DISENGAGE]
+  disengage_predictions.steerOverrideProbs = meta_probs[Meta.STEER_OVERRIDE]
+  disengage_predictions.brake3MetersPerSecondSquaredProbs = meta_probs[Meta.HARD_BRAKE_3]
+  disengage_predictions.brake4MetersPerSecondSquaredProbs = meta_probs[Meta.HARD_BRAKE_4]
+  disengage_predictions.brake5MetersPerSecondSquaredProbs = meta_probs[Meta.HARD_BRAKE_5]
 
   publish_state.prev_brake_5ms2_probs[:-1] = publish_state.prev_brake_5ms2_probs[1:]
   publish_state.prev_brake_5ms2_probs[-1] = net_output_data['meta'][0,Meta.HARD_BRAKE_5][0]
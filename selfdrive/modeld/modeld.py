@@ -20,7 +20,7 @@ from openpilot.selfdrive.car.car_helpers import get_demo_car_params
 from openpilot.selfdrive.controls.lib.desire_helper import DesireHelper
 from openpilot.selfdrive.modeld.runners import ModelRunner, Runtime
 from openpilot.selfdrive.modeld.parse_model_outputs import Parser
-from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, fill_pose_msg, PublishState
+from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, fill_pose_msg, new_model_msg, PublishState
 from openpilot.selfdrive.modeld.constants import ModelConstants
 from openpilot.selfdrive.modeld.models.commonmodel_pyx import ModelFrame, CLContext
 
@@ -50,7 +50,7 @@ class ModelState:
   prev_desire: np.ndarray  # for tracking the rising edge of the pulse
   model: ModelRunner
 
-  def __init__(self, context: CLContext):
+  def __init__(self, context: CLContext, model: ModelRunner | None = None):
     self.frame = ModelFrame(context)
     self.wide_frame = ModelFrame(context)
     self.prev_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
@@ -70,11 +70,15 @@ class ModelState:
     self.output = np.zeros(net_output_size, dtype=np.float32)
     self.parser = Parser()
 
-    self.model = ModelRunner(MODEL_PATHS, self.output, Runtime.GPU, False, context)
-    self.model.addInput("input_imgs", None)
-    self.model.addInput("big_input_imgs", None)
-    for k,v in self.inputs.items():
-      self.model.addInput(k, v)
+    if model is None:
+      self.model = ModelRunner(MODEL_PATHS, self.output, Runtime.GPU, False, context)
+      self.model.addInput("input_imgs", None)
+      self.model.addInput("big_input_imgs", None)
+      for k,v in self.inputs.items():
+        self.model.addInput(k, v)
+    else:
+      # shared with other states, the caller feeds it the inputs from prepare() and gives the outputs to update()
+      self.model = model
 
   def slice_outputs(self, model_outputs: np.ndarray) -> dict[str, np.ndarray]:
     parsed_model_outputs = {k: model_outputs[np.newaxis, v] for k,v in self.output_slices.items()}
@@ -82,8 +86,8 @@ class ModelState:
       parsed_model_outputs['raw_pred'] = model_outputs.copy()
     return parsed_model_outputs
 
-  def run(self, buf: VisionBuf, wbuf: VisionBuf, transform: np.ndarray, transform_wide: np.ndarray,
-                inputs: dict[str, np.ndarray], prepare_only: bool) -> dict[str, np.ndarray] | None:
+  def prepare(self, buf: VisionBuf, wbuf: VisionBuf, transform: np.ndarray, transform_wide: np.ndarray,
+              inputs: dict[str, np.ndarray]) -> dict[str, np.ndarray | None]:
     # Model decides when action is completed, so desire input is just a pulse triggered on rising edge
     inputs['desire'][0] = 0
     self.inputs['desire'][:-ModelConstants.DESIRE_LEN] = self.inputs['desire'][ModelConstants.DESIRE_LEN:]
@@ -94,15 +98,13 @@ class ModelState:
     self.inputs['lateral_control_params'][:] = inputs['lateral_control_params']
 
     # if getCLBuffer is not None, frame will be None
-    self.model.setInputBuffer("input_imgs", self.frame.prepare(buf, transform.flatten(), self.model.getCLBuffer("input_imgs")))
+    imgs = {"input_imgs": self.frame.prepare(buf, transform.flatten(), self.model.getCLBuffer("input_imgs"))}
     if wbuf is not None:
-      self.model.setInputBuffer("big_input_imgs", self.wide_frame.prepare(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs")))
+      imgs["big_input_imgs"] = self.wide_frame.prepare(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs"))
+    return imgs
 
-    if prepare_only:
-      return None
-
-    self.model.execute()
-    outputs = self.parser.parse_outputs(self.slice_outputs(self.output))
+  def update(self, model_output: np.ndarray) -> dict[str, np.ndarray]:
+    outputs = self.parser.parse_outputs(self.slice_outputs(model_output))
 
     self.inputs['features_buffer'][:-ModelConstants.FEATURE_LEN] = self.inputs['features_buffer'][ModelConstants.FEATURE_LEN:]
     self.inputs['features_buffer'][-ModelConstants.FEATURE_LEN:] = outputs['hidden_state'][0, :]
@@ -110,6 +112,60 @@ class ModelState:
     self.inputs['prev_desired_curv'][-ModelConstants.PREV_DESIRED_CURV_LEN:] = outputs['desired_curvature'][0, :]
     return outputs
 
+  def run(self, buf: VisionBuf, wbuf: VisionBuf, transform: np.ndarray, transform_wide: np.ndarray,
+                inputs: dict[str, np.ndarray], prepare_only: bool) -> dict[str, np.ndarray] | None:
+    for k, v in self.prepare(buf, wbuf, transform, transform_wide, inputs).items():
+      self.model.setInputBuffer(k, v)
+
+    if prepare_only:
+      return None
+
+    self.model.execute()
+    return self.update(self.output)
+
+
+def get_model_transforms(sm, main_wide_camera: bool) -> tuple[np.ndarray, np.ndarray]:
+  device_from_calib_euler = np.array(sm["liveCalibration"].rpyCalib, dtype=np.float32)
+  dc = DEVICE_CAMERAS[(str(sm['deviceState'].deviceType), str(sm['roadCameraState'].sensor))]
+  model_transform_main = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics if main_wide_camera else dc.fcam.intrinsics, False).astype(np.float32)
+  model_transform_extra = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics, True).astype(np.float32)
+  return model_transform_main, model_transform_extra
+
+
+def get_model_inputs(sm, desire: int, steer_delay: float) -> dict[str, np.ndarray]:
+  traffic_convention = np.zeros(2)
+  traffic_convention[int(sm["driverMonitoringState"].isRHD)] = 1
+
+  vec_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
+  if desire >= 0 and desire < ModelConstants.DESIRE_LEN:
+    vec_desire[desire] = 1
+
+  return {
+    'desire': vec_desire,
+    'traffic_convention': traffic_convention,
+    'lateral_control_params': np.array([sm["carState"].vEgo, steer_delay], dtype=np.float32),
+  }
+
+
+def build_model_msgs(model_output: dict[str, np.ndarray], sm, DH: DesireHelper, publish_state: PublishState, meta_main: FrameMeta,
+                     meta_extra: FrameMeta, frame_drop_ratio: float, model_execution_time: float, vipc_dropped_frames: int,
+                     live_calib_seen: bool):
+  modelv2_send = new_model_msg()
+  posenet_send = messaging.new_message('cameraOdometry')
+  fill_model_msg(modelv2_send, model_output, publish_state, meta_main.frame_id, meta_extra.frame_id, sm["roadCameraState"].frameId,
+                 frame_drop_ratio, meta_main.timestamp_eof, model_execution_time, live_calib_seen)
+
+  desire_state = modelv2_send.modelV2.meta.desireState
+  l_lane_change_prob = desire_state[log.Desire.laneChangeLeft]
+  r_lane_change_prob = desire_state[log.Desire.laneChangeRight]
+  lane_change_prob = l_lane_change_prob + r_lane_change_prob
+  DH.update(sm['carState'], sm['carControl'].latActive, lane_change_prob)
+  modelv2_send.modelV2.meta.laneChangeState = DH.lane_change_state
+  modelv2_send.modelV2.meta.laneChangeDirection = DH.lane_change_direction
+
+  fill_pose_msg(posenet_send, model_output, meta_main.frame_id, vipc_dropped_frames, meta_main.timestamp_eof, live_calib_seen)
+  return modelv2_send, posenet_send
+
 
 def main(demo=False):
   cloudlog.warning("modeld init")
@@ -157,7 +213,6 @@ def main(demo=False):
 
   # setup filter to track dropped frames
   frame_dropped_filter = FirstOrderFilter(0., 10., 1. / ModelConstants.MODEL_FREQ)
-  frame_id = 0
   last_vipc_frame_id = 0
   run_count = 0
 
@@ -215,24 +270,10 @@ def main(demo=False):
       meta_extra = meta_main
 
     sm.update(0)
-    desire = DH.desire
-    is_rhd = sm["driverMonitoringState"].isRHD
-    frame_id = sm["roadCameraState"].frameId
-    lateral_control_params = np.array([sm["carState"].vEgo, steer_delay], dtype=np.float32)
     if sm.updated["liveCalibration"] and sm.seen['roadCameraState'] and sm.seen['deviceState']:
-      device_from_calib_euler = np.array(sm["liveCalibration"].rpyCalib, dtype=np.float32)
-      dc = DEVICE_CAMERAS[(str(sm['deviceState'].deviceType), str(sm['roadCameraState'].sensor))]
-      model_transform_main = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics if main_wide_camera else dc.fcam.intrinsics, False).astype(np.float32)
-      model_transform_extra = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics, True).astype(np.float32)
+      model_transform_main, model_transform_extra = get_model_transforms(sm, main_wide_camera)
       live_calib_seen = True
 
-    traffic_convention = np.zeros(2)
-    traffic_convention[int(is_rhd)] = 1
-
-    vec_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
-    if desire >= 0 and desire < ModelConstants.DESIRE_LEN:
-      vec_desire[desire] = 1
-
     # tracked dropped frames
     vipc_dropped_frames = max(0, meta_main.frame_id - last_vipc_frame_id - 1)
     frames_dropped = frame_dropped_filter.update(min(vipc_dropped_frames, 10))
@@ -246,11 +287,7 @@ def main(demo=False):
     if prepare_only:
       cloudlog.error(f"skipping model eval. Dropped {vipc_dropped_frames} frames")
 
-    inputs:dict[str, np.ndarray] = {
-      'desire': vec_desire,
-      'traffic_convention': traffic_convention,
-      'lateral_control_params': lateral_control_params,
-      }
+    inputs = get_model_inputs(sm, DH.desire, steer_delay)
 
     mt1 = time.perf_counter()
     model_output = model.run(buf_main, buf_extra, model_transform_main, model_transform_extra, inputs, prepare_only)
@@ -258,20 +295,8 @@ def main(demo=False):
     model_execution_time = mt2 - mt1
 
     if model_output is not None:
-      modelv2_send = messaging.new_message('modelV2')
-      posenet_send = messaging.new_message('cameraOdometry')
-      fill_model_msg(modelv2_send, model_output, publish_state, meta_main.frame_id, meta_extra.frame_id, frame_id, frame_drop_ratio,
-                      meta_main.timestamp_eof, model_execution_time, live_calib_seen)
-
-      desire_state = modelv2_send.modelV2.meta.desireState
-      l_lane_change_prob = desire_state[log.Desire.laneChangeLeft]
-      r_lane_change_prob = desire_state[log.Desire.laneChangeRight]
-      lane_change_prob = l_lane_change_prob + r_lane_change_prob
-      DH.update(sm['carState'], sm['carControl'].latActive, lane_change_prob)
-      modelv2_send.modelV2.meta.laneChangeState = DH.lane_change_state
-      modelv2_send.modelV2.meta.laneChangeDirection = DH.lane_change_direction
-
-      fill_pose_msg(posenet_send, model_output, meta_main.frame_id, vipc_dropped_frames, meta_main.timestamp_eof, live_calib_seen)
+      modelv2_send, posenet_send = build_model_msgs(model_output, sm, DH, publish_state, meta_main, meta_extra, frame_drop_ratio,
+                                                    model_execution_time, vipc_dropped_frames, live_calib_seen)
       pm.send('modelV2', modelv2_send)
       pm.send('cameraOdometry', posenet_send)
 
@@ -1,11 +1,17 @@
 import numpy as np
 from openpilot.selfdrive.modeld.constants import ModelConstants
 
-def sigmoid(x):
-  return 1. / (1. + np.exp(-x))
+def sigmoid(x, out=None):
+  out = np.negative(x, out=out)
+  np.exp(out, out=out)
+  out += 1.
+  return np.reciprocal(out, out=out)
 
-def softmax(x, axis=-1):
-  x -= np.max(x, axis=axis, keepdims=True)
+def softmax(x, axis=-1, out=None):
+  if out is not None:
+    x = np.subtract(x, np.max(x, axis=axis, keepdims=True), out=out)
+  else:
+    x -= np.max(x, axis=axis, keepdims=True)
   if x.dtype == np.float32 or x.dtype == np.float64:
     np.exp(x, out=x)
   else:
@@ -14,8 +20,18 @@ def softmax(x, axis=-1):
   return x
 
 class Parser:
+  """Parses the raw outputs of a batch of model frames, every output has the frames as its first axis.
+
+  Parsed outputs are written to buffers owned by the parser, which are reused by the next call."""
   def __init__(self, ignore_missing=False):
     self.ignore_missing = ignore_missing
+    self.buffers: dict[str, np.ndarray] = {}
+
+  def get_buffer(self, name, shape, dtype):
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = self.buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
 
   def check_missing(self, outs, name):
     if name not in outs and not self.ignore_missing:
@@ -28,13 +44,20 @@ class Parser:
     raw = outs[name]
     if out_shape is not None:
       raw = raw.reshape((raw.shape[0],) + out_shape)
-    outs[name] = softmax(raw, axis=-1)
+    outs[name] = softmax(raw, axis=-1, out=self.get_buffer(name, raw.shape, raw.dtype))
 
   def parse_binary_crossentropy(self, name, outs):
     if self.check_missing(outs, name):
       return
     raw = outs[name]
-    outs[name] = sigmoid(raw)
+    outs[name] = sigmoid(raw, out=self.get_buffer(name, raw.shape, raw.dtype))
+
+  def select_hypotheses(self, name, x, idxs):
+    # x[fidx, idxs[fidx]] for every frame, as rows of x with the frames and hypotheses flattened
+    rows = idxs + x.shape[1] * np.arange(x.shape[0])[:, None] if x.shape[0] > 1 else idxs
+    out = self.get_buffer(name, idxs.shape + x.shape[2:], x.dtype)
+    x.reshape((-1,) + x.shape[2:]).take(rows.reshape(-1), axis=0, out=out.reshape((-1,) + x.shape[2:]))
+    return out
 
   def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
     if self.check_missing(outs, name):
@@ -42,34 +65,29 @@ class Parser:
     raw = outs[name]
     raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
 
-    pred_mu = raw[:,:,:(raw.shape[2] - out_N)//2]
     n_values = (raw.shape[2] - out_N)//2
     pred_mu = raw[:,:,:n_values]
-    pred_std = np.exp(raw[:,:,n_values: 2*n_values])
+    pred_std = np.exp(raw[:,:,n_values: 2*n_values], out=self.get_buffer(name + '_stds_raw', pred_mu.shape, raw.dtype))
 
     if in_N > 1:
-      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
-      for i in range(out_N):
-        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+      weights_shape = (raw.shape[0], in_N, out_N)
+      weights = softmax(raw[:,:,raw.shape[2] - out_N:], axis=1, out=self.get_buffer(name + '_weights_raw', weights_shape, raw.dtype))
 
       if out_N == 1:
-        for fidx in range(weights.shape[0]):
-          idxs = np.argsort(weights[fidx][:,0])[::-1]
-          weights[fidx] = weights[fidx][idxs]
-          pred_mu[fidx] = pred_mu[fidx][idxs]
-          pred_std[fidx] = pred_std[fidx][idxs]
+        # hypotheses in order of decreasing weight
+        idxs = np.argsort(weights[:,:,0], axis=1)[:,::-1]
+        weights = self.select_hypotheses(name + '_weights', weights, idxs)
+        pred_mu = self.select_hypotheses(name + '_hypotheses', pred_mu, idxs)
+        pred_std = self.select_hypotheses(name + '_stds_hypotheses', pred_std, idxs)
       full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
       outs[name + '_weights'] = weights
       outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
       outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
 
-      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      for fidx in range(weights.shape[0]):
-        for hidx in range(out_N):
-          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
-          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
-          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+      # the highest weighted hypothesis for each selection, argsort picks the same one as before on ties
+      best_idxs = np.argsort(weights, axis=1)[:,-1,:]
+      pred_mu_final = self.select_hypotheses(name, pred_mu, best_idxs)
+      pred_std_final = self.select_hypotheses(name + '_stds', pred_std, best_idxs)
     else:
       pred_mu_final = pred_mu
       pred_std_final = pred_std
@@ -82,6 +100,8 @@ class Parser:
     outs[name + '_stds'] = pred_std_final.reshape(final_shape)
 
   def parse_outputs(self, outs: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Parses outs in place. The parsed arrays are views of the parser's buffers and are overwritten by the next call,
+    copy any output that is kept across calls"""
     self.parse_mdn('plan', outs, in_N=ModelConstants.PLAN_MHP_N, out_N=ModelConstants.PLAN_MHP_SELECTION,
                    out_shape=(ModelConstants.IDX_N,ModelConstants.PLAN_WIDTH))
     self.parse_mdn('lane_lines', outs, in_N=0, out_N=0, out_shape=(ModelConstants.NUM_LANE_LINES,ModelConstants.IDX_N,ModelConstants.LANE_LINES_WIDTH))
@@ -101,3 +121,8 @@ class Parser:
     self.parse_categorical_crossentropy('desire_state', outs, out_shape=(ModelConstants.DESIRE_PRED_WIDTH,))
     self.parse_categorical_crossentropy('desire_pred', outs, out_shape=(ModelConstants.DESIRE_PRED_LEN,ModelConstants.DESIRE_PRED_WIDTH))
     return outs
+
+  def parse_batch(self, model_outputs: np.ndarray, output_slices: dict[str, slice]) -> dict[str, np.ndarray]:
+    """Parses the flat outputs of N model frames at once, model_outputs has shape (N, net_output_size).
+    Like parse_outputs, the results are overwritten by the next call"""
+    return self.parse_outputs({k: model_outputs[:, v] for k, v in output_slices.items()})
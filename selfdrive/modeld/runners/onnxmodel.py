@@ -1,21 +1,29 @@
 import onnx
+from onnx import numpy_helper
+import hashlib
 import itertools
 import os
+import platform
 import sys
 import numpy as np
+from pathlib import Path
 from typing import Any
 
+from openpilot.system.hardware.hw import Paths
 from openpilot.selfdrive.modeld.runners.runmodel_pyx import RunModel
 
 ORT_TYPES_TO_NP_TYPES = {'tensor(float16)': np.float16, 'tensor(float)': np.float32, 'tensor(uint8)': np.uint8}
 
+# converted, and for the CPU provider optimized, models are kept here so they're only built once
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(Paths.comma_home(), "model_cache"))
+NO_MODEL_CACHE = "NO_MODEL_CACHE" in os.environ
+
 def attributeproto_fp16_to_fp32(attr):
   float32_list = np.frombuffer(attr.raw_data, dtype=np.float16)
   attr.data_type = 1
   attr.raw_data = float32_list.astype(np.float32).tobytes()
 
-def convert_fp16_to_fp32(path):
-  model = onnx.load(path)
+def convert_fp16_to_fp32(model):
   for i in model.graph.initializer:
     if i.data_type == 10:
       attributeproto_fp16_to_fp32(i)
@@ -27,9 +35,37 @@ def convert_fp16_to_fp32(path):
       if hasattr(a, 't'):
         if a.t.data_type == 10:
           attributeproto_fp16_to_fp32(a.t)
+
+def make_batch_dynamic(model):
+  # a constant reshape to a first axis of 1 keeps the batch at 1 whatever the inputs say
+  constants = {i.name: i for i in model.graph.initializer}
+  constants.update({n.output[0]: n.attribute[0].t for n in model.graph.node if n.op_type == 'Constant' and n.attribute[0].name == 'value'})
+  for n in model.graph.node:
+    if n.op_type == 'Reshape' and n.input[1] in constants:
+      shape = numpy_helper.to_array(constants[n.input[1]])
+      if len(shape) and shape[0] == 1:
+        raise ValueError(f"Reshape {n.name} fixes the batch to 1, the model can't run batched")
+
+  # the first axis of every input and output becomes a named dimension, so the session takes any number of frames
+  for i in itertools.chain(model.graph.input, model.graph.output):
+    i.type.tensor_type.shape.dim[0].dim_param = 'batch'
+
+def convert_model(path, fp16_to_fp32, dynamic_batch):
+  model = onnx.load(path)
+  if fp16_to_fp32:
+    convert_fp16_to_fp32(model)
+  if dynamic_batch:
+    make_batch_dynamic(model)
   return model.SerializeToString()
 
-def create_ort_session(path, fp16_to_fp32):
+def get_model_cache_path(path, provider, **kwargs):
+  import onnxruntime as ort
+  with open(path, 'rb') as f:
+    model_hash = hashlib.file_digest(f, 'sha256')
+  model_hash.update(f"{ort.__version__} {provider} {platform.machine()} {sorted(kwargs.items())}".encode())
+  return os.path.join(MODEL_CACHE_DIR, f"{Path(path).stem}_{model_hash.hexdigest()[:16]}.onnx")
+
+def create_ort_session(path, fp16_to_fp32, dynamic_batch=False):
   os.environ["OMP_NUM_THREADS"] = "4"
   os.environ["OMP_WAIT_POLICY"] = "PASSIVE"
 
@@ -50,22 +86,49 @@ def create_ort_session(path, fp16_to_fp32):
     options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
     provider = 'CPUExecutionProvider'
 
-  model_data = convert_fp16_to_fp32(path) if fp16_to_fp32 else path
+  provider_name = provider if isinstance(provider, str) else provider[0]
+  optimize_offline = provider_name == 'CPUExecutionProvider'
+  cache_path = None if NO_MODEL_CACHE else get_model_cache_path(path, provider_name, fp16_to_fp32=fp16_to_fp32, dynamic_batch=dynamic_batch)
+  tmp_cache_path = None
+  if cache_path is not None and os.path.isfile(cache_path):
+    print("Onnx using cached model: ", cache_path, file=sys.stderr)
+    model_data = cache_path
+  else:
+    model_data = convert_model(path, fp16_to_fp32, dynamic_batch) if fp16_to_fp32 or dynamic_batch else path
+    if cache_path is not None and (optimize_offline or isinstance(model_data, bytes)):
+      os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+      tmp_cache_path = f"{cache_path}.{os.getpid()}.tmp"
+      if optimize_offline:
+        # ORT_ENABLE_ALL adds layout optimizations (NCHWc kernels) for this CPU, which another CPU sharing the
+        # cache may not run, so only the extended ones are saved and the rest still run when the session loads
+        offline_options = ort.SessionOptions()
+        offline_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        offline_options.optimized_model_filepath = tmp_cache_path
+        ort.InferenceSession(model_data, offline_options, providers=[provider])
+        os.replace(tmp_cache_path, cache_path)
+        model_data, tmp_cache_path = cache_path, None
+      else:
+        with open(tmp_cache_path, 'wb') as f:
+          f.write(model_data)
+
   print("Onnx selected provider: ", [provider], file=sys.stderr)
   ort_session = ort.InferenceSession(model_data, options, providers=[provider])
   print("Onnx using ", ort_session.get_providers(), file=sys.stderr)
+  if tmp_cache_path is not None:
+    os.replace(tmp_cache_path, cache_path)
   return ort_session
 
 
 class ONNXModel(RunModel):
-  def __init__(self, path, output, runtime, use_tf8, cl_context):
+  def __init__(self, path, output, runtime, use_tf8, cl_context, batch_size=1):
+    """With batch_size > 1 every input buffer and the output hold that many independent frames, which run as one batch"""
     self.inputs = {}
     self.output = output
     self.use_tf8 = use_tf8
 
-    self.session = create_ort_session(path, fp16_to_fp32=True)
+    self.session = create_ort_session(path, fp16_to_fp32=True, dynamic_batch=batch_size > 1)
     self.input_names = [x.name for x in self.session.get_inputs()]
-    self.input_shapes = {x.name: [1, *x.shape[1:]] for x in self.session.get_inputs()}
+    self.input_shapes = {x.name: [batch_size, *x.shape[1:]] for x in self.session.get_inputs()}
     self.input_dtypes = {x.name: ORT_TYPES_TO_NP_TYPES[x.type] for x in self.session.get_inputs()}
 
     # run once to initialize CUDA provider
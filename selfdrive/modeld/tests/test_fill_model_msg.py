@@ -0,0 +1,51 @@
+import numpy as np
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.modeld.constants import ModelConstants as MC
+from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, get_plan_t_idxs, new_model_msg, PublishState
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+from openpilot.selfdrive.modeld.tests.test_parse_model_outputs import get_output_slices
+
+
+def get_plan_t_idxs_loop(plan_x):
+  plan_t = [np.nan] * MC.IDX_N
+  plan_t[0] = 0.0
+  plan_x = plan_x.tolist()
+  for xidx in range(1, MC.IDX_N):
+    tidx = 0
+    while tidx < MC.IDX_N - 1 and plan_x[tidx+1] < MC.X_IDXS[xidx]:
+      tidx += 1
+    if tidx == MC.IDX_N - 1:
+      plan_t[xidx] = MC.T_IDXS[MC.IDX_N - 1]
+      break
+    current_x_val = plan_x[tidx]
+    next_x_val = plan_x[tidx+1]
+    p = (MC.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
+    plan_t[xidx] = p * MC.T_IDXS[tidx+1] + (1 - p) * MC.T_IDXS[tidx]
+  return plan_t
+
+
+class TestFillModelMsg:
+  def test_plan_t_idxs(self):
+    rng = np.random.default_rng(0)
+    for i in range(200):
+      plan_x = np.cumsum(rng.normal(3 * (i % 4), 8, MC.IDX_N)).astype(np.float32)
+      if i % 5 == 0:
+        plan_x[rng.integers(MC.IDX_N)] = np.nan
+      elif i % 5 == 1:
+        plan_x[5:8] = plan_x[4]
+      np.testing.assert_array_equal(get_plan_t_idxs(plan_x), get_plan_t_idxs_loop(plan_x))
+
+  def test_template(self):
+    output_slices, net_output_size = get_output_slices()
+    model_outputs = np.random.default_rng(0).normal(0, 3, (4, net_output_size)).astype(np.float32)
+    outs = Parser().parse_batch(model_outputs, output_slices)
+
+    publish_state, publish_state_template = PublishState(), PublishState()
+    for i in range(len(model_outputs)):
+      frame = {k: v[i:i+1] for k, v in outs.items()}
+      msg, msg_template = messaging.new_message('modelV2'), new_model_msg()
+      fill_model_msg(msg, frame, publish_state, i, i, i, 0., 0, 0., True)
+      fill_model_msg(msg_template, frame, publish_state_template, i, i, i, 0., 0, 0., True)
+      np.testing.assert_equal(msg_template.modelV2.to_dict(), msg.modelV2.to_dict())
+      assert msg_template.valid and msg_template.logMonoTime > 0
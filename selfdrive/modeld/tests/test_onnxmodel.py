@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+import openpilot.selfdrive.modeld.runners.onnxmodel as onnxmodel
+
+
+def make_model(path, bias):
+  # fp16 weights and a fixed batch of 1, like supercombo
+  x = helper.make_tensor_value_info('x', TensorProto.FLOAT16, [1, 4])
+  y = helper.make_tensor_value_info('y', TensorProto.FLOAT16, [1, 4])
+  b = numpy_helper.from_array(np.full((1, 4), bias, dtype=np.float16), 'b')
+  graph = helper.make_graph([helper.make_node('Add', ['x', 'b'], ['s']), helper.make_node('Relu', ['s'], ['y'])],
+                            'tiny', [x], [y], [b])
+  onnx.save(helper.make_model(graph, ir_version=8, opset_imports=[helper.make_opsetid('', 13)]), path)
+
+
+class TestModelCache:
+  def setup_method(self):
+    os.environ['ONNXCPU'] = '1'
+
+  def teardown_method(self):
+    del os.environ['ONNXCPU']
+
+  def _run(self, session, batch_size=1):
+    x = np.arange(batch_size * 4, dtype=np.float32).reshape(batch_size, 4) - 2
+    return session.run(None, {'x': x})[0]
+
+  def test_hit_and_miss(self, mocker, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    mocker.patch.object(onnxmodel, 'MODEL_CACHE_DIR', str(cache_dir))
+    mocker.patch.object(onnxmodel, 'NO_MODEL_CACHE', False)
+    convert_model = mocker.spy(onnxmodel, 'convert_model')
+    model_path = str(tmp_path / 'tiny.onnx')
+    make_model(model_path, 1.)
+
+    miss = onnxmodel.create_ort_session(model_path, fp16_to_fp32=True)
+    assert convert_model.call_count == 1
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1 and cache_files[0].startswith('tiny_') and cache_files[0].endswith('.onnx')
+
+    hit = onnxmodel.create_ort_session(model_path, fp16_to_fp32=True)
+    assert convert_model.call_count == 1
+    assert os.listdir(cache_dir) == cache_files
+    np.testing.assert_array_equal(self._run(hit), self._run(miss))
+    np.testing.assert_array_equal(self._run(hit), [[0., 0., 1., 2.]])
+
+    # the saved graph keeps only hardware independent optimizations
+    cached = onnx.load(str(cache_dir / cache_files[0]))
+    assert not any(node.domain == 'com.microsoft.nchwc' for node in cached.graph.node)
+
+    # a different conversion is cached next to it
+    batched = onnxmodel.create_ort_session(model_path, fp16_to_fp32=True, dynamic_batch=True)
+    assert convert_model.call_count == 2 and len(os.listdir(cache_dir)) == 2
+    assert self._run(batched, batch_size=3).shape == (3, 4)
+
+  def test_cache_key(self, tmp_path):
+    model_path = str(tmp_path / 'tiny.onnx')
+    make_model(model_path, 1.)
+    key = onnxmodel.get_model_cache_path(model_path, 'CPUExecutionProvider', fp16_to_fp32=True, dynamic_batch=False)
+    assert key == onnxmodel.get_model_cache_path(model_path, 'CPUExecutionProvider', fp16_to_fp32=True, dynamic_batch=False)
+    assert key != onnxmodel.get_model_cache_path(model_path, 'CUDAExecutionProvider', fp16_to_fp32=True, dynamic_batch=False)
+    assert key != onnxmodel.get_model_cache_path(model_path, 'CPUExecutionProvider', fp16_to_fp32=True, dynamic_batch=True)
+
+    make_model(model_path, 2.)
+    assert key != onnxmodel.get_model_cache_path(model_path, 'CPUExecutionProvider', fp16_to_fp32=True, dynamic_batch=False)
+
+
+class TestMakeBatchDynamic:
+  def make_reshape_model(self, shape):
+    x = helper.make_tensor_value_info('x', TensorProto.FLOAT, [1, 4])
+    y = helper.make_tensor_value_info('y', TensorProto.FLOAT, [1, 2, 2])
+    graph = helper.make_graph([helper.make_node('Reshape', ['x', 'shape'], ['y'], name='reshape')], 'reshape', [x], [y],
+                              [numpy_helper.from_array(np.array(shape, dtype=np.int64), 'shape')])
+    return helper.make_model(graph)
+
+  def test_dynamic_reshape(self):
+    model = self.make_reshape_model([-1, 2, 2])
+    onnxmodel.make_batch_dynamic(model)
+    assert all(i.type.tensor_type.shape.dim[0].dim_param == 'batch' for i in [*model.graph.input, *model.graph.output])
+
+  def test_reshape_fixes_batch(self):
+    with pytest.raises(ValueError, match="reshape"):
+      onnxmodel.make_batch_dynamic(self.make_reshape_model([1, 2, 2]))
@@ -0,0 +1,152 @@
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants as MC
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+
+OUTPUT_SIZES = {
+  'plan': MC.PLAN_MHP_N * (2 * MC.IDX_N * MC.PLAN_WIDTH + MC.PLAN_MHP_SELECTION),
+  'lane_lines': 2 * MC.NUM_LANE_LINES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'road_edges': 2 * MC.NUM_ROAD_EDGES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'pose': 2 * MC.POSE_WIDTH,
+  'road_transform': 2 * MC.POSE_WIDTH,
+  'sim_pose': 2 * MC.POSE_WIDTH,
+  'wide_from_device_euler': 2 * MC.WIDE_FROM_DEVICE_WIDTH,
+  'lead': MC.LEAD_MHP_N * (2 * MC.LEAD_TRAJ_LEN * MC.LEAD_WIDTH + MC.LEAD_MHP_SELECTION),
+  'desired_curvature': 2 * MC.DESIRED_CURV_WIDTH,
+  'lead_prob': len(MC.LEAD_T_OFFSETS),
+  'lane_lines_prob': 2 * MC.NUM_LANE_LINES,
+  'meta': 55,
+  'desire_state': MC.DESIRE_PRED_WIDTH,
+  'desire_pred': MC.DESIRE_PRED_LEN * MC.DESIRE_PRED_WIDTH,
+}
+
+
+def ref_sigmoid(x):
+  return 1. / (1. + np.exp(-x))
+
+
+def ref_softmax(x, axis=-1):
+  x -= np.max(x, axis=axis, keepdims=True)
+  np.exp(x, out=x)
+  x /= np.sum(x, axis=axis, keepdims=True)
+  return x
+
+
+def ref_parse_mdn(name, outs, in_N=0, out_N=1, out_shape=None):
+  # the per-frame parser the vectorized one replaced
+  raw = outs[name]
+  raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+
+  n_values = (raw.shape[2] - out_N)//2
+  pred_mu = raw[:,:,:n_values]
+  pred_std = np.exp(raw[:,:,n_values: 2*n_values])
+
+  if in_N > 1:
+    weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
+    for i in range(out_N):
+      weights[:,:,i - out_N] = ref_softmax(raw[:,:,i - out_N], axis=-1)
+
+    if out_N == 1:
+      for fidx in range(weights.shape[0]):
+        idxs = np.argsort(weights[fidx][:,0])[::-1]
+        weights[fidx] = weights[fidx][idxs]
+        pred_mu[fidx] = pred_mu[fidx][idxs]
+        pred_std[fidx] = pred_std[fidx][idxs]
+    full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+    outs[name + '_weights'] = weights
+    outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
+    outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
+
+    pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+    pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+    for fidx in range(weights.shape[0]):
+      for hidx in range(out_N):
+        idxs = np.argsort(weights[fidx,:,hidx])[::-1]
+        pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
+        pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+  else:
+    pred_mu_final = pred_mu
+    pred_std_final = pred_std
+
+  if out_N > 1:
+    final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+  else:
+    final_shape = tuple([raw.shape[0],] + list(out_shape))
+  outs[name] = pred_mu_final.reshape(final_shape)
+  outs[name + '_stds'] = pred_std_final.reshape(final_shape)
+
+
+def ref_parse_outputs(outs):
+  ref_parse_mdn('plan', outs, in_N=MC.PLAN_MHP_N, out_N=MC.PLAN_MHP_SELECTION, out_shape=(MC.IDX_N, MC.PLAN_WIDTH))
+  ref_parse_mdn('lane_lines', outs, in_N=0, out_N=0, out_shape=(MC.NUM_LANE_LINES, MC.IDX_N, MC.LANE_LINES_WIDTH))
+  ref_parse_mdn('road_edges', outs, in_N=0, out_N=0, out_shape=(MC.NUM_ROAD_EDGES, MC.IDX_N, MC.LANE_LINES_WIDTH))
+  for k in ('pose', 'road_transform', 'sim_pose'):
+    ref_parse_mdn(k, outs, in_N=0, out_N=0, out_shape=(MC.POSE_WIDTH,))
+  ref_parse_mdn('wide_from_device_euler', outs, in_N=0, out_N=0, out_shape=(MC.WIDE_FROM_DEVICE_WIDTH,))
+  ref_parse_mdn('lead', outs, in_N=MC.LEAD_MHP_N, out_N=MC.LEAD_MHP_SELECTION, out_shape=(MC.LEAD_TRAJ_LEN, MC.LEAD_WIDTH))
+  ref_parse_mdn('desired_curvature', outs, in_N=0, out_N=0, out_shape=(MC.DESIRED_CURV_WIDTH,))
+  for k in ('lead_prob', 'lane_lines_prob', 'meta'):
+    outs[k] = ref_sigmoid(outs[k])
+  outs['desire_state'] = ref_softmax(outs['desire_state'].reshape((-1, MC.DESIRE_PRED_WIDTH)), axis=-1)
+  outs['desire_pred'] = ref_softmax(outs['desire_pred'].reshape((-1, MC.DESIRE_PRED_LEN, MC.DESIRE_PRED_WIDTH)), axis=-1)
+  return outs
+
+
+def get_output_slices():
+  output_slices = {}
+  start = 0
+  for name, size in OUTPUT_SIZES.items():
+    output_slices[name] = slice(start, start + size)
+    start += size
+  return output_slices, start
+
+
+class TestParseModelOutputs:
+  def test_matches_reference(self):
+    output_slices, net_output_size = get_output_slices()
+    rng = np.random.default_rng(1)
+    model_outputs = rng.normal(0, 3, (16, net_output_size)).astype(np.float32)
+    # tied weights, where the hypothesis order depends on argsort
+    for fidx in range(4):
+      plan = model_outputs[fidx, output_slices['plan']].reshape((MC.PLAN_MHP_N, -1))
+      plan[:, -MC.PLAN_MHP_SELECTION:] = 1.
+      model_outputs[fidx, output_slices['plan']] = plan.reshape(-1)
+
+    parser = Parser()
+    for fidx in range(len(model_outputs)):
+      ref = ref_parse_outputs({k: model_outputs[fidx:fidx+1, v].copy() for k, v in output_slices.items()})
+      outs = parser.parse_outputs({k: model_outputs[fidx:fidx+1, v].copy() for k, v in output_slices.items()})
+      assert outs.keys() == ref.keys()
+      for k, v in ref.items():
+        np.testing.assert_array_equal(outs[k], v, err_msg=k)
+
+    ref = ref_parse_outputs({k: model_outputs[:, v].copy() for k, v in output_slices.items()})
+    outs = Parser().parse_batch(model_outputs.copy(), output_slices)
+    for k, v in ref.items():
+      np.testing.assert_array_equal(outs[k], v, err_msg=k)
+
+  def test_batch(self):
+    output_slices, net_output_size = get_output_slices()
+    model_outputs = np.random.default_rng(0).normal(0, 3, (16, net_output_size)).astype(np.float32)
+    batch = {k: v.copy() for k, v in Parser().parse_batch(model_outputs.copy(), output_slices).items()}
+
+    parser = Parser()
+    for fidx in range(len(model_outputs)):
+      outs = parser.parse_batch(model_outputs[fidx:fidx+1].copy(), output_slices)
+      assert outs.keys() == batch.keys()
+      for k, v in outs.items():
+        np.testing.assert_array_equal(v[0], batch[k][fidx], err_msg=k)
+
+    # plan hypotheses are sorted by weight and the plan is the most likely one
+    assert np.all(np.diff(batch['plan_weights'][:, :, 0], axis=1) <= 0)
+    np.testing.assert_array_equal(batch['plan'], batch['plan_hypotheses'][:, 0])
+    np.testing.assert_array_equal(batch['plan_stds'], batch['plan_stds_hypotheses'][:, 0])
+
+    # every lead selection picks its most likely hypothesis
+    best = np.argmax(batch['lead_weights'], axis=1)
+    for fidx in range(len(model_outputs)):
+      np.testing.assert_array_equal(batch['lead'][fidx], batch['lead_hypotheses'][fidx, best[fidx]])
+
+    for k in ('lead_prob', 'lane_lines_prob', 'meta'):
+      np.testing.assert_allclose(batch[k], 1 / (1 + np.exp(-model_outputs[:, output_slices[k]])), rtol=1e-6)
+    np.testing.assert_allclose(batch['desire_pred'].sum(axis=-1), 1, rtol=1e-6)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import os
+import time
+import numpy as np
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, new_model_msg, PublishState
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+from openpilot.selfdrive.modeld.tests.test_parse_model_outputs import get_output_slices
+
+N = int(os.getenv("N", "2000"))
+
+
+def benchmark(new_msg, frames):
+  publish_state = PublishState()
+  fill_times, serialize_times = [], []
+  for i, outs in enumerate(frames):
+    t1 = time.perf_counter()
+    msg = new_msg()
+    fill_model_msg(msg, outs, publish_state, i, i, i, 0., 0, 0., True)
+    t2 = time.perf_counter()
+    msg.to_bytes()
+    t3 = time.perf_counter()
+    fill_times.append(t2 - t1)
+    serialize_times.append(t3 - t2)
+  return np.array(fill_times) * 1e6, np.array(serialize_times) * 1e6
+
+
+if __name__ == "__main__":
+  output_slices, net_output_size = get_output_slices()
+  model_outputs = np.random.default_rng(0).normal(0, 3, (N, net_output_size)).astype(np.float32)
+  outs = Parser().parse_batch(model_outputs, output_slices)
+  frames = [{k: v[i:i+1] for k, v in outs.items()} for i in range(N)]
+
+  print(f"filled modelV2 from {N} synthetic model outputs")
+  for name, new_msg in (("new_message", lambda: messaging.new_message('modelV2')), ("new_model_msg", new_model_msg)):
+    fill_times, serialize_times = benchmark(new_msg, frames)
+    print(f"\t{name:14s} fill avg: {np.mean(fill_times):0.1f}us, p50: {np.percentile(fill_times, 50):0.1f}us, " +
+          f"p99: {np.percentile(fill_times, 99):0.1f}us, serialize avg: {np.mean(serialize_times):0.1f}us")
@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
-import time
 import numpy as np
 
 from cereal import log
 import cereal.messaging as messaging
-from openpilot.common.realtime import Ratekeeper, DT_MDL
+from openpilot.common.realtime import DT_MDL
 from openpilot.selfdrive.controls.lib.longcontrol import LongCtrlState
 from openpilot.selfdrive.modeld.constants import ModelConstants
 from openpilot.selfdrive.controls.lib.longitudinal_planner import LongitudinalPlanner
@@ -12,18 +11,11 @@ from openpilot.selfdrive.controls.radard import _LEAD_ACCEL_TAU
 
 
 class Plant:
-  messaging_initialized = False
-
+  """Runs the longitudinal planner in-process on a simulated clock, every step is DT_MDL regardless of how long it takes"""
   def __init__(self, lead_relevancy=False, speed=0.0, distance_lead=2.0,
                enabled=True, only_lead2=False, only_radar=False, e2e=False, personality=0, force_decel=False):
     self.rate = 1. / DT_MDL
-
-    if not Plant.messaging_initialized:
-      Plant.radar = messaging.pub_sock('radarState')
-      Plant.controls_state = messaging.pub_sock('controlsState')
-      Plant.car_state = messaging.pub_sock('carState')
-      Plant.plan = messaging.sub_sock('longitudinalPlan')
-      Plant.messaging_initialized = True
+    self.frame = 0
 
     self.v_lead_prev = 0.0
 
@@ -42,10 +34,7 @@ class Plant:
     self.personality = personality
     self.force_decel = force_decel
 
-    self.rk = Ratekeeper(self.rate, print_delay_threshold=100.0)
     self.ts = 1. / self.rate
-    time.sleep(0.1)
-    self.sm = messaging.SubMaster(['longitudinalPlan'])
 
     from openpilot.selfdrive.car.honda.values import CAR
     from openpilot.selfdrive.car.honda.interface import CarInterface
@@ -54,7 +43,7 @@ class Plant:
 
   @property
   def current_time(self):
-    return float(self.rk.frame) / self.rate
+    return float(self.frame) / self.rate
 
   def step(self, v_lead=0.0, prob=1.0, v_cruise=50.):
     # ******** publish a fake model going straight and fake calibration ********
@@ -146,13 +135,13 @@ class Plant:
       v_rel = 0.
 
     # print at 5hz
-    # if (self.rk.frame % (self.rate // 5)) == 0:
+    # if (self.frame % (self.rate // 5)) == 0:
     #   print("%2.2f sec   %6.2f m  %6.2f m/s  %6.2f m/s2   lead_rel: %6.2f m  %6.2f m/s"
     #         % (self.current_time, self.distance, self.speed, self.acceleration, d_rel, v_rel))
 
 
     # ******** update prevs ********
-    self.rk.monitor_time()
+    self.frame += 1
 
     return {
       "distance": self.distance,
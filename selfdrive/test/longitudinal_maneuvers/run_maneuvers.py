@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from openpilot.selfdrive.test.longitudinal_maneuvers.maneuver import Maneuver
+from openpilot.selfdrive.test.longitudinal_maneuvers.test_longitudinal import create_maneuvers
+
+
+def run_maneuver(maneuver: Maneuver) -> tuple[bool, np.ndarray, float]:
+  t = time.perf_counter()
+  valid, logs = maneuver.evaluate()
+  return valid, logs, time.perf_counter() - t
+
+
+def get_all_maneuvers() -> list[Maneuver]:
+  # the same matrix as test_longitudinal
+  return [m for e2e, force_decel in itertools.product([True, False], repeat=2) for m in create_maneuvers({"e2e": e2e, "force_decel": force_decel})]
+
+
+def run_maneuvers(maneuvers: list[Maneuver], jobs: int) -> list[tuple[bool, np.ndarray, float]]:
+  """Runs independent maneuvers in parallel worker processes, each one on the plant's simulated clock"""
+  if jobs == 1:
+    return [run_maneuver(m) for m in maneuvers]
+  with ProcessPoolExecutor(max_workers=jobs) as pool:
+    return list(pool.map(run_maneuver, maneuvers))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run the longitudinal maneuvers in parallel and report how much faster than real time they run",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+  parser.add_argument("--check", action="store_true", help="also run every maneuver serially and check the results are the same")
+  args = parser.parse_args()
+
+  maneuvers = get_all_maneuvers()
+  t = time.perf_counter()
+  results = run_maneuvers(maneuvers, args.jobs)
+  total_time = time.perf_counter() - t
+
+  for maneuver, (valid, _, wall_time) in zip(maneuvers, results, strict=True):
+    mode = f'{"e2e" if maneuver.e2e else "acc"}{" force_decel" if maneuver.force_decel else ""}'
+    print(f"{'ok  ' if valid else 'FAIL'} {maneuver.title[:60]:60s} {mode:15s} {maneuver.duration:5.1f}s in {wall_time:6.2f}s, " +
+          f"{maneuver.duration / wall_time:6.1f}x real time")
+
+  simulated_time = sum(m.duration for m in maneuvers)
+  print(f"\n{len(maneuvers)} maneuvers, {simulated_time:.0f}s simulated in {total_time:.2f}s with {args.jobs} jobs, " +
+        f"{simulated_time / total_time:.1f}x real time")
+
+  if args.check:
+    for maneuver, (valid, logs, _) in zip(maneuvers, results, strict=True):
+      serial_valid, serial_logs, _ = run_maneuver(maneuver)
+      assert valid == serial_valid and np.array_equal(logs, serial_logs, equal_nan=True), f"results differ for {maneuver.title}"
+    print("results match the serial run")
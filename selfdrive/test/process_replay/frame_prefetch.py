@@ -0,0 +1,75 @@
+import queue
+import threading
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Iterable
+
+import capnp
+
+from openpilot.tools.lib.framereader import BaseFrameReader
+
+PREFETCH_FRAMES = 20
+# frames that were already handed out and can be asked for again, by another process replaying the same camera
+RECENT_FRAMES = 4
+
+
+class FramePrefetcher:
+  """Decodes the frames of the camera state messages that are going to be replayed ahead of time, with a worker thread per camera.
+
+  Frames are handed out as flat nv12 arrays that can be sent to VisionIPC as they are. They have to be requested in the order of
+  the messages, asking for one of the last few frames again is allowed."""
+  def __init__(self, frs: dict[str, BaseFrameReader], msgs: Iterable[capnp._DynamicStructReader], camera_states: Iterable[str],
+               prefetch_frames: int = PREFETCH_FRAMES):
+    camera_states = set(camera_states)
+    frame_ids: dict[str, list[int]] = {camera_state: [] for camera_state in camera_states}
+    for msg in msgs:
+      if msg.which() in camera_states:
+        frame_id = getattr(msg, msg.which()).frameId
+        if len(frame_ids[msg.which()]) == 0 or frame_ids[msg.which()][-1] != frame_id:
+          frame_ids[msg.which()].append(frame_id)
+
+    self.stop_event = threading.Event()
+    self.queues: dict[str, queue.Queue] = {camera_state: queue.Queue(maxsize=prefetch_frames) for camera_state in camera_states}
+    self.recent_frames: dict[str, OrderedDict[int, np.ndarray]] = {camera_state: OrderedDict() for camera_state in camera_states}
+    self.threads = [threading.Thread(target=self._decode_thread, args=(frs[camera_state], frame_ids[camera_state], self.queues[camera_state]), daemon=True)
+                    for camera_state in camera_states]
+    for thread in self.threads:
+      thread.start()
+
+  def _put(self, q: queue.Queue, item) -> bool:
+    while not self.stop_event.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _decode_thread(self, fr: BaseFrameReader, frame_ids: list[int], q: queue.Queue):
+    for frame_id in frame_ids:
+      try:
+        img = fr.get(frame_id, pix_fmt="nv12")[0]
+        item = (frame_id, np.ascontiguousarray(img).reshape(-1))
+      except Exception as e:
+        item = (frame_id, e)
+      if not self._put(q, item) or isinstance(item[1], Exception):
+        return
+
+  def get(self, camera_state: str, frame_id: int) -> np.ndarray:
+    recent_frames = self.recent_frames[camera_state]
+    if frame_id in recent_frames:
+      return recent_frames[frame_id]
+
+    decoded_frame_id, img = self.queues[camera_state].get()
+    if isinstance(img, Exception):
+      raise img
+    assert decoded_frame_id == frame_id, f"{camera_state} frames requested out of order: got {frame_id}, expected {decoded_frame_id}"
+    recent_frames[frame_id] = img
+    if len(recent_frames) > RECENT_FRAMES:
+      recent_frames.popitem(last=False)
+    return img
+
+  def stop(self):
+    self.stop_event.set()
+    for thread in self.threads:
+      thread.join()
@@ -44,21 +44,27 @@ def trim_logs_to_max_frames(logs, max_frames, frs_types, include_all_types):
   return all_msgs
 
 
-def model_replay(lr, frs):
-  # modeld is using frame pairs
-  modeld_logs = trim_logs_to_max_frames(lr, MAX_FRAMES, {"roadCameraState", "wideRoadCameraState"}, {"roadEncodeIdx", "wideRoadEncodeIdx", "carParams"})
-  dmodeld_logs = trim_logs_to_max_frames(lr, MAX_FRAMES, {"driverCameraState"}, {"driverEncodeIdx", "carParams"})
-
+def setup_logs(lr, logs):
   if not SEND_EXTRA_INPUTS:
-    modeld_logs = [msg for msg in modeld_logs if msg.which() != 'liveCalibration']
-    dmodeld_logs = [msg for msg in dmodeld_logs if msg.which() != 'liveCalibration']
+    logs = [msg for msg in logs if msg.which() != 'liveCalibration']
 
   # initial setup
   for s in ('liveCalibration', 'deviceState'):
     msg = next(msg for msg in lr if msg.which() == s).as_builder()
     msg.logMonoTime = lr[0].logMonoTime
-    modeld_logs.insert(1, msg.as_reader())
-    dmodeld_logs.insert(1, msg.as_reader())
+    logs.insert(1, msg.as_reader())
+  return logs
+
+
+def get_modeld_logs(lr, max_frames=MAX_FRAMES):
+  # modeld is using frame pairs
+  modeld_logs = trim_logs_to_max_frames(lr, max_frames, {"roadCameraState", "wideRoadCameraState"}, {"roadEncodeIdx", "wideRoadEncodeIdx", "carParams"})
+  return setup_logs(lr, modeld_logs)
+
+
+def model_replay(lr, frs):
+  modeld_logs = get_modeld_logs(lr)
+  dmodeld_logs = setup_logs(lr, trim_logs_to_max_frames(lr, MAX_FRAMES, {"driverCameraState"}, {"driverEncodeIdx", "carParams"}))
 
   modeld = get_process_config("modeld")
   dmonitoringmodeld = get_process_config("dmonitoringmodeld")
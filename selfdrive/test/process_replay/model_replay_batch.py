@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import pickle
+import sys
+import numpy as np
+
+import cereal.messaging as messaging
+from msgq.visionipc import VisionIpcClient, VisionIpcServer
+from openpilot.selfdrive.car.car_helpers import get_demo_car_params
+from openpilot.selfdrive.controls.lib.desire_helper import DesireHelper
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState
+from openpilot.selfdrive.modeld.modeld import METADATA_PATH, MODEL_PATHS, FrameMeta, ModelState, build_model_msgs, get_model_inputs, \
+                                             get_model_transforms
+from openpilot.selfdrive.modeld.models.commonmodel_pyx import CLContext
+from openpilot.selfdrive.modeld.runners import ModelRunner, Runtime
+from openpilot.selfdrive.modeld.runners.onnxmodel import ONNXModel
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.model_replay import MAX_FRAMES, SEGMENT, TEST_ROUTE, get_modeld_logs
+from openpilot.selfdrive.test.process_replay.process_replay import get_process_config, replay_process
+from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state
+from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.helpers import save_log
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.openpilotci import get_url
+
+CAMERA_STATES = ("roadCameraState", "wideRoadCameraState")
+SERVICES = ["deviceState", "carState", "roadCameraState", "liveCalibration", "driverMonitoringState", "carControl"]
+MODELD_CFG = get_process_config("modeld")
+
+
+class SegmentReplay:
+  """Replays the messages model_replay gives modeld for one segment, with its own recurrent model state"""
+  def __init__(self, idx: int, route: str, segment: int, cl_context: CLContext, model: ONNXModel, max_frames: int):
+    self.name = f"{route.replace('|', '_')}_{segment}"
+    self.lr = get_modeld_logs(list(LogReader(get_url(route, segment))), max_frames)
+    self.frs = {
+      'roadCameraState': FrameReader(get_url(route, segment, log_type="fcamera"), readahead=True),
+      'wideRoadCameraState': FrameReader(get_url(route, segment, log_type="ecamera"), readahead=True),
+    }
+    self.max_frames = max_frames
+
+    # frames get to the model as VisionBufs, like in modeld
+    self.vipc_server = VisionIpcServer(f"model_replay_batch{idx}")
+    for camera_state in CAMERA_STATES:
+      self.vipc_server.create_buffers(meta_from_camera_state(camera_state).stream, 2, False, self.frs[camera_state].w, self.frs[camera_state].h)
+    self.vipc_server.start_listener()
+    self.vipc_clients = {}
+    for camera_state in CAMERA_STATES:
+      self.vipc_clients[camera_state] = VisionIpcClient(f"model_replay_batch{idx}", meta_from_camera_state(camera_state).stream, True, cl_context)
+      assert self.vipc_clients[camera_state].connect(True)
+
+    CP = next((m.carParams for m in self.lr if m.which() == 'carParams'), None)
+    self.steer_delay = (CP or get_demo_car_params()).steerActuatorDelay + .2
+
+    self.state = ModelState(cl_context, model)
+    self.publish_state = PublishState()
+    self.DH = DesireHelper()
+    self.sm = {s: getattr(messaging.new_message(s), s) for s in SERVICES}
+    self.seen: set[str] = set()
+    self.updated: set[str] = set()
+    self.model_transform_main = np.zeros((3, 3), dtype=np.float32)
+    self.model_transform_extra = np.zeros((3, 3), dtype=np.float32)
+    self.live_calib_seen = False
+    self.last_vipc_frame_id = 0
+    self.msgs: list = []
+
+  def get_frames(self):
+    # every pair of road and wide road frames, with the messages logged before the second one,
+    # in the order and with the services process replay publishes to modeld
+    camera_states: dict[int, dict] = {}
+    count = 0
+    for msg in sorted(self.lr, key=lambda m: m.logMonoTime):
+      which = msg.which()
+      if which not in MODELD_CFG.pubs:
+        continue
+      self.sm[which] = getattr(msg, which)
+      self.seen.add(which)
+      self.updated.add(which)
+      if which in CAMERA_STATES:
+        frame = camera_states.setdefault(self.sm[which].frameId, {})
+        frame[which] = self.sm[which]
+        if len(frame) == len(CAMERA_STATES):
+          yield camera_states.pop(self.sm[which].frameId)
+          count += 1
+          if count == self.max_frames:
+            return
+
+  def recv_frame(self, camera_state, state):
+    img = self.frs[camera_state].get(state.frameId, pix_fmt="nv12")[0]
+    self.vipc_server.send(meta_from_camera_state(camera_state).stream, img.flatten().tobytes(), state.frameId, state.timestampSof, state.timestampEof)
+    return self.vipc_clients[camera_state].recv()
+
+  def prepare(self, frame) -> tuple[dict[str, np.ndarray], bool]:
+    """Same steps as a modeld loop up to the model run, returns the model inputs and whether modeld would run the model"""
+    buf_main = self.recv_frame('roadCameraState', frame['roadCameraState'])
+    self.meta_main = FrameMeta(self.vipc_clients['roadCameraState'])
+    buf_extra = self.recv_frame('wideRoadCameraState', frame['wideRoadCameraState'])
+    self.meta_extra = FrameMeta(self.vipc_clients['wideRoadCameraState'])
+
+    if 'liveCalibration' in self.updated and {'roadCameraState', 'deviceState'} <= self.seen:
+      self.model_transform_main, self.model_transform_extra = get_model_transforms(self.sm, False)
+      self.live_calib_seen = True
+    self.updated.clear()
+
+    # modeld skips the model run, and its outputs, after dropped frames
+    self.vipc_dropped_frames = max(0, self.meta_main.frame_id - self.last_vipc_frame_id - 1)
+    self.last_vipc_frame_id = self.meta_main.frame_id
+
+    inputs = get_model_inputs(self.sm, self.DH.desire, self.steer_delay)
+    imgs = self.state.prepare(buf_main, buf_extra, self.model_transform_main, self.model_transform_extra, inputs)
+    return {**imgs, **self.state.inputs}, self.vipc_dropped_frames == 0
+
+  def update(self, model_output: np.ndarray):
+    outputs = self.state.update(model_output)
+    modelv2_send, posenet_send = build_model_msgs(outputs, self.sm, self.DH, self.publish_state, self.meta_main, self.meta_extra, 0., 0.,
+                                                  self.vipc_dropped_frames, self.live_calib_seen)
+    self.msgs += [modelv2_send.as_reader(), posenet_send.as_reader()]
+
+
+def model_replay_batch(segments: list[tuple[str, int]], max_frames: int) -> dict[str, list]:
+  """Runs modeld over every segment at once, with the segments as the batch dimension of one ONNX session.
+  Each segment keeps its own recurrent state, compare_model_replay checks the outputs against replaying one segment."""
+  with open(METADATA_PATH, 'rb') as f:
+    net_output_size = pickle.load(f)['output_shapes']['outputs'][1]
+
+  cl_context = CLContext()
+  output = np.zeros((len(segments), net_output_size), dtype=np.float32)
+  model = ONNXModel(str(MODEL_PATHS[ModelRunner.ONNX]), output, Runtime.GPU, False, cl_context, batch_size=len(segments))
+  replays = [SegmentReplay(i, route, segment, cl_context, model, max_frames) for i, (route, segment) in enumerate(segments)]
+  frame_iters = [replay.get_frames() for replay in replays]
+  for name in model.input_names:
+    model.addInput(name, None)
+
+  # segments that ran out of frames, or dropped one, keep running on their last inputs, and their outputs are dropped
+  inputs: list[dict[str, np.ndarray]] = [{} for _ in replays]
+  while True:
+    active, done = [], True
+    for i, (replay, frames) in enumerate(zip(replays, frame_iters, strict=True)):
+      frame = next(frames, None)
+      if frame is not None:
+        inputs[i], run_model = replay.prepare(frame)
+        done = False
+        if run_model:
+          active.append(i)
+    if done:
+      break
+
+    for name in model.input_names:
+      model.setInputBuffer(name, np.stack([inp[name] for inp in inputs]))
+    model.execute()
+    for i in active:
+      replays[i].update(output[i])
+
+  return {replay.name: replay.msgs for replay in replays}
+
+
+def compare_model_replay(route: str, segment: int, msgs: list, max_frames: int) -> list:
+  """Replays modeld on the segment as model_replay does, and returns how the batched outputs differ from it"""
+  lr = list(LogReader(get_url(route, segment)))
+  frs = {
+    'roadCameraState': FrameReader(get_url(route, segment, log_type="fcamera"), readahead=True),
+    'wideRoadCameraState': FrameReader(get_url(route, segment, log_type="ecamera"), readahead=True),
+  }
+  ref_msgs = replay_process(MODELD_CFG, get_modeld_logs(lr, max_frames), frs)
+  return [d for service in MODELD_CFG.subs for d in compare_logs([m for m in ref_msgs if m.which() == service],
+                                                                 [m for m in msgs if m.which() == service],
+                                                                 MODELD_CFG.ignore, tolerance=MODELD_CFG.tolerance)]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Replay modeld on several segments at once, batching them in one ONNX session",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("segments", nargs="*", default=[f"{TEST_ROUTE}/{SEGMENT}"], help="segments as route/segment_num")
+  parser.add_argument("--max-frames", type=int, default=MAX_FRAMES)
+  parser.add_argument("--output-dir", default=".")
+  parser.add_argument("--compare", action="store_true", help="check every segment against a one segment model_replay")
+  args = parser.parse_args()
+
+  segments = [(s.rsplit('/', 1)[0], int(s.rsplit('/', 1)[1])) for s in args.segments]
+  failed = False
+  for (route, segment), (name, msgs) in zip(segments, model_replay_batch(segments, args.max_frames).items(), strict=True):
+    fn = os.path.join(args.output_dir, f"{name}_model_batch.bz2")
+    save_log(fn, msgs)
+    print(f"{name}: {len(msgs) // 2} frames, saved to {fn}")
+    if args.compare:
+      diff = compare_model_replay(route, segment, msgs, args.max_frames)
+      print(f"{name}: {len(diff)} differences from model_replay", *diff[:10], sep="\n  ")
+      failed |= len(diff) > 0
+
+  sys.exit(int(failed))
@@ -6,7 +6,7 @@ import json
 import heapq
 import signal
 import platform
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, deque
 from dataclasses import dataclass, field
 from typing import Any
 from collections.abc import Callable, Iterable
@@ -27,7 +27,8 @@ from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
-from openpilot.tools.lib.logreader import LogIterable
+from openpilot.selfdrive.test.process_replay.frame_prefetch import FramePrefetcher
+from openpilot.tools.lib.logreader import LogIterable, LogSummary, get_log_summary
 from openpilot.tools.lib.framereader import BaseFrameReader
 
 # Numpy gives different results based on CPU features after version 19
@@ -146,6 +147,22 @@ class ProcessConfig:
   unlocked_pubs: list[str] = field(default_factory=list)
 
 
+@dataclass
+class ReplayProfile:
+  """Where the time of a replay goes: scheduling messages in this process, or stepping each replayed process,
+  most of which is spent waiting for it to receive and publish"""
+  msg_count: int = 0
+  schedule_time: float = 0.
+  step_time: dict[str, float] = field(default_factory=dict)
+  wait_time: dict[str, float] = field(default_factory=dict)
+
+  def __str__(self) -> str:
+    lines = [f"{self.msg_count} messages, {self.schedule_time:.2f}s scheduling"]
+    for proc_name, step_time in sorted(self.step_time.items(), key=lambda x: -x[1]):
+      lines.append(f"  {proc_name:20s} {step_time:7.2f}s stepping, {self.wait_time[proc_name]:7.2f}s of it waiting on the process")
+    return "\n".join(lines)
+
+
 class ProcessContainer:
   def __init__(self, cfg: ProcessConfig):
     self.prefix = OpenpilotPrefix(clean_dirs_on_exit=False)
@@ -153,6 +170,7 @@ class ProcessContainer:
     self.process = copy.deepcopy(managed_processes[cfg.proc_name])
     self.msg_queue: list[capnp._DynamicStructReader] = []
     self.cnt = 0
+    self.wait_time = 0.
     self.pm: messaging.PubMaster | None = None
     self.sockets: list[messaging.SubSocket] | None = None
     self.rc: ReplayContext | None = None
@@ -203,7 +221,7 @@ class ProcessContainer:
 
     self.environ_config = environ_config
 
-  def _setup_vision_ipc(self, all_msgs: LogIterable, frs: dict[str, Any]):
+  def _setup_vision_ipc(self, all_msgs: LogIterable | LogSummary, frs: dict[str, Any]):
     assert len(self.cfg.vision_pubs) != 0
 
     vipc_server = VisionIpcServer("camerad")
@@ -226,7 +244,7 @@ class ProcessContainer:
   def start(
     self, params_config: dict[str, Any], environ_config: dict[str, Any],
     all_msgs: LogIterable, frs: dict[str, BaseFrameReader] | None,
-    fingerprint: str | None, capture_output: bool
+    fingerprint: str | None, capture_output: bool, summary: LogSummary | None = None
   ):
     with self.prefix as p:
       self._setup_env(params_config, environ_config)
@@ -243,7 +261,7 @@ class ProcessContainer:
 
       if len(self.cfg.vision_pubs) != 0:
         assert frs is not None
-        self._setup_vision_ipc(all_msgs, frs)
+        self._setup_vision_ipc(summary if summary is not None else all_msgs, frs)
         assert self.vipc_server is not None
 
       if capture_output:
@@ -267,7 +285,7 @@ class ProcessContainer:
       self.prefix.clean_dirs()
       self._clean_env()
 
-  def run_step(self, msg: capnp._DynamicStructReader, frs: dict[str, BaseFrameReader] | None) -> list[capnp._DynamicStructReader]:
+  def run_step(self, msg: capnp._DynamicStructReader, frames: FramePrefetcher | None) -> list[capnp._DynamicStructReader]:
     assert self.rc and self.pm and self.sockets and self.process.proc
 
     output_msgs = []
@@ -278,7 +296,9 @@ class ProcessContainer:
 
       self.msg_queue.append(msg)
       if end_of_cycle:
+        t = time.monotonic()
         self.rc.wait_for_recv_called()
+        self.wait_time += time.monotonic() - t
 
         # call recv to let sub-sockets reconnect, after we know the process is ready
         if self.cnt == 0:
@@ -296,14 +316,15 @@ class ProcessContainer:
           if self.vipc_server is not None and m.which() in self.cfg.vision_pubs:
             camera_state = getattr(m, m.which())
             camera_meta = meta_from_camera_state(m.which())
-            assert frs is not None
-            img = frs[m.which()].get(camera_state.frameId, pix_fmt="nv12")[0]
-            self.vipc_server.send(camera_meta.stream, img.flatten().tobytes(),
+            assert frames is not None
+            self.vipc_server.send(camera_meta.stream, frames.get(m.which(), camera_state.frameId),
                                   camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
         self.msg_queue = []
 
         self.rc.unlock_sockets()
+        t = time.monotonic()
         self.rc.wait_for_next_recv(trigger_empty_recv)
+        self.wait_time += time.monotonic() - t
 
         for socket in self.sockets:
           ms = messaging.drain_sock(socket)
@@ -599,36 +620,32 @@ def get_process_config(name: str) -> ProcessConfig:
     raise Exception(f"Cannot find process config with name: {name}") from ex
 
 
-def get_custom_params_from_lr(lr: LogIterable, initial_state: str = "first") -> dict[str, Any]:
+def get_custom_params_from_lr(lr: LogIterable | LogSummary, initial_state: str = "first") -> dict[str, Any]:
   """
   Use this to get custom params dict based on provided logs.
   Useful when replaying following processes: calibrationd, paramsd, torqued
   The params may be based on first or last message of given type (carParams, liveCalibration, liveParameters, liveTorqueParameters) in the logs.
   """
 
-  car_params = [m for m in lr if m.which() == "carParams"]
-  live_calibration = [m for m in lr if m.which() == "liveCalibration"]
-  live_parameters = [m for m in lr if m.which() == "liveParameters"]
-  live_torque_parameters = [m for m in lr if m.which() == "liveTorqueParameters"]
-
   assert initial_state in ["first", "last"]
-  msg_index = 0 if initial_state == "first" else -1
+  summary = get_log_summary(lr)
+  msgs = summary.first if initial_state == "first" else summary.last
 
-  assert len(car_params) > 0, "carParams required for initial state of liveParameters and CarParamsPrevRoute"
-  CP = car_params[msg_index].carParams
+  assert "carParams" in msgs, "carParams required for initial state of liveParameters and CarParamsPrevRoute"
+  CP = msgs["carParams"].carParams
 
   custom_params = {
     "CarParamsPrevRoute": CP.as_builder().to_bytes()
   }
 
-  if len(live_calibration) > 0:
-    custom_params["CalibrationParams"] = live_calibration[msg_index].as_builder().to_bytes()
-  if len(live_parameters) > 0:
-    lp_dict = live_parameters[msg_index].to_dict()
+  if "liveCalibration" in msgs:
+    custom_params["CalibrationParams"] = msgs["liveCalibration"].as_builder().to_bytes()
+  if "liveParameters" in msgs:
+    lp_dict = msgs["liveParameters"].to_dict()
     lp_dict["carFingerprint"] = CP.carFingerprint
     custom_params["LiveParameters"] = json.dumps(lp_dict)
-  if len(live_torque_parameters) > 0:
-    custom_params["LiveTorqueParameters"] = live_torque_parameters[msg_index].as_builder().to_bytes()
+  if "liveTorqueParameters" in msgs:
+    custom_params["LiveTorqueParameters"] = msgs["liveTorqueParameters"].as_builder().to_bytes()
 
   return custom_params
 
@@ -647,7 +664,7 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, BaseFrameReader] = None,
   fingerprint: str = None, return_all_logs: bool = False, custom_params: dict[str, Any] = None,
-  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False, profile: ReplayProfile = None
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
@@ -658,7 +675,7 @@ def replay_process(
                          manager_states=True,
                          panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, profile)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -674,14 +691,19 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, BaseFrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  profile: ReplayProfile | None = None
 ) -> list[capnp._DynamicStructReader]:
+  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  # the log is only scanned once for everything the setup needs to know about it
+  summary = get_log_summary(all_msgs)
+
   if fingerprint is not None:
-    params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
+    params_config = generate_params_config(lr=summary, fingerprint=fingerprint, custom_params=custom_params)
     env_config = generate_environ_config(fingerprint=fingerprint)
   else:
-    CP = next((m.carParams for m in lr if m.which() == "carParams"), None)
-    params_config = generate_params_config(lr=lr, CP=CP, custom_params=custom_params)
+    CP = summary.first["carParams"].carParams if "carParams" in summary else None
+    params_config = generate_params_config(lr=summary, CP=CP, custom_params=custom_params)
     env_config = generate_environ_config(CP=CP)
 
   # validate frs and vision pubs
@@ -690,48 +712,68 @@ def _replay_multi_process(
     assert frs is not None, "frs must be provided when replaying process using vision streams"
     assert all(meta_from_camera_state(st) is not None for st in all_vision_pubs), \
                                                           f"undefined vision stream spotted, probably misconfigured process: (vision pubs: {all_vision_pubs})"
-    required_vision_pubs = {m.camera_state for m in available_streams(lr)} & set(all_vision_pubs)
+    required_vision_pubs = {m.camera_state for m in available_streams(summary)} & set(all_vision_pubs)
     assert all(st in frs for st in required_vision_pubs), f"frs for this process must contain following vision streams: {required_vision_pubs}"
 
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
   log_msgs = []
+  frames = None
   try:
     containers = []
     for cfg in cfgs:
       container = ProcessContainer(cfg)
       containers.append(container)
-      container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
+      container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None, summary)
 
     all_pubs = {pub for container in containers for pub in container.pubs}
     all_subs = {sub for container in containers for sub in container.subs}
     lr_pubs = all_pubs - all_subs
-    pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
+    pubs_to_containers = {pub: tuple(container for container in containers if pub in container.pubs) for pub in all_pubs}
 
     pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: list[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: list[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: list[tuple[int, int]] = []
+    # frames are decoded in the background while the processes run
+    vision_pubs = {pub for container in containers for pub in container.cfg.vision_pubs}
+    if len(vision_pubs) != 0:
+      frames = FramePrefetcher(frs, pub_msgs, vision_pubs)
+    # messages taken from logs and messages generated by processes, which will be republished, are merged by logMonoTime.
+    # the heap is ordered by (logMonoTime, order of generation), so messages with the same time keep the order they were generated in
+    external_pub_queue: deque[capnp._DynamicStructReader] = deque(pub_msgs)
+    internal_pub_heap: list[tuple[int, int, capnp._DynamicStructReader]] = []
+    internal_pub_cnt = 0
+    # containers with messages queued until their next cycle, only those can still publish after the log runs out
+    pending_containers = 0
+    step_times = dict.fromkeys(containers, 0.)
 
     pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+    start_time = time.monotonic()
+    while len(external_pub_queue) != 0 or (len(internal_pub_heap) != 0 and pending_containers != 0):
+      if len(internal_pub_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_heap[0][0]):
+        msg = external_pub_queue.popleft()
         pbar.update(1)
       else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
-
-      target_containers = pubs_to_containers[msg.which()]
-      for container in target_containers:
-        output_msgs = container.run_step(msg, frs)
+        msg = heapq.heappop(internal_pub_heap)[2]
+
+      for container in pubs_to_containers[msg.which()]:
+        was_empty = container.has_empty_queue
+        t = time.monotonic()
+        output_msgs = container.run_step(msg, frames)
+        step_times[container] += time.monotonic() - t
+        pending_containers += was_empty - container.has_empty_queue
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            heapq.heappush(internal_pub_heap, (m.logMonoTime, internal_pub_cnt, m))
+            internal_pub_cnt += 1
         log_msgs.extend(output_msgs)
+
+    if profile is not None:
+      profile.msg_count += len(pub_msgs) + internal_pub_cnt
+      profile.schedule_time += time.monotonic() - start_time - sum(step_times.values())
+      for container, step_time in step_times.items():
+        proc_name = container.cfg.proc_name
+        profile.step_time[proc_name] = profile.step_time.get(proc_name, 0.) + step_time
+        profile.wait_time[proc_name] = profile.wait_time.get(proc_name, 0.) + container.wait_time
   finally:
+    if frames is not None:
+      frames.stop()
     for container in containers:
       container.stop()
       if captured_output_store is not None:
@@ -752,9 +794,9 @@ def generate_params_config(lr=None, CP=None, fingerprint=None, custom_params=Non
   if custom_params is not None:
     params_dict.update(custom_params)
   if lr is not None:
-    has_ublox = any(msg.which() == "ubloxGnss" for msg in lr)
-    params_dict["UbloxAvailable"] = has_ublox
-    is_rhd = next((msg.driverMonitoringState.isRHD for msg in lr if msg.which() == "driverMonitoringState"), False)
+    summary = get_log_summary(lr)
+    params_dict["UbloxAvailable"] = "ubloxGnss" in summary
+    is_rhd = summary.first["driverMonitoringState"].driverMonitoringState.isRHD if "driverMonitoringState" in summary else False
     params_dict["IsRhdDetected"] = is_rhd
 
   if CP is not None:
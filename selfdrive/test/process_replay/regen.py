@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import argparse
+import concurrent.futures
 import time
 import capnp
 import numpy as np
@@ -9,12 +10,13 @@ from typing import Any
 from collections.abc import Iterable
 
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, FAKEDATA, ProcessConfig, replay_process, get_process_config, \
-                                                                   check_openpilot_enabled, check_most_messages_valid, get_custom_params_from_lr
+                                                                   check_openpilot_enabled, check_most_messages_valid, get_custom_params_from_lr, ReplayProfile
 from openpilot.selfdrive.test.process_replay.vision_meta import DRIVER_CAMERA_FRAME_SIZES
 from openpilot.selfdrive.test.update_ci_routes import upload_route
+from openpilot.common.prefix import OpenpilotPrefix
 from openpilot.tools.lib.route import Route
 from openpilot.tools.lib.framereader import FrameReader, BaseFrameReader, FrameType
-from openpilot.tools.lib.logreader import LogReader, LogIterable
+from openpilot.tools.lib.logreader import LogReader, LogIterable, get_log_summary
 from openpilot.tools.lib.helpers import save_log
 
 
@@ -42,15 +44,20 @@ class DummyFrameReader(BaseFrameReader):
 
 def regen_segment(
   lr: LogIterable, frs: dict[str, Any] = None,
-  processes: Iterable[ProcessConfig] = CONFIGS, disable_tqdm: bool = False
+  processes: Iterable[ProcessConfig] = CONFIGS, disable_tqdm: bool = False,
+  custom_params: dict[str, Any] | None = None
 ) -> list[capnp._DynamicStructReader]:
   all_msgs = sorted(lr, key=lambda m: m.logMonoTime)
-  custom_params = get_custom_params_from_lr(all_msgs)
+  if custom_params is None:
+    custom_params = get_custom_params_from_lr(all_msgs)
 
   print("Replayed processes:", [p.proc_name for p in processes])
   print("\n\n", "*"*30, "\n\n", sep="")
 
-  output_logs = replay_process(processes, all_msgs, frs, return_all_logs=True, custom_params=custom_params, disable_progress=disable_tqdm)
+  profile = ReplayProfile()
+  output_logs = replay_process(processes, all_msgs, frs, return_all_logs=True, custom_params=custom_params, disable_progress=disable_tqdm,
+                               profile=profile)
+  print(profile)
 
   return output_logs
 
@@ -71,7 +78,7 @@ def setup_data_readers(
       if dummy_driver_cam:
         frs['driverCameraState'] = DummyFrameReader.zero_dcamera()
       elif len(r.dcamera_paths()) > sidx and r.dcamera_paths()[sidx] is not None:
-        device_type = next(str(msg.initData.deviceType) for msg in lr if msg.which() == "initData")
+        device_type = str(get_log_summary(lr).first["initData"].initData.deviceType)
         assert device_type != "neo", "Driver camera not supported on neo segments. Use dummy dcamera."
         frs['driverCameraState'] = FrameReader(r.dcamera_paths()[sidx])
   else:
@@ -79,13 +86,13 @@ def setup_data_readers(
     frs = {}
     if needs_road_cam:
       frs['roadCameraState'] = FrameReader(f"cd:/{route.replace('|', '/')}/{sidx}/fcamera.hevc")
-      if next((True for m in lr if m.which() == "wideRoadCameraState"), False):
+      if "wideRoadCameraState" in get_log_summary(lr):
         frs['wideRoadCameraState'] = FrameReader(f"cd:/{route.replace('|', '/')}/{sidx}/ecamera.hevc")
     if needs_driver_cam:
       if dummy_driver_cam:
         frs['driverCameraState'] = DummyFrameReader.zero_dcamera()
       else:
-        device_type = next(str(msg.initData.deviceType) for msg in lr if msg.which() == "initData")
+        device_type = str(get_log_summary(lr).first["initData"].initData.deviceType)
         assert device_type != "neo", "Driver camera not supported on neo segments. Use dummy dcamera."
         frs['driverCameraState'] = FrameReader(f"cd:/{route.replace('|', '/')}/{sidx}/dcamera.hevc")
 
@@ -94,7 +101,8 @@ def setup_data_readers(
 
 def regen_and_save(
   route: str, sidx: int, processes: str | Iterable[str] = "all", outdir: str = FAKEDATA,
-  upload: bool = False, use_route_meta: bool = False, disable_tqdm: bool = False, dummy_driver_cam: bool = False
+  upload: bool = False, use_route_meta: bool = False, disable_tqdm: bool = False, dummy_driver_cam: bool = False,
+  custom_params: dict[str, Any] | None = None, log_dir: str | None = None, check_output: bool = True
 ) -> str:
   if not isinstance(processes, str) and not hasattr(processes, "__iter__"):
     raise ValueError("whitelist_proc must be a string or iterable")
@@ -115,9 +123,10 @@ def regen_and_save(
                                needs_driver_cam="driverCameraState" in all_vision_pubs,
                                needs_road_cam="roadCameraState" in all_vision_pubs or "wideRoadCameraState" in all_vision_pubs,
                                dummy_driver_cam=dummy_driver_cam)
-  output_logs = regen_segment(lr, frs, replayed_processes, disable_tqdm=disable_tqdm)
+  output_logs = regen_segment(lr, frs, replayed_processes, disable_tqdm=disable_tqdm, custom_params=custom_params)
 
-  log_dir = os.path.join(outdir, time.strftime("%Y-%m-%d--%H-%M-%S--0", time.gmtime()))
+  if log_dir is None:
+    log_dir = os.path.join(outdir, time.strftime("%Y-%m-%d--%H-%M-%S--0", time.gmtime()))
   rel_log_dir = os.path.relpath(log_dir)
   rpath = os.path.join(log_dir, "rlog.bz2")
 
@@ -127,9 +136,9 @@ def regen_and_save(
   print("\n\n", "*"*30, "\n\n", sep="")
   print("New route:", rel_log_dir, "\n")
 
-  if not check_openpilot_enabled(output_logs):
+  if check_output and not check_openpilot_enabled(output_logs):
     raise Exception("Route did not engage for long enough")
-  if not check_most_messages_valid(output_logs):
+  if check_output and not check_most_messages_valid(output_logs):
     raise Exception("Route has too many invalid messages")
 
   if upload:
@@ -138,6 +147,27 @@ def regen_and_save(
   return rel_log_dir
 
 
+def regen_route_segment(route: str, sidx: int, log_dir: str, use_route_meta: bool, check_output: bool = True, **kwargs) -> str:
+  with OpenpilotPrefix():
+    # estimators start from where the previous segment of the source route left them
+    custom_params = None
+    if sidx > 0:
+      prev_lr, _ = setup_data_readers(route, sidx - 1, use_route_meta, needs_driver_cam=False, needs_road_cam=False)
+      custom_params = get_custom_params_from_lr(prev_lr, initial_state="last")
+    return regen_and_save(route, sidx, use_route_meta=use_route_meta, custom_params=custom_params, log_dir=log_dir, disable_tqdm=True,
+                          check_output=check_output, **kwargs)
+
+
+def regen_route(route: str, segments: Iterable[int], jobs: int = 1, outdir: str = FAKEDATA, use_route_meta: bool = False, **kwargs) -> str:
+  """Regenerates segments of a route as the same segments of a new route, each one in its own process"""
+  route_dir = os.path.join(outdir, time.strftime("%Y-%m-%d--%H-%M-%S", time.gmtime()))
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+    futures = [pool.submit(regen_route_segment, route, sidx, f"{route_dir}--{sidx}", use_route_meta, **kwargs) for sidx in segments]
+    for future in concurrent.futures.as_completed(futures):
+      print("New segment:", future.result())
+  return os.path.relpath(route_dir)
+
+
 if __name__ == "__main__":
   def comma_separated_list(string):
     return string.split(",")
@@ -151,10 +181,18 @@ if __name__ == "__main__":
                       help="Comma-separated whitelist of processes to regen (e.g. controlsd,radard)")
   parser.add_argument("--blacklist-procs", type=comma_separated_list, default=[],
                       help="Comma-separated blacklist of processes to regen (e.g. controlsd,radard)")
+  parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of segments regenerated in parallel")
+  parser.add_argument("--no-check", action="store_true", help="Don't check that the new segments engage and have mostly valid messages")
   parser.add_argument("route", type=str, help="The source route")
-  parser.add_argument("seg", type=int, help="Segment in source route")
+  parser.add_argument("seg", type=str, help="Segment in source route, or a start:end range of segments regenerated as a new route")
   args = parser.parse_args()
 
   blacklist_set = set(args.blacklist_procs)
   processes = [p for p in args.whitelist_procs if p not in blacklist_set]
-  regen_and_save(args.route, args.seg, processes=processes, upload=args.upload, outdir=args.outdir, dummy_driver_cam=args.dummy_dcamera)
+  if ":" in args.seg:
+    start, end = (int(i) for i in args.seg.split(":"))
+    regen_route(args.route, range(start, end), jobs=args.jobs, processes=processes, upload=args.upload, outdir=args.outdir,
+                dummy_driver_cam=args.dummy_dcamera, check_output=not args.no_check)
+  else:
+    regen_and_save(args.route, int(args.seg), processes=processes, upload=args.upload, outdir=args.outdir, dummy_driver_cam=args.dummy_dcamera,
+                   check_output=not args.no_check)
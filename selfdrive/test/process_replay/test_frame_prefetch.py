@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.test.process_replay.frame_prefetch import FramePrefetcher
+
+
+class FakeFrameReader:
+  w, h = 8, 4
+
+  def get(self, num, count=1, pix_fmt="yuv420p"):
+    assert pix_fmt == "nv12"
+    if num >= 20:
+      raise ValueError(f"{num + count} > 20")
+    return [np.full((self.h * 3 // 2, self.w), num, dtype=np.uint8)]
+
+
+def camera_msgs(camera_state, frame_ids):
+  msgs = []
+  for frame_id in frame_ids:
+    msg = messaging.new_message(camera_state)
+    getattr(msg, camera_state).frameId = frame_id
+    msgs.append(msg.as_reader())
+  return msgs
+
+
+class TestFramePrefetch:
+  def test_frames_in_order(self):
+    msgs = camera_msgs('roadCameraState', range(10)) + camera_msgs('driverCameraState', [3, 3, 4])
+    frames = FramePrefetcher({'roadCameraState': FakeFrameReader(), 'driverCameraState': FakeFrameReader()}, msgs,
+                             ['roadCameraState', 'driverCameraState'], prefetch_frames=2)
+    try:
+      for frame_id in range(10):
+        img = frames.get('roadCameraState', frame_id)
+        assert img.shape == (8 * 4 * 3 // 2,) and img.flags.c_contiguous and np.all(img == frame_id)
+        # other processes replaying the same camera get the frame again
+        assert frames.get('roadCameraState', frame_id) is img
+      assert np.all(frames.get('driverCameraState', 3) == 3)
+      assert np.all(frames.get('driverCameraState', 4) == 4)
+    finally:
+      frames.stop()
+
+  def test_decode_error(self):
+    frames = FramePrefetcher({'roadCameraState': FakeFrameReader()}, camera_msgs('roadCameraState', [19, 20, 21]), ['roadCameraState'])
+    try:
+      frames.get('roadCameraState', 19)
+      with pytest.raises(ValueError):
+        frames.get('roadCameraState', 20)
+    finally:
+      frames.stop()
+
+  def test_stop_with_frames_left(self):
+    frames = FramePrefetcher({'roadCameraState': FakeFrameReader()}, camera_msgs('roadCameraState', range(20)), ['roadCameraState'], prefetch_frames=1)
+    frames.get('roadCameraState', 0)
+    frames.stop()
+    assert not any(thread.is_alive() for thread in frames.threads)
@@ -2,6 +2,7 @@ from collections import namedtuple
 from msgq.visionipc import VisionStreamType
 from openpilot.common.realtime import DT_MDL, DT_DMON
 from openpilot.common.transformations.camera import DEVICE_CAMERAS
+from openpilot.tools.lib.logreader import LogIterable, LogSummary, get_log_summary
 
 VideoStreamMeta = namedtuple("VideoStreamMeta", ["camera_state", "encode_index", "stream", "dt", "frame_sizes"])
 ROAD_CAMERA_FRAME_SIZES = {k: (v.dcam.width, v.dcam.height) for k, v in DEVICE_CAMERAS.items()}
@@ -30,14 +31,9 @@ def meta_from_stream_type(stream_type):
   return meta
 
 
-def available_streams(lr=None):
+def available_streams(lr: LogIterable | LogSummary | None = None):
   if lr is None:
     return [VideoStreamMeta(*meta) for meta in VIPC_STREAM_METADATA]
 
-  result = []
-  for meta in VIPC_STREAM_METADATA:
-    has_cam_state = next((True for m in lr if m.which() == meta[0]), False)
-    if has_cam_state:
-      result.append(VideoStreamMeta(*meta))
-
-  return result
+  summary = get_log_summary(lr)
+  return [VideoStreamMeta(*meta) for meta in VIPC_STREAM_METADATA if meta[0] in summary]
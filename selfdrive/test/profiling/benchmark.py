@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# controlsd and card check this on import
+os.environ['REPLAY'] = "1"
+
+import cereal.messaging as messaging
+from openpilot.common.params import Params
+from openpilot.selfdrive.car.car_helpers import interfaces
+from openpilot.selfdrive.car.card import Car
+from openpilot.selfdrive.controls.controlsd import Controls
+from openpilot.selfdrive.test.profiling.lib import BASE_URL, CARS, summarize
+from openpilot.tools.lib.logreader import LogReader
+
+PROCS = {
+  'controlsd': (Controls, 'carState', ['data_sample', 'update_events', 'state_transition', 'state_control', 'publish_logs']),
+  'card': (Car, 'can', ['state_update', 'update_events', 'state_publish', 'controls_update']),
+}
+
+
+class ReplaySocket:
+  """Stands in for a msgq socket, receive returns the queued messages and then None"""
+  def __init__(self):
+    self.queue: deque[bytes] = deque()
+
+  def receive(self, non_blocking=False):
+    return self.queue.popleft() if len(self.queue) else None
+
+  def send(self, dat):
+    pass
+
+
+class NullPubMaster(messaging.PubMaster):
+  def __init__(self):
+    super().__init__([])
+    self.sock = defaultdict(ReplaySocket)
+    self.first_segment_words = defaultdict(lambda: messaging.FIRST_SEGMENT_WORDS)
+
+  def send(self, s, dat):
+    # keep the serialization cost of publishing
+    if not isinstance(dat, bytes):
+      dat.to_bytes()
+
+
+class StageTimer:
+  def __init__(self, obj, stages):
+    self.times = {}
+    for stage in stages:
+      self.times[stage] = []
+      setattr(obj, stage, self._timed(getattr(obj, stage), self.times[stage]))
+
+  @staticmethod
+  def _timed(func, times):
+    def wrapper(*args, **kwargs):
+      t = time.perf_counter()
+      ret = func(*args, **kwargs)
+      times.append(time.perf_counter() - t)
+      return ret
+    return wrapper
+
+
+class GCMonitor:
+  def __init__(self):
+    self.pauses = []
+    self.start_time = 0.
+
+  def __call__(self, phase, info):
+    if phase == "start":
+      self.start_time = time.perf_counter()
+    else:
+      self.pauses.append(time.perf_counter() - self.start_time)
+
+  def __enter__(self):
+    gc.callbacks.append(self)
+    return self
+
+  def __exit__(self, *args):
+    gc.callbacks.remove(self)
+
+
+def get_steps(msgs, trigger, services):
+  # one step per trigger message, with the other inputs logged since the previous one
+  steps = []
+  pending = []
+  for msg in msgs:
+    which = msg.which()
+    if which == trigger:
+      steps.append((msg.logMonoTime, msg.as_builder().to_bytes(), pending))
+      pending = []
+    elif which in services:
+      pending.append(msg)
+  return steps
+
+
+def benchmark_process(proc_name, msgs, fingerprint, warmup):
+  proc_cls, trigger, stages = PROCS[proc_name]
+
+  CarInterface, CarController, CarState = interfaces[fingerprint]
+  CP = CarInterface.get_non_essential_params(fingerprint)
+  Params().put("CarParams", CP.to_bytes())
+  proc = proc_cls(CI=CarInterface(CP, CarController, CarState))
+
+  # replace sockets so the process is driven by the log, as fast as it can run
+  trigger_sock = ReplaySocket()
+  if proc_name == 'controlsd':
+    proc.car_state_sock = trigger_sock
+    proc.log_sock = ReplaySocket()
+  else:
+    proc.can_sock = trigger_sock
+  proc.pm = NullPubMaster()
+
+  sm = proc.sm
+  cur: dict = {}
+  sm.update = lambda timeout=0: sm.update_msgs(cur['time'], cur['msgs'])
+
+  steps = get_steps(msgs, trigger, set(sm.data.keys()))
+  timer = StageTimer(proc, stages)
+  step_times = []
+  allocated_blocks = []
+  with GCMonitor() as gc_monitor:
+    for i, (log_mono_time, dat, pending) in enumerate(steps):
+      if i == warmup:
+        for times in timer.times.values():
+          times.clear()
+        gc_monitor.pauses.clear()
+
+      cur['time'] = log_mono_time / 1e9
+      cur['msgs'] = pending
+      trigger_sock.queue.append(dat)
+
+      blocks = sys.getallocatedblocks()
+      t = time.perf_counter()
+      proc.step()
+      if i >= warmup:
+        step_times.append(time.perf_counter() - t)
+        allocated_blocks.append(sys.getallocatedblocks() - blocks)
+
+  return {
+    'steps': len(step_times),
+    'stages': {'step': summarize(step_times)} | {stage: summarize(times) for stage, times in timer.times.items()},
+    'allocated_blocks_per_step': float(np.mean(allocated_blocks)) if len(allocated_blocks) else 0.,
+    'gc': {'collections': len(gc_monitor.pauses), 'total_ms': sum(gc_monitor.pauses) * 1e3,
+           'max_ms': max(gc_monitor.pauses, default=0.) * 1e3},
+  }
+
+
+def compare(results, baseline, tolerance):
+  regressions = []
+  for car_name, procs in results.items():
+    for proc_name, result in procs.items():
+      base = baseline.get(car_name, {}).get(proc_name)
+      if base is None:
+        continue
+
+      for stage, stats in result['stages'].items():
+        base_stats = base['stages'].get(stage, {})
+        if 'p99' in stats and 'p99' in base_stats and stats['p99'] > base_stats['p99'] * (1 + tolerance):
+          regressions.append(f"{car_name} {proc_name} {stage}: p99 {stats['p99']:.3f} ms, baseline {base_stats['p99']:.3f} ms")
+  return regressions
+
+
+def print_results(results):
+  for car_name, procs in results.items():
+    for proc_name, result in procs.items():
+      gc_stats = result['gc']
+      print(f"{car_name} {proc_name}: {result['steps']} steps, {result['allocated_blocks_per_step']:.1f} allocated blocks/step")
+      print(f"  gc: {gc_stats['collections']} collections, {gc_stats['total_ms']:.1f} ms total, {gc_stats['max_ms']:.2f} ms max")
+      for stage, stats in result['stages'].items():
+        if stats['count']:
+          print(f"  {stage:20s} p50 {stats['p50']:7.3f} ms  p99 {stats['p99']:7.3f} ms  max {stats['max']:7.3f} ms")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the controlsd and card loops per stage, replaying logs without realtime pacing",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--cars", nargs="+", default=list(CARS.keys()), choices=list(CARS.keys()))
+  parser.add_argument("--procs", nargs="+", default=list(PROCS.keys()), choices=list(PROCS.keys()))
+  parser.add_argument("--loop", type=int, default=1, help="number of times to replay each segment")
+  parser.add_argument("--warmup", type=int, default=100, help="number of steps excluded from the results")
+  parser.add_argument("--output", help="write the results as JSON to this file")
+  parser.add_argument("--baseline", help="JSON results to compare against, exits with 1 on regressions")
+  parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p99 increase over the baseline")
+  args = parser.parse_args()
+
+  results: dict = {}
+  for car_name in args.cars:
+    segment, fingerprint = CARS[car_name]
+    msgs = list(LogReader(f"{BASE_URL}{segment.replace('|', '/')}/rlog.bz2")) * args.loop
+    results[car_name] = {proc_name: benchmark_process(proc_name, msgs, fingerprint, args.warmup) for proc_name in args.procs}
+
+  print_results(results)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+    for r in regressions:
+      print("REGRESSION:", r)
+    sys.exit(1 if len(regressions) else 0)
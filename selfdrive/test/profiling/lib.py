@@ -2,6 +2,44 @@ from collections import defaultdict, deque
 from cereal.services import SERVICE_LIST
 import cereal.messaging as messaging
 import capnp
+import numpy as np
+
+from openpilot.selfdrive.car.body.values import CAR as COMMA
+from openpilot.selfdrive.car.chrysler.values import CAR as CHRYSLER
+from openpilot.selfdrive.car.ford.values import CAR as FORD
+from openpilot.selfdrive.car.gm.values import CAR as GM
+from openpilot.selfdrive.car.honda.values import CAR as HONDA
+from openpilot.selfdrive.car.hyundai.values import CAR as HYUNDAI
+from openpilot.selfdrive.car.mazda.values import CAR as MAZDA
+from openpilot.selfdrive.car.nissan.values import CAR as NISSAN
+from openpilot.selfdrive.car.subaru.values import CAR as SUBARU
+from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
+from openpilot.selfdrive.car.volkswagen.values import CAR as VW
+
+BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
+
+CARS = {
+  'toyota': ("0982d79ebb0de295|2021-01-03--20-03-36/6", TOYOTA.TOYOTA_RAV4),
+  'honda': ("0982d79ebb0de295|2021-01-08--10-13-10/6", HONDA.HONDA_CIVIC),
+  "vw": ("ef895f46af5fd73f|2021-05-22--14-06-35/6", VW.AUDI_A3_MK3),
+  # one process replay source segment for each of the other brands, tesla is dashcam only
+  'body': ("937ccb7243511b65|2022-05-24--16-03-09/1", COMMA.COMMA_BODY),
+  'hyundai': ("02c45f73a2e5c6e9|2021-01-01--19-08-22/1", HYUNDAI.HYUNDAI_SONATA),
+  'chrysler': ("4deb27de11bee626|2021-02-20--11-28-55/8", CHRYSLER.CHRYSLER_PACIFICA_2018_HYBRID),
+  'subaru': ("341dccd5359e3c97|2022-09-12--10-35-33/3", SUBARU.SUBARU_OUTBACK),
+  'gm': ("0c58b6a25109da2b|2021-02-23--16-35-50/11", GM.CHEVROLET_VOLT),
+  'nissan': ("35336926920f3571|2021-02-12--18-38-48/46", NISSAN.NISSAN_XTRAIL),
+  'mazda': ("bd6a637565e91581|2021-10-30--15-14-53/4", MAZDA.MAZDA_CX9_2021),
+  'ford': ("54827bf84c38b14f|2023-01-26--21-59-07/4", FORD.FORD_BRONCO_SPORT_MK1),
+}
+
+
+def summarize(times):
+  ms = np.array(times) * 1e3
+  if len(ms) == 0:
+    return {'count': 0}
+  return {'count': len(ms), 'mean': float(np.mean(ms)), 'p50': float(np.percentile(ms, 50)),
+          'p99': float(np.percentile(ms, 99)), 'max': float(np.max(ms))}
 
 
 class ReplayDone(Exception):
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import time
+
+import numpy as np
+
+from openpilot.selfdrive.controls.lib.drive_helpers import CAR_ROTATION_RADIUS, MIN_SPEED
+from openpilot.selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import LateralMpc, T_IDXS as LAT_T_IDXS
+from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import MODES
+from openpilot.selfdrive.controls.lib.longitudinal_planner import LongitudinalPlanner
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.test.profiling.lib import BASE_URL, CARS, summarize
+from openpilot.tools.lib.logreader import LogReader
+
+SERVICES = ['carState', 'controlsState', 'radarState', 'modelV2']
+
+
+def get_frames(msgs):
+  # the latest inputs of plannerd at every modelV2
+  CP = None
+  sm = {}
+  frames = []
+  for msg in msgs:
+    which = msg.which()
+    if which == 'carParams':
+      CP = msg.carParams
+    elif which in SERVICES:
+      sm[which] = getattr(msg, which)
+      if which == 'modelV2' and len(sm) == len(SERVICES):
+        frames.append(dict(sm))
+  assert CP is not None, "no carParams in log"
+  return CP, frames
+
+
+def timed(func, times):
+  def wrapper(*args, **kwargs):
+    t = time.perf_counter()
+    ret = func(*args, **kwargs)
+    times.append(time.perf_counter() - t)
+    return ret
+  return wrapper
+
+
+def benchmark_long_mpc(CP, frames, mode, warm_start, warmup):
+  planner = LongitudinalPlanner(CP, collect_mpc_stats=True)
+  planner.mpc.warm_start = warm_start
+  times: list[float] = []
+  planner.mpc.run = timed(planner.mpc.run, times)
+
+  # force the planner mode, it's picked from controlsState
+  controls_states = []
+  for frame in frames:
+    cs = frame['controlsState'].as_builder()
+    cs.experimentalMode = mode == 'blended'
+    controls_states.append(cs)
+
+  for i, (frame, cs) in enumerate(zip(frames, controls_states, strict=True)):
+    if i == warmup:
+      times.clear()
+      planner.mpc.stats[mode].clear()
+    planner.update(frame | {'controlsState': cs})
+  return {'run': summarize(times), 'solver': planner.mpc.stats[mode].to_dict()}
+
+
+def benchmark_lat_mpc(frames, warm_start, warmup):
+  lat_mpc = LateralMpc(warm_start=warm_start, collect_stats=True)
+  lat_mpc.set_weights(1., .1, 0.0, .05, 800)
+  times: list[float] = []
+  lat_mpc.run = timed(lat_mpc.run, times)
+
+  for i, frame in enumerate(frames):
+    if i == warmup:
+      times.clear()
+      lat_mpc.stats.clear()
+
+    model = frame['modelV2']
+    if len(model.position.y) != ModelConstants.IDX_N:
+      continue
+    v_ego = max(MIN_SPEED, frame['carState'].vEgo)
+    y_pts = np.interp(LAT_T_IDXS, ModelConstants.T_IDXS, model.position.y)
+    heading_pts = np.interp(LAT_T_IDXS, ModelConstants.T_IDXS, model.orientation.z)
+    yaw_rate_pts = np.interp(LAT_T_IDXS, ModelConstants.T_IDXS, model.orientationRate.z)
+    x0 = np.array([0., 0., 0., yaw_rate_pts[0]])
+    p = np.column_stack([v_ego * np.ones(len(LAT_T_IDXS)), CAR_ROTATION_RADIUS * np.ones(len(LAT_T_IDXS))])
+    lat_mpc.run(x0, p, y_pts, heading_pts, yaw_rate_pts)
+  return {'run': summarize(times), 'solver': lat_mpc.stats.to_dict()}
+
+
+def print_results(results):
+  for car_name, mpcs in results.items():
+    for name, result in mpcs.items():
+      run, solver = result['run'], result['solver']
+      if run['count'] == 0:
+        continue
+      print(f"{car_name} {name:24s} {run['count']} solves, p50 {run['p50']:6.3f} ms  p99 {run['p99']:6.3f} ms  max {run['max']:6.3f} ms")
+      print(f"  solver p99 {solver['solve_time_p99_ms']:6.3f} ms  qp iter {solver['qp_iter_mean']:.2f}  resets {solver['resets']}")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the longitudinal and lateral MPC solves, replaying logged radarState and modelV2",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--cars", nargs="+", default=list(CARS.keys()), choices=list(CARS.keys()))
+  parser.add_argument("--warmup", type=int, default=20, help="number of model frames excluded from the results")
+  parser.add_argument("--output", help="write the results as JSON to this file")
+  args = parser.parse_args()
+
+  results: dict = {}
+  for car_name in args.cars:
+    segment, _ = CARS[car_name]
+    CP, frames = get_frames(LogReader(f"{BASE_URL}{segment.replace('|', '/')}/rlog.bz2"))
+    results[car_name] = {}
+    for warm_start in (False, True):
+      suffix = " warm start" if warm_start else ""
+      for mode in MODES:
+        results[car_name][f"long {mode}{suffix}"] = benchmark_long_mpc(CP, frames, mode, warm_start, args.warmup)
+      results[car_name][f"lat{suffix}"] = benchmark_lat_mpc(frames, warm_start, args.warmup)
+
+  print_results(results)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
@@ -7,19 +7,8 @@ import pyprof2calltree
 
 from openpilot.common.params import Params
 from openpilot.tools.lib.logreader import LogReader
-from openpilot.selfdrive.test.profiling.lib import SubMaster, PubMaster, SubSocket, ReplayDone
+from openpilot.selfdrive.test.profiling.lib import BASE_URL, CARS, SubMaster, PubMaster, SubSocket, ReplayDone
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS
-from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
-from openpilot.selfdrive.car.honda.values import CAR as HONDA
-from openpilot.selfdrive.car.volkswagen.values import CAR as VW
-
-BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
-
-CARS = {
-  'toyota': ("0982d79ebb0de295|2021-01-03--20-03-36/6", TOYOTA.TOYOTA_RAV4),
-  'honda': ("0982d79ebb0de295|2021-01-08--10-13-10/6", HONDA.HONDA_CIVIC),
-  "vw": ("ef895f46af5fd73f|2021-05-22--14-06-35/6", VW.AUDI_A3_MK3),
-}
 
 
 def get_inputs(msgs, process, fingerprint):
@@ -1,3 +1,4 @@
+import gc
 import importlib
 import os
 import signal
@@ -21,10 +22,12 @@ WATCHDOG_FN = "/dev/shm/wd_"
 ENABLE_WATCHDOG = os.getenv("NO_WATCHDOG") is None
 
 
-def launcher(proc: str, name: str) -> None:
+def launcher(proc: str, name: str, start_time: float | None = None) -> None:
   try:
-    # import the process
+    # import the process, this is a no-op if the manager preimported it before forking
+    t = time.monotonic()
     mod = importlib.import_module(proc)
+    import_time = time.monotonic() - t
 
     # rename the process
     setthreadname(proc)
@@ -36,6 +39,10 @@ def launcher(proc: str, name: str) -> None:
     cloudlog.bind(daemon=name)
     sentry.set_tag("daemon", name)
 
+    if start_time is not None:
+      cloudlog.event("process_startup", fork_time=t - start_time, import_time=import_time,
+                     startup_time=time.monotonic() - start_time)
+
     # exec the process
     mod.main()
   except KeyboardInterrupt:
@@ -55,6 +62,14 @@ def nativelauncher(pargs: list[str], cwd: str, name: str) -> None:
   os.execvp(pargs[0], pargs)
 
 
+def freeze_preimported() -> None:
+  # Move everything imported so far into the permanent GC generation. Python processes are
+  # forked from the manager, so this keeps their garbage collector from touching (and copying)
+  # the pages holding the preimported modules, which then stay shared between all processes.
+  gc.collect()
+  gc.freeze()
+
+
 def join_process(process: Process, timeout: float) -> None:
   # Process().join(timeout) will hang due to a python 3 bug: https://bugs.python.org/issue28382
   # We have to poll the exitcode instead
@@ -221,7 +236,7 @@ class PythonProcess(ManagerProcess):
       return
 
     cloudlog.info(f"starting python {self.module}")
-    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name))
+    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name, time.monotonic()))
     self.proc.start()
     self.watchdog_seen = False
     self.shutting_down = False
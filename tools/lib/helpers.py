@@ -1,5 +1,8 @@
 import bz2
+from concurrent.futures import ThreadPoolExecutor
 
+# uncompressed size of the chunks save_log serializes and compresses at a time
+SAVE_LOG_CHUNK_SIZE = 16 * 1024 * 1024
 
 # regex patterns
 class RE:
@@ -20,11 +23,38 @@ class RE:
   OP_SEGMENT_DIR = fr'^(?P<segment_name>{SEGMENT_NAME})$'
 
 
-def save_log(dest, log_msgs, compress=True):
-  dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
+def iter_log_chunks(log_msgs, chunk_size):
+  chunk: list[bytes] = []
+  size = 0
+  for msg in log_msgs:
+    chunk.append(msg.as_builder().to_bytes())
+    size += len(chunk[-1])
+    if size >= chunk_size:
+      yield b"".join(chunk)
+      chunk, size = [], 0
+  if len(chunk):
+    yield b"".join(chunk)
+
 
-  if compress:
-    dat = bz2.compress(dat)
+def save_log(dest, log_msgs, compress=True):
+  """Writes the messages as they come, without joining the whole log first.
 
+  With compress, the log is one bz2 stream: replay's decompressBZ2 stops at the first stream end, so concatenated
+  streams would be cut short there. Each chunk is compressed on a worker thread while the next one is serialized."""
   with open(dest, "wb") as f:
-    f.write(dat)
+    if not compress:
+      for chunk in iter_log_chunks(log_msgs, SAVE_LOG_CHUNK_SIZE):
+        f.write(chunk)
+      return
+
+    compressor = bz2.BZ2Compressor()
+    # a single worker feeds the shared compressor in order
+    with ThreadPoolExecutor(max_workers=1) as pool:
+      pending = None
+      for chunk in iter_log_chunks(log_msgs, SAVE_LOG_CHUNK_SIZE):
+        if pending is not None:
+          f.write(pending.result())
+        pending = pool.submit(compressor.compress, chunk)
+      if pending is not None:
+        f.write(pending.result())
+    f.write(compressor.flush())
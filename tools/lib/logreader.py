@@ -230,6 +230,36 @@ def parse_indirect(identifier: str):
   return identifier, None, False
 
 
+class LogSummary:
+  """Services in a log with their message counts, and the first and last message of each, from a single pass over it"""
+  def __init__(self, lr: LogIterable):
+    self.counts: dict[str, int] = {}
+    self.first: dict[str, LogMessage] = {}
+    self.last: dict[str, LogMessage] = {}
+    for msg in lr:
+      which = msg.which()
+      if which not in self.counts:
+        self.counts[which] = 0
+        self.first[which] = msg
+      self.counts[which] += 1
+      self.last[which] = msg
+
+  def __contains__(self, which: str) -> bool:
+    return which in self.counts
+
+
+def get_log_summary(lr: LogIterable | LogSummary) -> LogSummary:
+  """The summary of a log. A LogReader keeps its summary, so it is only scanned once, other logs are scanned
+  on every call: pass their summary around instead. A summary is returned as is."""
+  if isinstance(lr, LogSummary):
+    return lr
+  if isinstance(lr, LogReader):
+    if lr._log_summary is None:
+      lr._log_summary = LogSummary(lr)
+    return lr._log_summary
+  return LogSummary(lr)
+
+
 class LogReader:
   def _parse_identifiers(self, identifier: str | list[str]):
     if isinstance(identifier, list):
@@ -287,6 +317,7 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
 
   def reset(self):
     self.logreader_identifiers = self._parse_identifiers(self.identifier)
+    self._log_summary: LogSummary | None = None
 
   @staticmethod
   def from_bytes(dat):
@@ -1,3 +1,4 @@
+import bz2
 import capnp
 import contextlib
 import io
@@ -10,7 +11,9 @@ import requests
 from parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException
+from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, get_log_summary, parse_indirect, ReadMode, \
+                                           InternalUnavailableException
+from openpilot.tools.lib.helpers import save_log
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -249,3 +252,48 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  def test_log_summary(self):
+    services = ["carParams", "carState", "carState", "initData", "carState"]
+    msgs = [capnp_log.Event.new_message(**{s: {}}, logMonoTime=i).as_reader() for i, s in enumerate(services)]
+
+    summary = get_log_summary(msgs)
+    assert summary.counts == {"carParams": 1, "carState": 3, "initData": 1}
+    assert summary.first["carState"].logMonoTime == 1 and summary.last["carState"].logMonoTime == 4
+    assert "initData" in summary and "roadCameraState" not in summary
+    assert get_log_summary(summary) is summary
+
+    # lists aren't cached, a changed list gets a new summary
+    msgs.append(capnp_log.Event.new_message(roadCameraState={}).as_reader())
+    assert "roadCameraState" in get_log_summary(msgs)
+
+    # a LogReader keeps its summary until it is reset
+    with tempfile.NamedTemporaryFile() as qlog:
+      with open(qlog.name, "wb") as f:
+        f.write(b"".join(m.as_builder().to_bytes() for m in msgs))
+      lr = LogReader(qlog.name)
+      summary = get_log_summary(lr)
+      assert summary.counts == {"carParams": 1, "carState": 3, "initData": 1, "roadCameraState": 1}
+      assert get_log_summary(lr) is summary
+      lr.reset()
+      assert get_log_summary(lr) is not summary
+
+  @pytest.mark.parametrize("compress", [True, False])
+  def test_save_log_round_trip(self, mocker, compress):
+    # small chunks, so the log is serialized and compressed over many of them
+    mocker.patch("openpilot.tools.lib.helpers.SAVE_LOG_CHUNK_SIZE", 1024)
+    msgs = [capnp_log.Event.new_message(logMonoTime=i, carState={"vEgo": i}).as_reader() for i in range(500)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, "rlog.bz2" if compress else "rlog")
+      save_log(fn, msgs, compress=compress)
+      if compress:
+        # one stream, so readers that stop at the first stream end (replay's decompressBZ2) see the whole log
+        decompressor = bz2.BZ2Decompressor()
+        with open(fn, "rb") as f:
+          data = decompressor.decompress(f.read())
+        assert decompressor.eof and decompressor.unused_data == b""
+        assert data == b"".join(m.as_builder().to_bytes() for m in msgs)
+
+      read_msgs = list(LogReader(fn))
+      assert [m.as_builder().to_bytes() for m in read_msgs] == [m.as_builder().to_bytes() for m in msgs]